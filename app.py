@@ -1,16 +1,26 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, make_response, Response
 from pathlib import Path
 import uuid, os, json
 import logging
 import shutil
 import time      # <-- Import time
-import threading # <-- Import threading
-import random    # <-- Import random for zone selection
-from llm_service import LLMService
+import threading
+import functools
+import ipaddress
+import math
+from llm_service import get_llm_service
 # ... (existing imports like agent_do_analysis, read_block) ...
 from core.agent import agent_do_analysis
 from core.blocks import read_block
-import asyncio
+from core.state_store import get_board_state, VersionConflict, DEFAULT_FINISH_ZONES, INITIAL_AGENT_X, INITIAL_AGENT_Y
+from core.locks import LockTimeout
+from core.assignment import ZoneAssigner, min_cost_assignment
+from core.jobs import JobScheduler, QueueFull, JobCancelled, LeaseLost, LEASE_SECONDS, new_job_id
+from core.lifecycle import AgentLifecycle
+from core.priority import DurationEstimator, block_priority, block_schedule_key, parse_deadline, task_size
+from core.workspace import pack_workspace, unpack_workspace, workspace_paths
+from core.dead_letters import DeadLetterQueue, RETRY_STAGGER
+from core.checkpoints import checkpoint_summary
 import re
 
 from developer_agent import perform_agent_work_and_move
@@ -26,55 +36,208 @@ LAYOUT_DIR = BASE_OUTPUT / "layout"
 LAYOUT_DIR.mkdir(parents=True, exist_ok=True)
 ZONES_FILE = LAYOUT_DIR / "zones.json"
 
-INITIAL_AGENT_X = 50
-INITIAL_AGENT_Y = 50
-
-# --- Define Finish Zones (Example Coordinates) ---
-# Store as a list of dictionaries. Add more zones as needed.
-DEFAULT_FINISH_ZONES = [
-    {"id": "finish-zone-1", "x": 50,  "y": 50, "width": 100, "height": 100, "label": "Zone 1"},
-    {"id": "finish-zone-2", "x": 200, "y": 50, "width": 100, "height": 100, "label": "Zone 2"},
-    {"id": "finish-zone-3", "x": 350, "y": 50, "width": 100, "height": 100, "label": "Zone 3"},
-    {"id": "finish-zone-4", "x": 500, "y": 50, "width": 100, "height": 100, "label": "Zone 4"},
-    {"id": "finish-zone-5", "x": 650, "y": 50, "width": 100, "height": 100, "label": "Zone 5"},
-    {"id": "finish-zone-6", "x": 800, "y": 50, "width": 100, "height": 100, "label": "Zone 6"},
-]
-# --- ---
-
 app = Flask(__name__)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-llm_service = LLMService()
-
-# --- Helper Functions for Zone Layout ---
-def load_zone_positions():
-    """Loads zone positions from the JSON file or returns defaults."""
-    if ZONES_FILE.exists():
+llm_service = get_llm_service()
+# In-memory board (agents, blocks, zones); loaded once, persisted in the background
+board_state = get_board_state()
+
+# Finish / drop-off zones for completing agents, assigned in short batches (no two agents get one slot)
+zone_assigner = ZoneAssigner(board_state)
+
+# Seconds a request waits for an agent's lock before answering 409
+AGENT_LOCK_TIMEOUT = 10
+# Seconds DELETE /agents/<id> waits, in all, for the agent's cancelled jobs to stop before removing its workspace
+AGENT_DELETE_JOB_WAIT = 15
+
+# --- Background Jobs ---
+# Developer and QA pipelines run on a bounded worker pool with a persistent queue (output/jobs/)
+def run_develop_job(agent_id, task_info, block_id, marker_id, use_cache=True):
+    if not board_state.has_agent(agent_id):
+        logging.warning(f"Skipping develop job for deleted agent {agent_id}")
+        return
+    perform_agent_work_and_move(agent_id, AGENTS_DIR / agent_id, task_info, block_id, marker_id, use_cache=use_cache)
+
+def run_qa_job(qa_agent_id, developer_agent_id, use_cache=True):
+    if not board_state.has_agent(qa_agent_id):
+        logging.warning(f"Skipping QA job for deleted agent {qa_agent_id}")
+        return
+    perform_qa_work(qa_agent_id, AGENTS_DIR / qa_agent_id, developer_agent_id, str(AGENTS_DIR / developer_agent_id),
+                    use_cache=use_cache)
+
+def stop_cancelled_work(agent_id, cancelled):
+    """
+    Agent bookkeeping for a job that was stopped. Cancelled: the agent goes back to idle
+    and its block is marked 'cancelled'. Past its deadline: the agent goes to 'error' (and
+    its block to 'failed'). A QA agent's developer goes back to waiting for review either way.
+    """
+    developer_agent_id = None
+    try:
+        with board_state.agent_lock(agent_id, timeout=AGENT_LOCK_TIMEOUT):
+            agent = board_state.get_agent(agent_id)
+            if agent is None or agent.get("job_id") != cancelled.job_id or agent.get("state") not in ("working", "working_qa"):
+                return  # Deleted, or already moved on to other work
+            block_id = agent.get("assigned_block_id") if agent["state"] == "working" else None
+            if agent["state"] == "working_qa":
+                developer_agent_id = agent.get("assigned_developer_id")
+            if cancelled.timed_out:
+                board_state.update_agent(agent_id, expected_version=agent["version"], state="error",
+                                         source_block_title=f"Timed out: {agent.get('source_block_title')}")
+            else:
+                board_state.update_agent(agent_id, expected_version=agent["version"], state="idle",
+                                         source_block_title=None, assigned_block_id=None, assigned_developer_id=None)
+                if block_id:
+                    board_state.release_block(block_id, agent_id, status="cancelled")
+        logging.info(f"[{agent_id}] Job {cancelled.job_id} stopped ({cancelled.reason}); agent set to "
+                     f"'{'error' if cancelled.timed_out else 'idle'}'")
+        if developer_agent_id:
+            release_reviewed_developer(developer_agent_id)
+    except (LockTimeout, VersionConflict) as e:
+        logging.error(f"[{agent_id}] Could not reset agent after stopping job {cancelled.job_id}: {e}")
+
+def release_reviewed_developer(developer_agent_id):
+    """A developer whose review stopped goes back to waiting for one. Takes the developer's lock."""
+    with board_state.agent_lock(developer_agent_id, timeout=AGENT_LOCK_TIMEOUT):
+        developer = board_state.get_agent(developer_agent_id)
+        if developer and developer.get("state") == "under_qa":
+            board_state.update_agent(developer_agent_id, expected_version=developer["version"],
+                                     state="idle", awaiting_qa=True)
+
+def on_job_stopped(job):
+    """Job listener: resets the agent of a job that was cancelled or timed out (here or on a remote worker)."""
+    if job["status"] in ("cancelled", "timed_out") and job.get("agent_id"):
+        stop_cancelled_work(job["agent_id"], JobCancelled(job["job_id"], job.get("error") or job["status"],
+                                                          timed_out=job["status"] == "timed_out"))
+
+def on_job_failed(job):
+    """Job listener: a job whose handler raised leaves its agent in 'error' (and so in the dead-letter queue)."""
+    if job["status"] != "failed" or not job.get("agent_id"):
+        return
+    agent_id = job["agent_id"]
+    try:
+        with board_state.agent_lock(agent_id, timeout=AGENT_LOCK_TIMEOUT):
+            agent = board_state.get_agent(agent_id)
+            if agent and agent.get("job_id") == job["job_id"] and agent.get("state") in ("working", "working_qa"):
+                board_state.update_agent(agent_id, expected_version=agent["version"], state="error",
+                                         error_details=job.get("error"))
+    except (LockTimeout, VersionConflict) as e:
+        logging.error(f"[{agent_id}] Could not mark agent failed after job {job['job_id']}: {e}")
+
+def job_urgency(block):
+    """submit() keywords ordering a block's job in its queue: the block's priority and deadline."""
+    block = block or {}
+    return {"priority": block_priority(block), "deadline": parse_deadline(block.get("deadline"))}
+
+# Learned run times per job type and task size; they order deadline-bound blocks by latest start
+duration_estimator = DurationEstimator(BASE_OUTPUT / "jobs" / "durations.json")
+
+def record_job_duration(job):
+    if job["status"] != "done" or not job.get("started_at"):
+        return
+    size = task_size(job["args"].get("task_info") or {}) if job["type"] == "develop" else 0
+    duration_estimator.record(job["type"], size, job["finished_at"] - job["started_at"])
+
+job_scheduler = JobScheduler(BASE_OUTPUT / "jobs")
+job_scheduler.add_listener(record_job_duration)
+job_scheduler.add_listener(on_job_stopped)
+job_scheduler.add_listener(on_job_failed)
+# Deadlines (seconds) stop runaway pipelines; JOB_TIMEOUT_DEVELOP / JOB_TIMEOUT_QA override them, 0 disables
+job_scheduler.register("develop", run_develop_job, concurrency=4, timeout=1800)
+job_scheduler.register("qa", run_qa_job, concurrency=2, timeout=900)
+
+def resume_interrupted_work():
+    """
+    Startup check for agents left 'working' / 'working_qa' without a queued or running job
+    (e.g. the process died before the job was persisted). Their job is submitted again;
+    the pipelines skip the steps already in their workspace checkpoint.
+    """
+    live_jobs = {job["job_id"] for status in ("queued", "running") for job in job_scheduler.list_jobs(status=status)}
+    resumed = 0
+    for agent in board_state.find_agents(state="working") + board_state.find_agents(state="working_qa"):
+        agent_id = agent["agent_id"]
+        if agent.get("job_id") in live_jobs:
+            continue  # The scheduler re-queued it already
         try:
-            with open(ZONES_FILE, "r") as f:
-                zones = json.load(f)
-                # Basic validation (e.g., check if it's a list)
-                if isinstance(zones, list):
-                    logging.info(f"Loaded {len(zones)} zones from {ZONES_FILE}")
-                    return zones
+            with board_state.agent_lock(agent_id, timeout=AGENT_LOCK_TIMEOUT):
+                agent = board_state.get_agent(agent_id)
+                if agent is None or agent.get("state") not in ("working", "working_qa"):
+                    continue
+                previous_job = job_scheduler.get_job(agent.get("job_id")) if agent.get("job_id") else None
+                if agent["state"] == "working":
+                    block_id = agent.get("assigned_block_id")
+                    block = board_state.get_block(block_id) if block_id else None
+                    if block is None:
+                        logging.warning(f"[{agent_id}-Resume] Block {block_id} is gone; marking the agent 'error'.")
+                        board_state.update_agent(agent_id, expected_version=agent["version"], state="error",
+                                                 source_block_title=f"Block {block_id} missing after restart")
+                        continue
+                    job_type = "develop"
+                    task_info = {"block_id": block_id, "title": block.get("title", "Unknown Task"),
+                                 "description": block.get("description", ""), "agent_id": agent_id}
+                    args = {"agent_id": agent_id, "task_info": task_info, "block_id": block_id,
+                            "marker_id": (previous_job or {}).get("args", {}).get("marker_id")}
+                    urgency = job_urgency(block)
                 else:
-                    logging.warning(f"Invalid format in {ZONES_FILE}. Using defaults.")
-                    return DEFAULT_FINISH_ZONES
-        except Exception as e:
-            logging.error(f"Error reading {ZONES_FILE}: {e}. Using defaults.")
-            return DEFAULT_FINISH_ZONES
-    else:
-        logging.info("Zones file not found. Using default positions.")
-        return DEFAULT_FINISH_ZONES
+                    developer_agent_id = agent.get("assigned_developer_id")
+                    if not developer_agent_id or not board_state.has_agent(developer_agent_id):
+                        logging.warning(f"[{agent_id}-Resume] Developer {developer_agent_id} is gone; marking the QA agent 'error'.")
+                        board_state.update_agent(agent_id, expected_version=agent["version"], state="error",
+                                                 source_block_title="Reviewed developer missing after restart")
+                        continue
+                    job_type = "qa"
+                    args = {"qa_agent_id": agent_id, "developer_agent_id": developer_agent_id}
+                    urgency = job_urgency(reviewed_block(developer_agent_id))
+                job_id = new_job_id()
+                agent = board_state.update_agent(agent_id, expected_version=agent["version"], job_id=job_id)
+                job_scheduler.submit(job_type, args, job_id=job_id, agent_id=agent_id, **urgency)
+                resumed += 1
+                logging.info(f"[{agent_id}-Resume] Re-submitted interrupted {job_type} work as job {job_id}")
+        except (LockTimeout, VersionConflict, QueueFull) as e:
+            logging.warning(f"[{agent_id}-Resume] Could not resume interrupted work: {e}")
+    if resumed:
+        logging.info(f"Resumed {resumed} agent(s) whose work was interrupted by a restart")
+    return resumed
+
+def queue_full_body(e):
+    return {"error": str(e), "status": "rejected"}, 429
+
+def job_started_body(message, job, **extra):
+    """200 when a worker picks the job up right away, 202 while it waits in the queue."""
+    queued = bool(job.get("queue_position"))
+    body = {"message": message, "job_id": job["job_id"], "job_status": "queued" if queued else "started", **extra}
+    if queued:
+        body["queue_position"] = job["queue_position"]
+    return body, (202 if queued else 200)
+
+def agent_locked(route):
+    """
+    Runs an /agents/<agent_id>/... route while holding that agent's lock, so its
+    read-check-write can't interleave with a worker or another request.
+    Lock order when a route needs a second agent: QA agent first, then developer.
+    """
+    @functools.wraps(route)
+    def wrapper(agent_id, *args, **kwargs):
+        if not agent_id or not agent_id.startswith("agent_"):
+            return jsonify({"error": "Invalid agent ID format"}), 400
+        if not board_state.has_agent(agent_id):
+            return jsonify({"error": "Agent info file not found"}), 404
+        try:
+            with board_state.agent_lock(agent_id, timeout=AGENT_LOCK_TIMEOUT):
+                return route(agent_id, *args, **kwargs)
+        except LockTimeout as e:
+            logging.warning(f"Agent {agent_id} busy: {e}")
+            return jsonify({"error": f"Agent {agent_id} is busy, try again"}), 409
+    return wrapper
 
+# --- Helper Functions for Zone Layout ---
 def save_zone_positions(zones_data):
-    """Saves the provided zone data list to the JSON file."""
+    """Replaces the zone layout; the store writes zones.json in the background."""
     try:
-        with open(ZONES_FILE, "w") as f:
-            json.dump(zones_data, f, indent=2)
-        logging.info(f"Saved {len(zones_data)} zones to {ZONES_FILE}")
+        board_state.set_zones(zones_data)
+        logging.info(f"Updated {len(zones_data)} zones (persisting to {ZONES_FILE})")
         return True
     except Exception as e:
-        logging.error(f"Error writing to {ZONES_FILE}: {e}")
+        logging.error(f"Error updating zones: {e}")
         return False
 
 
@@ -90,27 +253,12 @@ def static_files(filename):
 # --- Agent Routes (Modified /interrogate) ---
 @app.route("/agents", methods=["GET"])
 def list_agents():
-    # ... (existing list_agents code) ...
-    agents = []
-    for agent_dir in AGENTS_DIR.glob("agent_*"):
-        if agent_dir.is_dir():
-            agent_id = agent_dir.name
-            agent_info_file = agent_dir / "agent_info.json"
-            agent_data = {
-                "agent_id": agent_id, "name": "Agent " + agent_id[-6:],
-                "state": "unknown", "assigned_block_id": None,
-                "source_block_title": None, "x": INITIAL_AGENT_X, "y": INITIAL_AGENT_Y
-            }
-            if agent_info_file.exists():
-                try:
-                    with open(agent_info_file, "r") as f: info = json.load(f)
-                    agent_data.update(info)
-                    agent_data["x"] = agent_data.get("x", INITIAL_AGENT_X)
-                    agent_data["y"] = agent_data.get("y", INITIAL_AGENT_Y)
-                except Exception as e:
-                    logging.warning(f"Could not read or parse agent info for {agent_id}: {e}")
-            agents.append(agent_data)
-    return jsonify(agents)
+    # Served from the in-memory board state (defaults for missing fields applied by the store)
+    # Optional filters use the store's indexes, e.g. /agents?state=idle&agent_type=qa
+    filters = {k: request.args[k] for k in ("state", "agent_type", "assigned_block_id") if k in request.args}
+    if filters:
+        return jsonify(board_state.find_agents(**filters))
+    return jsonify(board_state.list_agents())
 
 
 @app.route("/agents", methods=["POST"])
@@ -153,17 +301,14 @@ def spawn_agent():
         "x": INITIAL_AGENT_X,
         "y": INITIAL_AGENT_Y,
         "llm_config": { "type": llm_type, "model": llm_model },
-        "agent_type": agent_type # <-- Save agent type
+        "agent_type": agent_type, # <-- Save agent type
+        "awaiting_qa": False # Set once a developer finishes a block (see complete_and_move)
         # Other fields like assigned_block_id, completed_marker_id will be added later
     }
 
-    # Path to the agent's specific information file
-    agent_info_file = agent_dir / "agent_info.json"
-
     try:
-        # Write the agent data to its JSON file
-        with open(agent_info_file, "w") as f:
-            json.dump(agent, f, indent=2)
+        # Register the agent; its agent_info.json is written by the store's background writer
+        board_state.put_agent(agent_id, agent)
 
         # Log successful spawning including the type
         logging.info(
@@ -186,9 +331,29 @@ def delete_agent(agent_id):
      # ... (existing delete_agent code) ...
     if not agent_id or not agent_id.startswith("agent_"): return jsonify({"error": "Invalid agent ID format"}), 400
     agent_dir = AGENTS_DIR / agent_id
-    if agent_dir.is_dir():
+    if agent_dir.is_dir() or board_state.has_agent(agent_id):
         try:
-            shutil.rmtree(agent_dir)
+            claimed_block_id = (board_state.get_agent(agent_id) or {}).get("assigned_block_id")
+            # Stop the agent's jobs, and QA reviews reading its files, before the workspace goes away
+            job_ids = [job["job_id"] for job in job_scheduler.list_jobs(agent_id=agent_id)
+                       if job["status"] in ("queued", "running")]
+            for job_id in job_ids:
+                job_scheduler.cancel(job_id, "agent deleted")
+            for qa_agent in board_state.find_agents(state="working_qa"):
+                if qa_agent.get("assigned_developer_id") == agent_id and qa_agent.get("job_id"):
+                    job_scheduler.cancel(qa_agent["job_id"], f"developer {agent_id} deleted")
+                    job_ids.append(qa_agent["job_id"])
+            # The jobs stop concurrently, so one deadline covers them all
+            wait_until = time.monotonic() + AGENT_DELETE_JOB_WAIT
+            for job_id in job_ids:
+                if not job_scheduler.wait(job_id, timeout=max(wait_until - time.monotonic(), 0)):
+                    logging.warning(f"Job {job_id} still running {AGENT_DELETE_JOB_WAIT}s after cancelling; deleting {agent_id} anyway")
+            board_state.delete_agent(agent_id)
+            dead_letters.forget_agent(agent_id)
+            # Its block goes back in the queue (the job it was running just marked it 'cancelled')
+            if claimed_block_id and board_state.release_block(claimed_block_id, agent_id, from_statuses=("taken", "cancelled")):
+                logging.info(f"Block {claimed_block_id} back in the pending queue after deleting {agent_id}")
+            if agent_dir.is_dir(): shutil.rmtree(agent_dir)
             logging.info(f"Agent {agent_id} deleted successfully.")
             return jsonify({"message": f"Agent {agent_id} deleted"}), 200
         except Exception as e:
@@ -199,76 +364,109 @@ def delete_agent(agent_id):
         return jsonify({"error": "Agent not found"}), 404
 
 
+# States a manual move leaves alone: a develop / QA job owns the agent until it finishes
+MOVE_KEEPS_STATE = ("working", "working_qa", "under_qa")
+
 @app.route("/agents/<agent_id>/move", methods=["POST"])
+@agent_locked
 def move_agent(agent_id):
-    # ... (existing move_agent code - No change needed here) ...
-    if not agent_id or not agent_id.startswith("agent_"): return jsonify({"error": "Invalid agent ID format"}), 400
-    agent_dir = AGENTS_DIR / agent_id
-    agent_info_file = agent_dir / "agent_info.json"
-    if not agent_info_file.is_file(): return jsonify({"error": "Agent info file not found"}), 404
     data = request.json
     target_x = data.get("x"); target_y = data.get("y")
     if target_x is None or target_y is None: return jsonify({"error": "Missing target coordinates (x, y)"}), 400
     try:
-        with open(agent_info_file, "r") as f: agent_data = json.load(f)
-        agent_data["x"] = float(target_x); agent_data["y"] = float(target_y); agent_data["state"] = "idle" # Set state to idle on manual move
-        with open(agent_info_file, "w") as f: json.dump(agent_data, f, indent=2)
+        agent_data = board_state.get_agent(agent_id)
+        updates = {"x": float(target_x), "y": float(target_y)}
+        # A manual move resets the agent to idle, except while a job is working for it
+        if agent_data.get("state") not in MOVE_KEEPS_STATE and not job_scheduler.has_active_job(agent_id):
+            updates["state"] = "idle"
+        agent_data = board_state.update_agent(agent_id, expected_version=agent_data["version"], **updates)
         logging.info(f"Agent {agent_id} MOVED to ({agent_data['x']:.1f}, {agent_data['y']:.1f})")
         return jsonify({"message": f"Move command processed", "new_x": agent_data["x"], "new_y": agent_data["y"]}), 200
+    except VersionConflict as e:
+        logging.warning(f"Move for Agent {agent_id} lost a concurrent update: {e}")
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         logging.error(f"Error processing move command for {agent_id}: {e}")
         return jsonify({"error": "Failed to process move command"}), 500
 
 
-# --- *** MODIFIED: interrogate_block route uses threading *** ---
+# --- *** MODIFIED: interrogate_block route queues a develop job *** ---
 @app.route("/agents/<agent_id>/interrogate", methods=["POST"])
+@agent_locked
 # ... interrogate_block (uses loaded FINISH_ZONES now indirectly via the thread call)...
 # Note: The interrogate route itself doesn't need the zones, but the thread it starts does.
 # We load zones once when getting state, assuming they don't change *during* a work cycle.
 def interrogate_block(agent_id):
     # ... (previous implementation - check required args) ...
     if not agent_id or not agent_id.startswith("agent_"): return jsonify({"error": "Invalid agent ID format"}), 400
-    agent_dir = AGENTS_DIR / agent_id
-    agent_info_file = agent_dir / "agent_info.json"
-    if not agent_info_file.is_file(): return jsonify({"error": "Agent info file not found"}), 404
+    if not board_state.has_agent(agent_id): return jsonify({"error": "Agent info file not found"}), 404
     data = request.json
     marker_id = data.get("markerId"); block_id = data.get("blockId")
     target_x = data.get("x"); target_y = data.get("y")
     if not block_id or target_x is None or target_y is None:
         return jsonify({"error": "Missing blockId or target coordinates (x, y) in interrogate request"}), 400
-    block_path = BLOCKS_DIR / f"{block_id}.json"
-    if not block_path.is_file(): return jsonify({"error": f"Block data not found for ID {block_id}"}), 404
+    body, status = start_block_work(agent_id, block_id, marker_id=marker_id, target_x=target_x, target_y=target_y)
+    return jsonify(body), status
+
+def start_block_work(agent_id, block_id, marker_id=None, target_x=None, target_y=None, use_cache=True):
+    """
+    Claims `block_id` for developer `agent_id`, sets it 'working' (moved to the marker
+    when coordinates are given) and queues the 'develop' job (its LLM calls skip the
+    response cache with use_cache=False).
+    Caller holds the agent's lock. Returns (body, status); 409 when another agent holds the block.
+    """
+    block_data = board_state.get_block(block_id)
+    if block_data is None: return {"error": f"Block data not found for ID {block_id}"}, 404
+
+    if job_scheduler.is_full("develop"):
+        return queue_full_body(QueueFull("develop", job_scheduler.queue_limit))
+
+    agent_data = board_state.get_agent(agent_id)
+    if agent_data.get("state") == "working":
+        return {"error": f"Agent {agent_id} is already working on {agent_data.get('assigned_block_id')}"}, 409
+    if board_state.claim_block(agent_id, block_id) is None:
+        holder = (board_state.get_block(block_id) or {}).get("agent_id")
+        return {"error": f"Block {block_id} is already taken by {holder}"}, 409
 
     try:
-        block_data = read_block(block_path)
+        previous = {k: agent_data.get(k) for k in ("state", "assigned_block_id", "source_block_title", "x", "y", "job_id")}
         task_title = block_data.get("title", "Unknown Task"); task_description = block_data.get("description", "")
-        with open(agent_info_file, "r+") as f:
-            agent_data = json.load(f)
-            agent_data["state"] = "working"; agent_data["assigned_block_id"] = block_id
-            agent_data["source_block_title"] = task_title
-            try: agent_data["x"] = float(target_x); agent_data["y"] = float(target_y)
+        job_id = new_job_id()
+        updates = {"state": "working", "assigned_block_id": block_id, "source_block_title": task_title, "job_id": job_id}
+        if target_x is not None and target_y is not None:
+            try: updates["x"] = float(target_x); updates["y"] = float(target_y)
             except (TypeError, ValueError): logging.warning(f"Interrogate: Invalid coords ({target_x}, {target_y}). Initial move skipped.")
-            f.seek(0); json.dump(agent_data, f, indent=2); f.truncate()
-        logging.info(f"Agent {agent_id} state set 'working', moved to marker ({agent_data.get('x')}, {agent_data.get('y')}) for Block {block_id}")
+        agent_data = board_state.update_agent(agent_id, expected_version=agent_data["version"], **updates)
+        logging.info(f"Agent {agent_id} state set 'working' at ({agent_data.get('x')}, {agent_data.get('y')}) for Block {block_id}")
         task_info = {"block_id": block_id, "title": task_title, "description": task_description, "agent_id": agent_id}
 
-        # Pass the *currently loaded* zone data to the thread
-        current_zones = load_zone_positions() # Load fresh copy for the thread
-        thread = threading.Thread(target=perform_agent_work_and_move, args=(agent_id, agent_dir, task_info, block_id, marker_id), daemon=True) # Pass marker_id
-        thread.start()
-        logging.info(f"Started background work thread for Agent {agent_id}, Block {block_id}")
-        return jsonify({"message": f"Interrogation started...", "agent_state": "working"}), 200
+        try:
+            job = job_scheduler.submit("develop", {"agent_id": agent_id, "task_info": task_info, "block_id": block_id,
+                                                   "marker_id": marker_id, "use_cache": use_cache},
+                                       job_id=job_id, agent_id=agent_id,
+                                       **job_urgency(block_data))
+        except QueueFull as e:
+            # Filled up since the check above; put the agent and the block back as they were
+            board_state.update_agent(agent_id, expected_version=agent_data["version"], **previous)
+            board_state.release_block(block_id, agent_id)
+            return queue_full_body(e)
+        logging.info(f"Queued develop job {job_id} for Agent {agent_id}, Block {block_id}")
+        return job_started_body("Interrogation queued..." if job.get("queue_position") else "Interrogation started...",
+                                job, agent_state="working", block_id=block_id)
+    except VersionConflict as e:
+        logging.warning(f"Interrogate for Agent {agent_id} lost a concurrent update: {e}")
+        board_state.release_block(block_id, agent_id)
+        return {"error": str(e)}, 409
     except Exception as e:
         logging.exception(f"Error processing interrogate command for Agent {agent_id}, Block {block_id}: {e}")
         # Minimal revert attempt
         try:
-             with open(agent_info_file, "r+") as f:
-                 agent_data = json.load(f)
-                 if agent_data.get("state") == "working" and agent_data.get("assigned_block_id") == block_id:
-                     agent_data["state"] = "error"; agent_data["source_block_title"] = f"Error starting work on {block_id}"
-                     f.seek(0); json.dump(agent_data, f, indent=2); f.truncate()
+             board_state.release_block(block_id, agent_id)
+             agent_data = board_state.get_agent(agent_id)
+             if agent_data and agent_data.get("state") == "working" and agent_data.get("assigned_block_id") == block_id:
+                 board_state.update_agent(agent_id, state="error", source_block_title=f"Error starting work on {block_id}")
         except Exception: pass
-        return jsonify({"error": f"Failed to start interrogate process: {e}"}), 500
+        return {"error": f"Failed to start interrogate process: {e}"}, 500
 
 # --- *** END MODIFIED Route *** ---
 
@@ -374,181 +572,127 @@ def interrogate_block(agent_id):
 #                 agent_data["completed_marker_id"] = None; f.seek(0); json.dump(agent_data, f, indent=2); f.truncate()
 #         except Exception: pass
 #         return jsonify({"error": "Failed to complete agent move"}), 500
-@app.route("/agents/<agent_id>/complete_and_move", methods=["POST"])
-def complete_and_move_agent(agent_id):
+def complete_developer_work(agent_id):
     """
-    Triggered by the frontend after detecting 'finished_work' state.
+    Runs when a developer enters 'finished_work' (lifecycle hook) or on POST .../complete_and_move.
     Moves the agent to an *unoccupied* finish zone (non-dropoff) and resets state to idle.
+    Caller holds the agent's lock. Returns (body, status).
     """
-    # Construct the path to the agent's information file
-    agent_info_file = AGENTS_DIR / agent_id / "agent_info.json" # Correct path construction
-
-    # Validate agent ID format and check if the info file exists
+    # Validate agent ID format and check that the agent exists
     if not agent_id or not agent_id.startswith("agent_"):
-        return jsonify({"error": "Invalid agent ID format"}), 400
-    if not agent_info_file.is_file():
-        return jsonify({"error": "Agent info file not found"}), 404
+        return {"error": "Invalid agent ID format"}, 400
+    if not board_state.has_agent(agent_id):
+        return {"error": "Agent info file not found"}, 404
 
     try:
         # --- Find Empty Finish Zone ---
         target_finish_x, target_finish_y = None, None
         selected_zone_id_log = "N/A" # For logging which zone was chosen
 
-        # 1. Get all other agent positions to check for zone occupancy
-        all_agents_positions = []
-        for other_agent_dir in AGENTS_DIR.glob("agent_*"):
-            other_agent_id = other_agent_dir.name
-            if other_agent_id == agent_id: continue # Skip checking against self
-            other_info_file = other_agent_dir / "agent_info.json"
-            if other_info_file.exists():
-                try:
-                    with open(other_info_file, "r") as f_other:
-                        info = json.load(f_other)
-                    # Ensure both x and y exist and are numbers before adding
-                    if isinstance(info.get("x"), (int, float)) and isinstance(info.get("y"), (int, float)):
-                        all_agents_positions.append({"id": other_agent_id, "x": info["x"], "y": info["y"]})
-                    else:
-                        # Log if an agent is skipped due to missing/invalid coordinates
-                        logging.debug(f"Agent {other_agent_id} skipped (missing or invalid coordinates in info file).")
-                except Exception as e:
-                    # Log errors reading other agent files but continue
-                    logging.warning(f"Error reading info file for agent {other_agent_id}: {e}")
-
-        # 2. Load ALL zones and then filter for suitable 'finish' zones
-        all_zones = load_zone_positions() # Assumes this function loads from zones.json or returns defaults
-
-        # *** CORRECTION: Filter for zones NOT marked as 'dropoff' ***
-        # This selects zones intended for developers (e.g., those without type 'dropoff' or with type 'finish')
-        finish_zones = [zone for zone in all_zones if zone.get("type") != "dropoff"]
-        # --- END CORRECTION ---
-
-        # Check if any suitable finish zones were found after filtering
-        if not finish_zones:
+        # 1-5. Finish zone (non-dropoff) from the batch assigner: completions arriving together
+        # are matched to free zone slots in one pass (least total travel, zone capacity respected).
+        finish_zone_count = board_state.count_zones("finish")
+        selected_zone = zone_assigner.assign(agent_id, "finish") if finish_zone_count else None
+
+        if not finish_zone_count:
             logging.warning(f"[{agent_id}-CompleteMove] No suitable finish zones (non-dropoff) defined or found.")
+        elif selected_zone:
+            selected_zone_id_log = selected_zone['id']
+            # Calculate the center coordinates of the selected zone for the agent's destination
+            target_finish_x = selected_zone['x'] + selected_zone['width'] / 2
+            target_finish_y = selected_zone['y'] + selected_zone['height'] / 2
+            logging.info(f"[{agent_id}-CompleteMove] Assigned finish zone '{selected_zone_id_log}'. Target: ({target_finish_x:.0f}, {target_finish_y:.0f})")
         else:
-            # 3. Identify occupied zones (using the FILTERED finish_zones list)
-            occupied_zone_ids = set()
-            for zone in finish_zones: # Iterate over the filtered list of potential finish zones
-                # Basic validation for zone structure before accessing keys
-                if not all(k in zone for k in ('id', 'x', 'y', 'width', 'height')):
-                    logging.warning(f"[{agent_id}-CompleteMove] Skipping invalid zone data during occupancy check: {zone}")
-                    continue
-
-                zone_x, zone_y, zone_w, zone_h = zone['x'], zone['y'], zone['width'], zone['height']
-                # Check if any *other* agent is inside this specific zone
-                for other_agent_pos in all_agents_positions:
-                    agent_x, agent_y = other_agent_pos["x"], other_agent_pos["y"]
-                    # Check agent's center point against zone boundaries
-                    if (zone_x <= agent_x < zone_x + zone_w) and \
-                       (zone_y <= agent_y < zone_y + zone_h):
-                        occupied_zone_ids.add(zone['id'])
-                        logging.debug(f"[{agent_id}-CompleteMove] Finish Zone {zone['id']} occupied by agent {other_agent_pos['id']}")
-                        break # This zone is occupied, no need to check other agents for it
-
-            # 4. Filter for empty zones (from the already filtered finish_zones list)
-            empty_zones = [zone for zone in finish_zones if zone['id'] not in occupied_zone_ids]
-
-            # 5. Select target zone randomly from the empty ones
-            if empty_zones:
-                selected_zone = random.choice(empty_zones)
-                selected_zone_id_log = selected_zone['id']
-                # Calculate the center coordinates of the selected zone for the agent's destination
-                target_finish_x = selected_zone['x'] + selected_zone['width'] / 2
-                target_finish_y = selected_zone['y'] + selected_zone['height'] / 2
-                logging.info(f"[{agent_id}-CompleteMove] Found {len(empty_zones)} empty finish zones. Selected '{selected_zone_id_log}'. Target: ({target_finish_x:.0f}, {target_finish_y:.0f})")
-            else:
-                # Log that all *suitable* finish zones are occupied
-                logging.warning(f"[{agent_id}-CompleteMove] All {len(finish_zones)} suitable finish zones are occupied. Agent will remain at current location.")
-                # target_finish_x, target_finish_y remain None, agent position won't change
-
-        # --- Update agent state and position in its info file ---
-        with open(agent_info_file, "r+") as f:
-            agent_data = json.load(f)
-            # Check current state, log if it wasn't 'finished_work' but proceed
-            if agent_data.get("state") != "finished_work":
-                logging.warning(f"[{agent_id}-CompleteMove] Agent was not in 'finished_work' state (was '{agent_data.get('state')}'). Proceeding anyway.")
-
-            # Reset agent state and related fields
-            agent_data["state"] = "idle"
-            agent_data["assigned_block_id"] = None
-            agent_data["source_block_title"] = None
-            agent_data["completed_marker_id"] = None
-
-            # Get current position for logging/fallback, ensure they are numbers
-            current_x = agent_data.get("x") if isinstance(agent_data.get("x"), (int, float)) else INITIAL_AGENT_X
-            current_y = agent_data.get("y") if isinstance(agent_data.get("y"), (int, float)) else INITIAL_AGENT_Y
-
-            # Update position if a target zone was found
-            if target_finish_x is not None and target_finish_y is not None:
-                agent_data["x"] = target_finish_x
-                agent_data["y"] = target_finish_y
-                final_pos_log = f"finish zone '{selected_zone_id_log}' ({target_finish_x:.0f}, {target_finish_y:.0f})"
-            else:
-                 # Position remains unchanged if no empty suitable zone was found
-                 final_pos_log = f"previous location ({current_x:.0f}, {current_y:.0f}) as no empty suitable zone was available"
-                 # Ensure x and y fields exist even if not changing
-                 agent_data["x"] = current_x
-                 agent_data["y"] = current_y
+            # Log that all *suitable* finish zones are occupied
+            logging.warning(f"[{agent_id}-CompleteMove] All {finish_zone_count} suitable finish zones are occupied. Agent will remain at current location.")
+            # target_finish_x, target_finish_y remain None, agent position won't change
+
+        # --- Update agent state and position in the board state ---
+        agent_data = board_state.get_agent(agent_id)
+        # Check current state, log if it wasn't 'finished_work' but proceed
+        if agent_data.get("state") != "finished_work":
+            logging.warning(f"[{agent_id}-CompleteMove] Agent was not in 'finished_work' state (was '{agent_data.get('state')}'). Proceeding anyway.")
+
+        # Reset agent state and related fields
+        finished_block_id = agent_data.get("assigned_block_id")
+        updates = {"state": "idle", "assigned_block_id": None, "source_block_title": None, "completed_marker_id": None}
+        if agent_data.get("agent_type", "developer") == "developer":
+            updates["awaiting_qa"] = True  # Picked up by the QA dispatcher
+            updates["completed_block_id"] = finished_block_id  # Its review inherits the block's priority
+
+        # Get current position for logging/fallback, ensure they are numbers
+        current_x = agent_data.get("x") if isinstance(agent_data.get("x"), (int, float)) else INITIAL_AGENT_X
+        current_y = agent_data.get("y") if isinstance(agent_data.get("y"), (int, float)) else INITIAL_AGENT_Y
+
+        # Update position if a target zone was found
+        if target_finish_x is not None and target_finish_y is not None:
+            updates["x"] = target_finish_x
+            updates["y"] = target_finish_y
+            final_pos_log = f"finish zone '{selected_zone_id_log}' ({target_finish_x:.0f}, {target_finish_y:.0f})"
+        else:
+             # Position remains unchanged if no empty suitable zone was found
+             final_pos_log = f"previous location ({current_x:.0f}, {current_y:.0f}) as no empty suitable zone was available"
+             # Ensure x and y fields exist even if not changing
+             updates["x"] = current_x
+             updates["y"] = current_y
 
-            # Write the updated data back to the file
-            f.seek(0) # Go to the beginning of the file
-            json.dump(agent_data, f, indent=2) # Write updated JSON
-            f.truncate() # Remove any trailing data if the new content is shorter
+        try:
+            agent_data = board_state.update_agent(agent_id, expected_version=agent_data["version"], **updates)
+        finally:
+            zone_assigner.release(agent_id)  # Now standing in the zone (or not moving there at all)
+        if finished_block_id:
+            board_state.release_block(finished_block_id, agent_id, status="done")
 
         # Log the final outcome
         logging.info(f"[{agent_id}-CompleteMove] Agent state set to 'idle' and moved to {final_pos_log}.")
 
         # Return success response
-        return jsonify({
+        return {
             "message": f"Agent {agent_id} moved to {final_pos_log} and set to idle.",
             "new_state": "idle",
             "new_x": agent_data.get("x"), # Return the final position
             "new_y": agent_data.get("y")
-        }), 200
+        }, 200
 
+    except VersionConflict as e:
+        logging.warning(f"[{agent_id}-CompleteMove] Agent changed while completing, not moved: {e}")
+        return {"error": str(e)}, 409
     # General exception handling for the entire process
     except Exception as e:
         logging.error(f"[{agent_id}-CompleteMove] Error completing move: {e}", exc_info=True) # Log traceback
         # Attempt to set the agent's state to 'error' as a fallback
         try:
-            with open(agent_info_file, "r+") as f:
-                agent_data = json.load(f)
-                agent_data["state"] = "error"
-                agent_data["source_block_title"] = "Error during final move" # Add error context
-                agent_data["completed_marker_id"] = None # Clear marker ID on error
-                f.seek(0)
-                json.dump(agent_data, f, indent=2)
-                f.truncate()
+            board_state.update_agent(
+                agent_id, state="error",
+                source_block_title="Error during final move", # Add error context
+                completed_marker_id=None # Clear marker ID on error
+            )
         except Exception as e_update:
              # Log if even updating the state to error fails
              logging.error(f"[{agent_id}-CompleteMove] Failed to update agent state to error after exception: {e_update}")
         # Return server error response
-        return jsonify({"error": "Failed to complete agent move"}), 500
+        return {"error": "Failed to complete agent move"}, 500
+
+@app.route("/agents/<agent_id>/complete_and_move", methods=["POST"])
+@agent_locked
+def complete_and_move_agent(agent_id):
+    """Manual trigger for complete_developer_work; the lifecycle hook normally runs it."""
+    body, status = complete_developer_work(agent_id)
+    return jsonify(body), status
 
 # --- Block Routes (Existing - No changes needed here) ---
+# Server-managed block fields: pending -> taken (agent_id, claimed_at) -> done / failed (finished_at)
+BLOCK_CLAIM_FIELDS = ("status", "agent_id", "claimed_at", "finished_at")
+# Scheduling fields set through the API (the board editor doesn't send them either)
+BLOCK_SCHEDULE_FIELDS = ("priority", "deadline")
+
 @app.route("/blocks", methods=["GET"])
 def list_blocks():
-    # ... (existing list_blocks code) ...
-    logging.info(f"--- list_blocks called ---")
-    logging.info(f"Listing blocks in directory: {BLOCKS_DIR.resolve()}") # Log the absolute path being used
-    blocks = []
-    try: # Add try block for glob operation
-        block_files = sorted(BLOCKS_DIR.glob("block_*.json"))
-        found_filenames = [f.name for f in block_files]
-        logging.info(f"Found {len(found_filenames)} file(s) matching 'block_*.json': {found_filenames}")
-        for idx, f in enumerate(block_files): # Use enumerate for index
-            try:
-                with open(f, "r") as fp:
-                    data = json.load(fp)
-                    data['server_index'] = idx # Assign index based on sorted file list
-                    blocks.append(data)
-                    logging.info(f"Successfully read and added block: {f.name}")
-            except Exception as e:
-                logging.warning(f"Could not read block file {f.name}: {e}")
-                continue
-    except Exception as glob_e:
-         logging.error(f"Error during directory glob operation in {BLOCKS_DIR.resolve()}: {glob_e}")
-    logging.info(f"--- list_blocks finished. Returning {len(blocks)} block(s). ---")
+    # Served from memory; 'server_index' follows the sorted block file names as before
+    # Optional ?status=pending filter uses the store's block index
+    status = request.args.get("status")
+    blocks = board_state.find_blocks(status=status) if status else board_state.list_blocks()
+    logging.debug(f"list_blocks returning {len(blocks)} block(s)")
     return jsonify(blocks)
 
 
@@ -558,44 +702,176 @@ def save_blocks():
     posted = request.json
     if not posted or "blocks" not in posted: return jsonify({"error": "Missing 'blocks' data"}), 400
     blocks_to_save = posted.get("blocks", [])
-    saved_count = 0; existing_files = {f.name: f for f in BLOCKS_DIR.glob("block_*.json")}; saved_files = set()
     logging.info(f"Processing {len(blocks_to_save)} blocks for saving...")
-    for idx, b_data in enumerate(blocks_to_save):
+    for b_data in blocks_to_save:
         block_id = b_data.get("block_id")
         if not block_id: block_id = f"block_{uuid.uuid4().hex[:6]}"; logging.info(f"Assigned new ID {block_id}")
-        b_data["block_id"] = block_id; file_name = f"{block_id}.json"; block_path = BLOCKS_DIR / file_name; saved_files.add(file_name)
-        try:
-            with open(block_path, "w") as fp: json.dump(b_data.copy(), fp, indent=2)
-            saved_count += 1
-        except Exception as e: logging.error(f"Failed to save block {block_id}: {e}")
-    files_to_delete = set(existing_files.keys()) - saved_files
-    if files_to_delete:
-        logging.info(f"Deleting {len(files_to_delete)} removed blocks: {', '.join(files_to_delete)}")
-        for file_name in files_to_delete:
-            try: existing_files[file_name].unlink()
-            except Exception as e: logging.warning(f"Could not delete old block {file_name}: {e}")
-    logging.info(f"Saved/updated {saved_count} blocks. Deleted {len(files_to_delete)} blocks.")
-    return jsonify({"ok": True, "count": saved_count})
+        b_data["block_id"] = block_id
+    # The store swaps in the new block set and writes/deletes the block files in the background
+    # The board editor only sends title/description; claims made by agents survive the save
+    saved_ids, deleted_ids = board_state.replace_blocks(blocks_to_save, keep_fields=BLOCK_CLAIM_FIELDS + BLOCK_SCHEDULE_FIELDS)
+    if deleted_ids:
+        logging.info(f"Deleting {len(deleted_ids)} removed blocks: {', '.join(deleted_ids)}")
+    logging.info(f"Saved/updated {len(saved_ids)} blocks. Deleted {len(deleted_ids)} blocks.")
+    return jsonify({"ok": True, "count": len(saved_ids)})
+
+
+@app.route("/blocks/<block_id>", methods=["PATCH"])
+def update_block_schedule(block_id):
+    """
+    Sets a block's 'priority' (number, or low/normal/high/urgent) and/or 'deadline'
+    (epoch seconds or ISO 8601, null to clear). Pending blocks are dispatched in that order.
+    """
+    data = request.json or {}
+    fields = {k: data[k] for k in BLOCK_SCHEDULE_FIELDS if k in data}
+    if not fields:
+        return jsonify({"error": f"Expected one of {', '.join(BLOCK_SCHEDULE_FIELDS)}"}), 400
+    if fields.get("deadline") is not None and parse_deadline(fields["deadline"]) is None:
+        return jsonify({"error": f"Unreadable deadline {fields['deadline']!r}"}), 400
+    block = board_state.update_block(block_id, **fields)
+    if block is None:
+        return jsonify({"error": f"Block {block_id} not found"}), 404
+    return jsonify(block)
 
 
 # --- State Route (Existing - No changes needed) ---
 @app.route("/state", methods=["GET"])
 def get_state():
-    """Gets current state including blocks, agents, and finish zones."""
-    blocks_response = list_blocks()
-    agents_response = list_agents()
-    # --- NEW: Load zones ---
-    zones_data = load_zone_positions()
-    # --- END NEW ---
-
-    blocks_data = blocks_response.json if blocks_response and blocks_response.json is not None else []
-    agents_data = agents_response.json if agents_response and agents_response.json is not None else []
-
-    return jsonify({
-        "blocks": blocks_data,
-        "agents": agents_data,
-        "zones": zones_data # Include zones in the state
-        })
+    """
+    Gets current state including blocks, agents, and finish zones.
+    Supports '?since=<version>&epoch=<epoch>' for deltas (changed records plus deleted ids)
+    and If-None-Match against the board ETag, answering 304 when nothing changed.
+    """
+    etag = board_state.etag()
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+        response.set_etag(etag)
+        return response
+
+    # Serialized and gzipped once per board version, shared by every polling client
+    encoded = board_state.encoded_state(request.args.get("since", type=int), epoch=request.args.get("epoch"))
+    if "gzip" in request.accept_encodings:
+        response = Response(encoded.gzipped, mimetype="application/json")
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        response = Response(encoded.body, mimetype="application/json")
+    response.headers["Vary"] = "Accept-Encoding"
+    # ETag of the version actually served (the board may have moved on since the check above)
+    response.set_etag(f"{encoded.epoch}-{encoded.version}")
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/state/progress", methods=["GET"])
+def get_progress():
+    """
+    Live progress of the agents with work in flight (the file streaming in, bytes and
+    chunks so far, files done), keyed by agent_id. Kept out of /state so its frequent
+    updates don't bump the board version. Supports If-None-Match like /state.
+    """
+    version, progress = board_state.get_progress()
+    etag = f"{board_state.epoch}-progress-{version}"
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        response = jsonify(progress)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@app.route("/journal/transitions", methods=["GET"])
+def list_transitions():
+    """
+    Agent state transitions from the board journal, oldest first, for throughput analysis.
+    Optional filters: ?agent_id=...&since=<unix ts>&until=<unix ts>&limit=<n> (most recent n).
+    """
+    transitions = board_state.transitions(
+        agent_id=request.args.get("agent_id"),
+        since=request.args.get("since", type=float),
+        until=request.args.get("until", type=float),
+    )
+    limit = request.args.get("limit", type=int)
+    if limit:
+        transitions = transitions[-limit:]
+    return jsonify(transitions)
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    """
+    Background jobs known to the scheduler, oldest first, plus per-type queue stats.
+    Optional filters: ?status=queued|running|done|failed&type=develop|qa&agent_id=...
+    """
+    jobs = job_scheduler.list_jobs(status=request.args.get("status"), job_type=request.args.get("type"),
+                                   agent_id=request.args.get("agent_id"))
+    jobs.sort(key=lambda job: job.get("created_at", 0))
+    return jsonify({"jobs": jobs, "stats": job_scheduler.stats()})
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_scheduler.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job)
+
+
+@app.route("/llm/cache", methods=["GET"])
+def llm_cache_stats():
+    """Response cache hits and misses (memory / disk), entry counts and size."""
+    return jsonify(llm_service.cache_stats())
+
+@app.route("/llm/stats", methods=["GET"])
+def llm_stats():
+    """Response cache stats and how many concurrent identical requests shared a provider call."""
+    return jsonify(llm_service.stats())
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    """Drops a queued job, or stops a running one at its next LLM call (the agent goes back to idle)."""
+    job = job_scheduler.get_job(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    if job["status"] not in ("queued", "running"):
+        return jsonify({"error": f"Job {job_id} already {job['status']}", "job": job}), 409
+    job = job_scheduler.cancel(job_id, "cancelled by request")
+    return jsonify({"message": f"Job {job_id} {'cancelled' if job['status'] == 'cancelled' else 'cancelling'}",
+                    "job": job}), 200
+
+# Seconds between SSE keep-alive comments while the board is idle
+STATE_STREAM_KEEPALIVE = 15
+
+def _parse_state_event_id(event_id):
+    """Splits an SSE 'Last-Event-ID' of the form '<epoch>-<version>'. Returns (epoch, version) or (None, None)."""
+    epoch, _, version = (event_id or "").rpartition("-")
+    try:
+        return epoch or None, int(version)
+    except ValueError:
+        return None, None
+
+@app.route("/state/stream", methods=["GET"])
+def stream_state():
+    """
+    Server-Sent Events push channel for board changes.
+    Sends a full snapshot first (or a delta when the browser reconnects with
+    Last-Event-ID), then one 'state' event with the delta for every version bump.
+    """
+    epoch, version = _parse_state_event_id(request.headers.get("Last-Event-ID") or request.args.get("since"))
+
+    def events():
+        since, since_epoch = version, epoch
+        while True:
+            if since is not None:
+                current = board_state.wait_for_change(since, timeout=STATE_STREAM_KEEPALIVE)
+                if current == since:
+                    yield ": keepalive\n\n"
+                    continue
+            # Same cached bytes for every open stream on this version
+            encoded = board_state.encoded_state(since, epoch=since_epoch)
+            since, since_epoch = encoded.version, encoded.epoch
+            yield f"id: {encoded.epoch}-{encoded.version}\nevent: state\ndata: {encoded.body.decode('utf-8')}\n\n"
+
+    response = Response(events(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Don't let a proxy buffer the stream
+    return response
 
 @app.route("/zones", methods=["POST"])
 def update_zones():
@@ -615,17 +891,81 @@ def update_zones():
 
 
 # --- NEW: QA Agent Initiation Endpoint ---
+def start_qa_pairing(agent_id, developer_agent_id, use_cache=True):
+    """
+    Puts QA agent `agent_id` on developer `developer_agent_id` and queues the 'qa' job
+    (its LLM call skips the response cache with use_cache=False).
+    Caller holds the QA agent's lock; the developer's is taken here (QA -> developer order).
+    Returns (body, status). Raises VersionConflict / LockTimeout if another request got there first.
+    """
+    with board_state.agent_lock(developer_agent_id, timeout=AGENT_LOCK_TIMEOUT):
+        # --- Check both agents ---
+        qa_agent_data = board_state.get_agent(agent_id)
+        if qa_agent_data.get("state") != "idle":
+            return {"error": f"QA Agent {agent_id} is not idle (state: {qa_agent_data.get('state')})"}, 409 # Conflict
+        if qa_agent_data.get("agent_type") != "qa":
+            return {"error": f"Agent {agent_id} is not a QA agent"}, 400
+
+        dev_agent_data = board_state.get_agent(developer_agent_id)
+        if dev_agent_data is None:
+            return {"error": f"Developer Agent {developer_agent_id} info file not found"}, 404
+        if dev_agent_data.get("state") == "under_qa":
+            return {"error": f"Developer agent {developer_agent_id} is already under QA"}, 409
+        if dev_agent_data.get("state") != "idle": # Should be idle in a finish zone
+            logging.warning(f"Developer agent {developer_agent_id} was not in 'idle' state (was '{dev_agent_data.get('state')}') when QA started.")
+            # Allow proceeding, but log it.
+        developer_agent_x = dev_agent_data.get("x") # Get dev agent position (for moving QA agent)
+        developer_agent_y = dev_agent_data.get("y")
+
+        # --- Update QA Agent State (and move it to the Developer's location, optional visual step) ---
+        job_id = new_job_id()
+        qa_updates = {
+            "state": "working_qa", "assigned_developer_id": developer_agent_id,
+            "source_block_title": f"QA for Dev {developer_agent_id}", # Set title context
+            "job_id": job_id
+        }
+        if developer_agent_x is not None and developer_agent_y is not None:
+            qa_updates["x"] = developer_agent_x; qa_updates["y"] = developer_agent_y
+        qa_previous = {k: qa_agent_data.get(k) for k in ("state", "x", "y", "assigned_developer_id", "source_block_title", "job_id")}
+        board_state.update_agent(agent_id, expected_version=qa_agent_data["version"], **qa_updates)
+        logging.info(f"QA Agent {agent_id} state set to 'working_qa', assigned to Developer {developer_agent_id}")
+
+        # --- Update Developer Agent State (claims it: nobody else can start a review of this work) ---
+        try:
+            board_state.update_agent(developer_agent_id, expected_version=dev_agent_data["version"],
+                                     state="under_qa", awaiting_qa=False)
+        except VersionConflict:
+            board_state.update_agent(agent_id, **qa_previous)  # Developer changed underneath us; undo the QA side
+            raise
+        logging.info(f"Developer Agent {developer_agent_id} state set to 'under_qa'.")
+
+        # --- Queue the QA job (still under both locks, so a full queue can be undone cleanly) ---
+        try:
+            job = job_scheduler.submit("qa", {"qa_agent_id": agent_id, "developer_agent_id": developer_agent_id,
+                                              "use_cache": use_cache},
+                                       job_id=job_id, agent_id=agent_id,
+                                       **job_urgency(reviewed_block(developer_agent_id, dev_agent_data)))
+        except QueueFull as e:
+            board_state.update_agent(agent_id, **qa_previous)
+            board_state.update_agent(developer_agent_id, state=dev_agent_data.get("state"),
+                                     awaiting_qa=dev_agent_data.get("awaiting_qa"))
+            return queue_full_body(e)
+    logging.info(f"Queued QA job {job_id} for QA Agent {agent_id} on Developer {developer_agent_id}'s files.")
+
+    return job_started_body(
+        f"QA task {'queued' if job.get('queue_position') else 'started'} for agent {agent_id} on developer {developer_agent_id}.",
+        job, qa_agent_state="working_qa", developer_agent_state="under_qa")
+
 @app.route("/agents/<agent_id>/start_qa", methods=["POST"])
+@agent_locked
 def start_qa_task(agent_id):
     """
     Assigns a completed developer task to an idle QA agent and starts the QA workflow.
     Expects {'developer_agent_id': '...'} in JSON payload.
-    Calls the imported perform_qa_work function in a thread.
+    Queues a 'qa' job (perform_qa_work) on the job scheduler; 429 when the queue is full.
+    The QA dispatcher does this automatically; the route is for manual assignment.
     """
-    qa_agent_dir = AGENTS_DIR / agent_id
-    qa_agent_info_file = qa_agent_dir / "agent_info.json"
-
-    if not qa_agent_info_file.is_file():
+    if not board_state.has_agent(agent_id):
         return jsonify({"error": "QA Agent info file not found"}), 404
 
     data = request.json
@@ -633,188 +973,183 @@ def start_qa_task(agent_id):
     if not developer_agent_id:
         return jsonify({"error": "Missing 'developer_agent_id' in request body"}), 400
 
-    developer_agent_dir = AGENTS_DIR / developer_agent_id
-    developer_agent_info_file = developer_agent_dir / "agent_info.json"
-
-    if not developer_agent_info_file.is_file():
+    if not board_state.has_agent(developer_agent_id):
         return jsonify({"error": f"Developer Agent {developer_agent_id} info file not found"}), 404
+    if job_scheduler.is_full("qa"):
+        body, status = queue_full_body(QueueFull("qa", job_scheduler.queue_limit))
+        return jsonify(body), status
 
     try:
-        # --- Update QA Agent State ---
-        with open(qa_agent_info_file, "r+") as f_qa:
-            qa_agent_data = json.load(f_qa)
-            if qa_agent_data.get("state") != "idle":
-                return jsonify({"error": f"QA Agent {agent_id} is not idle (state: {qa_agent_data.get('state')})"}), 409 # Conflict
-            if qa_agent_data.get("agent_type") != "qa":
-                 return jsonify({"error": f"Agent {agent_id} is not a QA agent"}), 400
-
-            qa_agent_data["state"] = "working_qa"
-            qa_agent_data["assigned_developer_id"] = developer_agent_id
-            qa_agent_data["source_block_title"] = f"QA for Dev {developer_agent_id}" # Set title context
-
-            f_qa.seek(0); json.dump(qa_agent_data, f_qa, indent=2); f_qa.truncate()
-        logging.info(f"QA Agent {agent_id} state set to 'working_qa', assigned to Developer {developer_agent_id}")
-
-        # --- Update Developer Agent State ---
-        developer_agent_x, developer_agent_y = None, None # For moving QA agent
-        with open(developer_agent_info_file, "r+") as f_dev:
-             dev_agent_data = json.load(f_dev)
-             if dev_agent_data.get("state") != "idle": # Should be idle in a finish zone
-                 logging.warning(f"Developer agent {developer_agent_id} was not in 'idle' state (was '{dev_agent_data.get('state')}') when QA started.")
-                 # Allow proceeding, but log it. Could also return error 409.
-
-             dev_agent_data["state"] = "under_qa" # Mark as being reviewed
-             developer_agent_x = dev_agent_data.get("x") # Get dev agent position
-             developer_agent_y = dev_agent_data.get("y")
-
-             f_dev.seek(0); json.dump(dev_agent_data, f_dev, indent=2); f_dev.truncate()
-        logging.info(f"Developer Agent {developer_agent_id} state set to 'under_qa'.")
-
-        # --- Move QA agent to Developer's location (Optional visual step) ---
-        if developer_agent_x is not None and developer_agent_y is not None:
-             with open(qa_agent_info_file, "r+") as f_qa:
-                 qa_agent_data = json.load(f_qa) # Reload to be safe
-                 qa_agent_data["x"] = developer_agent_x
-                 qa_agent_data["y"] = developer_agent_y
-                 f_qa.seek(0); json.dump(qa_agent_data, f_qa, indent=2); f_qa.truncate()
-             logging.info(f"Moved QA Agent {agent_id} to Developer {developer_agent_id}'s location ({developer_agent_x:.0f}, {developer_agent_y:.0f}).")
-
-        # --- Start QA Background Thread using imported function ---
-        thread = threading.Thread(
-            target=perform_qa_work, # <-- Use imported function
-            args=(agent_id, qa_agent_dir, developer_agent_id, str(developer_agent_dir)),
-            daemon=True
-        )
-        thread.start()
-        logging.info(f"Started background QA work thread for QA Agent {agent_id} on Developer {developer_agent_id}'s files.")
-
-        return jsonify({
-            "message": f"QA task started for agent {agent_id} on developer {developer_agent_id}.",
-            "qa_agent_state": "working_qa",
-            "developer_agent_state": "under_qa"
-            }), 200
-
+        # QA agent's lock is held by @agent_locked
+        body, status = start_qa_pairing(agent_id, developer_agent_id)
+        return jsonify(body), status
+
+    except (VersionConflict, LockTimeout) as e:
+        # Another request or worker got to one of the agents first; nothing was started
+        logging.warning(f"start_qa for QA Agent {agent_id} on Developer {developer_agent_id} lost a race: {e}")
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         logging.exception(f"Error processing start_qa command for QA Agent {agent_id}, Developer {developer_agent_id}: {e}")
         # Minimal revert attempt (best effort)
-        try:
-             with open(qa_agent_info_file, "r+") as f_qa:
-                 qa_data = json.load(f_qa); qa_data["state"] = "error"; qa_data["assigned_developer_id"] = developer_agent_id; f_qa.seek(0); json.dump(qa_data, f_qa, indent=2); f_qa.truncate()
+        try: board_state.update_agent(agent_id, state="error", assigned_developer_id=developer_agent_id)
         except Exception: pass
-        try:
-             with open(developer_agent_info_file, "r+") as f_dev:
-                 dev_data = json.load(f_dev); dev_data["state"] = "idle"; f_dev.seek(0); json.dump(dev_data, f_dev, indent=2); f_dev.truncate() # Revert dev to idle maybe?
+        try: board_state.update_agent(developer_agent_id, state="idle") # Revert dev to idle maybe?
         except Exception: pass
         return jsonify({"error": f"Failed to start QA process: {e}"}), 500
 
+# --- QA Dispatcher ---
+# Pairs idle QA agents with developers waiting for review on every board change, in one batch
+# Seconds between dispatch passes when the board is quiet (e.g. after a full QA queue)
+QA_DISPATCH_IDLE_TIMEOUT = 5
+# Seconds the dispatcher waits for a QA agent's lock before leaving it for the next pass
+QA_DISPATCH_LOCK_TIMEOUT = 1
+
+def developer_awaits_qa(agent):
+    """Idle developers whose finished work hasn't been picked up for review yet."""
+    if agent.get("state") != "idle":
+        return False
+    if "awaiting_qa" not in agent or agent["awaiting_qa"] is None:
+        # Records from before the flag existed: idle in a finish zone, as the board used to check
+        return board_state.agent_in_zone(agent["agent_id"], "finish")
+    return bool(agent["awaiting_qa"])
+
+def reviewed_block(developer_agent_id, developer=None):
+    """The block whose finished work a developer is waiting to have reviewed (None if unknown)."""
+    developer = developer or board_state.get_agent(developer_agent_id) or {}
+    block_id = developer.get("completed_block_id")
+    return board_state.get_block(block_id) if block_id else None
+
+def review_order(developer):
+    """Sort key putting the developers with the most urgent finished blocks first."""
+    block = reviewed_block(developer["agent_id"], developer) or {}
+    deadline = parse_deadline(block.get("deadline"))
+    return -block_priority(block), deadline if deadline is not None else math.inf
+
+def _agent_position(agent):
+    x, y = agent.get("x"), agent.get("y")
+    return (x, y) if isinstance(x, (int, float)) and isinstance(y, (int, float)) else (INITIAL_AGENT_X, INITIAL_AGENT_Y)
+
+def dispatch_qa():
+    """
+    Matches all idle QA agents to all waiting developers (least total walking distance)
+    and starts each pair. Returns the number of QA tasks started.
+    """
+    qa_agents = board_state.find_agents(agent_type="qa", state="idle")
+    if not qa_agents:
+        return 0
+    developers = [a for a in board_state.find_agents(agent_type="developer", state="idle") if developer_awaits_qa(a)]
+    if not developers:
+        return 0
+    # More waiting than free QA agents: the urgent reviews get the free slots, nearest QA agent each
+    developers = sorted(developers, key=review_order)[:len(qa_agents)]
+
+    cost = [[math.dist(_agent_position(qa), _agent_position(dev)) for dev in developers] for qa in qa_agents]
+    started = 0
+    for qa, match in zip(qa_agents, min_cost_assignment(cost)):
+        if match is None:
+            continue
+        qa_id, dev_id = qa["agent_id"], developers[match]["agent_id"]
+        try:
+            with board_state.agent_lock(qa_id, timeout=QA_DISPATCH_LOCK_TIMEOUT):
+                body, status = start_qa_pairing(qa_id, dev_id)
+        except (VersionConflict, LockTimeout) as e:
+            logging.info(f"[QA-Dispatch] {qa_id} -> {dev_id} skipped, agent changed concurrently: {e}")
+            continue
+        if status == 429:
+            logging.warning(f"[QA-Dispatch] QA job queue is full; {dev_id} will wait for a later pass.")
+            break
+        if status in (200, 202):
+            started += 1
+        else:
+            logging.info(f"[QA-Dispatch] {qa_id} -> {dev_id} not started ({status}): {body.get('error')}")
+    if started:
+        logging.info(f"[QA-Dispatch] Started {started} QA task(s) ({len(qa_agents)} idle QA, {len(developers)} waiting developers)")
+    return started
+
+def qa_dispatch_loop():
+    version = 0
+    while True:
+        version = board_state.wait_for_change(version, timeout=QA_DISPATCH_IDLE_TIMEOUT)
+        try:
+            dispatch_qa()
+        except Exception as e:
+            logging.error(f"[QA-Dispatch] Dispatch pass failed: {e}", exc_info=True)
+
 # --- NEW: QA Agent Completion Endpoint ---
-@app.route("/agents/<agent_id>/complete_qa_and_move", methods=["POST"])
-def complete_qa_and_move_agent(agent_id):
+def complete_qa_work(agent_id):
     """
-    Triggered by frontend after detecting 'finished_qa_work' state.
+    Runs when a QA agent enters 'finished_qa_work' (lifecycle hook) or on POST .../complete_qa_and_move.
     Moves the QA agent to an *unoccupied* drop-off zone and resets state to idle.
     Also resets the corresponding Developer agent's state.
+    Caller holds the agent's lock. Returns (body, status).
     """
-    agent_info_file = AGENTS_DIR / agent_id / "agent_info.json"
-    if not agent_id or not agent_id.startswith("agent_"): return jsonify({"error": "Invalid agent ID format"}), 400
-    if not agent_info_file.is_file(): return jsonify({"error": "Agent info file not found"}), 404
+    if not agent_id or not agent_id.startswith("agent_"): return {"error": "Invalid agent ID format"}, 400
+    if not board_state.has_agent(agent_id): return {"error": "Agent info file not found"}, 404
 
     developer_agent_id_to_reset = None # Track which dev agent was associated
 
     try:
         # --- Update QA agent state and position ---
-        with open(agent_info_file, "r+") as f:
-            agent_data = json.load(f)
-            if agent_data.get("state") != "finished_qa_work":
-                logging.warning(f"[{agent_id}-CompleteQA] QA Agent was not in 'finished_qa_work' state (was '{agent_data.get('state')}'). Proceeding anyway.")
-
-            # Get assigned dev ID *before* clearing it
-            developer_agent_id_to_reset = agent_data.get("assigned_developer_id")
-
-            agent_data["state"] = "idle"
-            agent_data["assigned_developer_id"] = None # Clear assignment
-            agent_data["source_block_title"] = None
-            # Keep agent_data["output_zip_path"]
-
-            # --- Find Empty Drop-off Zone ---
-            target_dropoff_x, target_dropoff_y = None, None
-            selected_zone_id_log = "N/A"
-
-            # 1. Get all other agent positions
-            all_agents_positions = []
-            for other_agent_dir in AGENTS_DIR.glob("agent_*"):
-                other_agent_id = other_agent_dir.name
-                if other_agent_id == agent_id: continue
-                other_info_file = other_agent_dir / "agent_info.json"
-                if other_info_file.exists():
-                    try:
-                        with open(other_info_file, "r") as f_other: info = json.load(f_other)
-                        if info.get("x") is not None and info.get("y") is not None:
-                             all_agents_positions.append({"id": other_agent_id, "x": info["x"], "y": info["y"]})
-                    except Exception: pass
-
-            # 2. Load zones and filter for *dropoff* type
-            all_zones = load_zone_positions()
-            dropoff_zones = [zone for zone in all_zones if zone.get("type") == "dropoff"]
-
-            if not dropoff_zones:
-                logging.warning(f"[{agent_id}-CompleteQA] No drop-off zones defined.")
-            else:
-                # 3. Identify occupied dropoff zones
-                occupied_dropoff_zone_ids = set()
-                for zone in dropoff_zones:
-                    zone_x, zone_y, zone_w, zone_h = zone['x'], zone['y'], zone['width'], zone['height']
-                    for other_agent_pos in all_agents_positions:
-                        agent_x, agent_y = other_agent_pos["x"], other_agent_pos["y"]
-                        if (zone_x <= agent_x < zone_x + zone_w) and \
-                           (zone_y <= agent_y < zone_y + zone_h):
-                            occupied_dropoff_zone_ids.add(zone['id'])
-                            logging.debug(f"[{agent_id}-CompleteQA] Drop-off zone {zone['id']} occupied by agent {other_agent_pos['id']}")
-                            break
-
-                # 4. Filter for empty dropoff zones
-                empty_dropoff_zones = [zone for zone in dropoff_zones if zone['id'] not in occupied_dropoff_zone_ids]
-
-                # 5. Select target dropoff zone
-                if empty_dropoff_zones:
-                    selected_zone = random.choice(empty_dropoff_zones)
-                    selected_zone_id_log = selected_zone['id']
-                    target_dropoff_x = selected_zone['x'] + selected_zone['width'] / 2
-                    target_dropoff_y = selected_zone['y'] + selected_zone['height'] / 2
-                    logging.info(f"[{agent_id}-CompleteQA] Found {len(empty_dropoff_zones)} empty drop-off zones. Selected '{selected_zone_id_log}'. Target: ({target_dropoff_x:.0f}, {target_dropoff_y:.0f})")
-                else:
-                    logging.warning(f"[{agent_id}-CompleteQA] All {len(dropoff_zones)} drop-off zones are occupied. QA Agent will remain at current location.")
-
-            # Update agent position
-            current_x, current_y = agent_data.get("x"), agent_data.get("y")
-            if target_dropoff_x is not None and target_dropoff_y is not None:
-                agent_data["x"] = target_dropoff_x
-                agent_data["y"] = target_dropoff_y
-                final_pos_log = f"drop-off zone '{selected_zone_id_log}' ({target_dropoff_x:.0f}, {target_dropoff_y:.0f})"
-            else:
-                 final_pos_log = f"previous location ({current_x:.0f}, {current_y:.0f}) as no empty drop-off zone was available"
+        agent_data = board_state.get_agent(agent_id)
+        if agent_data.get("state") != "finished_qa_work":
+            logging.warning(f"[{agent_id}-CompleteQA] QA Agent was not in 'finished_qa_work' state (was '{agent_data.get('state')}'). Proceeding anyway.")
+
+        # Get assigned dev ID *before* clearing it
+        developer_agent_id_to_reset = agent_data.get("assigned_developer_id")
+
+        updates = {"state": "idle", "assigned_developer_id": None, "source_block_title": None} # Clear assignment
+        # Keep agent_data["output_zip_path"]
+
+        # --- Find Empty Drop-off Zone ---
+        target_dropoff_x, target_dropoff_y = None, None
+        selected_zone_id_log = "N/A"
+
+        # 1-5. Drop-off zone from the batch assigner (see complete_and_move_agent)
+        dropoff_zone_count = board_state.count_zones("dropoff")
+        selected_zone = zone_assigner.assign(agent_id, "dropoff") if dropoff_zone_count else None
+
+        if not dropoff_zone_count:
+            logging.warning(f"[{agent_id}-CompleteQA] No drop-off zones defined.")
+        elif selected_zone:
+            selected_zone_id_log = selected_zone['id']
+            target_dropoff_x = selected_zone['x'] + selected_zone['width'] / 2
+            target_dropoff_y = selected_zone['y'] + selected_zone['height'] / 2
+            logging.info(f"[{agent_id}-CompleteQA] Assigned drop-off zone '{selected_zone_id_log}'. Target: ({target_dropoff_x:.0f}, {target_dropoff_y:.0f})")
+        else:
+            logging.warning(f"[{agent_id}-CompleteQA] All {dropoff_zone_count} drop-off zones are occupied. QA Agent will remain at current location.")
+
+        # Update agent position
+        current_x, current_y = agent_data.get("x"), agent_data.get("y")
+        if target_dropoff_x is not None and target_dropoff_y is not None:
+            updates["x"] = target_dropoff_x
+            updates["y"] = target_dropoff_y
+            final_pos_log = f"drop-off zone '{selected_zone_id_log}' ({target_dropoff_x:.0f}, {target_dropoff_y:.0f})"
+        else:
+             final_pos_log = f"previous location ({current_x:.0f}, {current_y:.0f}) as no empty drop-off zone was available"
 
-            # Save changes to QA agent file
-            f.seek(0)
-            json.dump(agent_data, f, indent=2)
-            f.truncate()
+        # Save changes to the QA agent record
+        try:
+            agent_data = board_state.update_agent(agent_id, expected_version=agent_data["version"], **updates)
+        finally:
+            zone_assigner.release(agent_id)
 
         logging.info(f"[{agent_id}-CompleteQA] QA Agent state set to 'idle' and moved to {final_pos_log}.")
 
         # --- Update original Developer agent state ---
         if developer_agent_id_to_reset:
-            dev_agent_info_file = AGENTS_DIR / developer_agent_id_to_reset / "agent_info.json"
-            if dev_agent_info_file.exists():
+            if board_state.has_agent(developer_agent_id_to_reset):
                 try:
-                    with open(dev_agent_info_file, "r+") as f_dev:
-                        dev_data = json.load(f_dev)
-                        if dev_data.get("state") == "under_qa":
-                            dev_data["state"] = "idle" # Or "qa_complete"? Let's use idle.
-                            dev_data["source_block_title"] = "QA Completed" # Update title
-                            f_dev.seek(0); json.dump(dev_data, f_dev, indent=2); f_dev.truncate()
-                            logging.info(f"[{agent_id}-CompleteQA] Reset Developer agent {developer_agent_id_to_reset} state to '{dev_data['state']}'.")
-                        else:
-                            logging.warning(f"[{agent_id}-CompleteQA] Developer agent {developer_agent_id_to_reset} was not in 'under_qa' state (was '{dev_data.get('state')}'). State not reset.")
+                    with board_state.agent_lock(developer_agent_id_to_reset, timeout=AGENT_LOCK_TIMEOUT):
+                        dev_data = board_state.get_agent(developer_agent_id_to_reset)
+                        dev_reset = dev_data.get("state") == "under_qa"
+                        if dev_reset:
+                            # Or "qa_complete"? Let's use idle.
+                            board_state.update_agent(developer_agent_id_to_reset, expected_version=dev_data["version"],
+                                                     state="idle", source_block_title="QA Completed")
+                    if dev_reset:
+                        logging.info(f"[{agent_id}-CompleteQA] Reset Developer agent {developer_agent_id_to_reset} state to 'idle'.")
+                    else:
+                        logging.warning(f"[{agent_id}-CompleteQA] Developer agent {developer_agent_id_to_reset} was not in 'under_qa' state (was '{dev_data.get('state')}'). State not reset.")
                 except Exception as dev_reset_err:
                      logging.error(f"[{agent_id}-CompleteQA] Error resetting state for developer agent {developer_agent_id_to_reset}: {dev_reset_err}")
             else:
@@ -823,26 +1158,468 @@ def complete_qa_and_move_agent(agent_id):
             logging.warning(f"[{agent_id}-CompleteQA] No developer agent ID was associated with this QA task completion. No developer state reset.")
 
 
-        return jsonify({
+        return {
             "message": f"QA Agent {agent_id} moved to {final_pos_log} and set to idle.",
             "new_state": "idle",
             "new_x": agent_data.get("x"),
             "new_y": agent_data.get("y")
-        }), 200
+        }, 200
 
+    except VersionConflict as e:
+        logging.warning(f"[{agent_id}-CompleteQA] QA Agent changed while completing, not moved: {e}")
+        return {"error": str(e)}, 409
     except Exception as e:
         logging.error(f"[{agent_id}-CompleteQA] Error completing QA move: {e}", exc_info=True)
         # Attempt to set state to error
-        try:
-            with open(agent_info_file, "r+") as f:
-                agent_data = json.load(f); agent_data["state"] = "error"; agent_data["source_block_title"] = "Error during QA final move"
-                f.seek(0); json.dump(agent_data, f, indent=2); f.truncate()
+        try: board_state.update_agent(agent_id, state="error", source_block_title="Error during QA final move")
         except Exception: pass
-        return jsonify({"error": "Failed to complete QA agent move"}), 500
+        return {"error": "Failed to complete QA agent move"}, 500
+
+@app.route("/agents/<agent_id>/complete_qa_and_move", methods=["POST"])
+@agent_locked
+def complete_qa_and_move_agent(agent_id):
+    """Manual trigger for complete_qa_work; the lifecycle hook normally runs it."""
+    body, status = complete_qa_work(agent_id)
+    return jsonify(body), status
 
 # --- END Add ---
 
+# --- Agent Lifecycle Hooks ---
+# Completion transitions run on the server as soon as a worker reports them, with or without a browser open
+agent_lifecycle = AgentLifecycle(board_state)
+
+@agent_lifecycle.on_enter("finished_work")
+def on_developer_finished(agent_id):
+    """Finish zone move; the QA dispatcher then picks the developer up (awaiting_qa)."""
+    with board_state.agent_lock(agent_id, timeout=AGENT_LOCK_TIMEOUT):
+        if (board_state.get_agent(agent_id) or {}).get("state") != "finished_work":
+            return  # Completed by another path in the meantime
+        body, status = complete_developer_work(agent_id)
+    if status != 200:
+        logging.warning(f"[{agent_id}-Lifecycle] Completion returned {status}: {body.get('error')}")
+
+@agent_lifecycle.on_enter("finished_qa_work")
+def on_qa_finished(agent_id):
+    """Drop-off zone move and release of the reviewed developer."""
+    with board_state.agent_lock(agent_id, timeout=AGENT_LOCK_TIMEOUT):
+        if (board_state.get_agent(agent_id) or {}).get("state") != "finished_qa_work":
+            return
+        body, status = complete_qa_work(agent_id)
+    if status != 200:
+        logging.warning(f"[{agent_id}-Lifecycle] QA completion returned {status}: {body.get('error')}")
+
+
+
+@agent_lifecycle.on_enter("error")
+def on_agent_error(agent_id):
+    """A developer that failed gives up its block as 'failed', so the dispatcher doesn't hand it out again."""
+    agent = board_state.get_agent(agent_id) or {}
+    block_id = agent.get("assigned_block_id")
+    if block_id and board_state.release_block(block_id, agent_id, status="failed"):
+        logging.warning(f"[{agent_id}-Lifecycle] Block {block_id} marked 'failed'")
+
+
+# --- Dead Letters ---
+# Work that left its agent in 'error' is kept for a (bulk) retry instead of a manual reset per agent
+dead_letters = DeadLetterQueue(BASE_OUTPUT / "jobs" / "dead_letters.json")
+# Seconds a scheduled retry waits again when the job queue is full or the agent is busy
+DEAD_LETTER_BUSY_DELAY = 30
+# Seconds the retrier sleeps between checks when nothing is scheduled
+DEAD_LETTER_IDLE_TIMEOUT = 60
+
+@agent_lifecycle.on_enter("error")
+def record_dead_letter(agent_id):
+    """Records the work the agent failed on, with the cause and the last step its checkpoint holds."""
+    agent = board_state.get_agent(agent_id)
+    if agent is None:
+        return
+    if agent.get("agent_type") == "qa":
+        job_type, target = "qa", agent.get("assigned_developer_id")
+    else:
+        job_type, target = "develop", agent.get("assigned_block_id")
+    if not target:
+        return  # Failed before it had work assigned; nothing to run again
+    job = job_scheduler.get_job(agent["job_id"]) if agent.get("job_id") else None
+    cause = (job or {}).get("error") or agent.get("error_details") or agent.get("source_block_title")
+    zip_path = agent.get("output_zip_path") or ""
+    entry = dead_letters.record(
+        job_type, agent_id, target, job_id=agent.get("job_id"), cause=cause,
+        marker_id=((job or {}).get("args") or {}).get("marker_id"),
+        checkpoint=checkpoint_summary(AGENTS_DIR / agent_id / "checkpoint.json"),
+        error_zip=zip_path if zip_path.endswith("_error.zip") else None)
+    if entry:  # None when a sweep re-ran the hook for a failure already recorded
+        logging.warning(f"[{agent_id}-Lifecycle] {job_type} work on {target} dead-lettered "
+                        f"(attempt {entry['attempts']}): {cause}")
+
+@agent_lifecycle.on_enter("finished_work")
+@agent_lifecycle.on_enter("finished_qa_work")
+def clear_dead_letters(agent_id):
+    """A retried piece of work that went through leaves the dead-letter queue."""
+    dead_letters.forget_agent(agent_id, statuses=("retried",))
+
+def remove_error_zip(entry):
+    if entry.get("error_zip"):
+        try:
+            Path(entry["error_zip"]).unlink(missing_ok=True)
+        except OSError as e:
+            logging.warning(f"Could not remove QA error zip {entry['error_zip']}: {e}")
+
+def retry_dead_letter(entry):
+    """
+    Starts a dead-lettered piece of work again, resuming from the agent's checkpoint.
+    The steps it runs again (the failed one onwards) bypass the LLM response cache,
+    which would otherwise hand back the reply the work just failed on.
+    Returns (body, status) like the routes starting work; 410 when the agent is gone or
+    no longer in error, so there is nothing left to retry.
+    """
+    agent_id = entry["agent_id"]
+    if not board_state.has_agent(agent_id):
+        return {"error": f"Agent {agent_id} no longer exists"}, 410
+    with board_state.agent_lock(agent_id, timeout=AGENT_LOCK_TIMEOUT):
+        agent = board_state.get_agent(agent_id)
+        if agent is None or agent.get("state") != "error":
+            return {"error": f"Agent {agent_id} is no longer in error (state: {(agent or {}).get('state')})"}, 410
+        if entry["job_type"] == "develop":
+            board_state.update_agent(agent_id, expected_version=agent["version"], error_details=None)
+            return start_block_work(agent_id, entry["target"], marker_id=entry.get("marker_id"), use_cache=False)
+        board_state.update_agent(agent_id, expected_version=agent["version"], state="idle",
+                                 error_details=None, output_zip_path=None)
+        release_reviewed_developer(entry["target"])
+        return start_qa_pairing(agent_id, entry["target"], use_cache=False)
+
+def dead_letter_retry_loop():
+    while True:
+        for entry in dead_letters.wait_due(DEAD_LETTER_IDLE_TIMEOUT):
+            entry_id = entry["entry_id"]
+            try:
+                body, status = retry_dead_letter(entry)
+            except (LockTimeout, VersionConflict) as e:
+                dead_letters.reschedule(entry_id, DEAD_LETTER_BUSY_DELAY, str(e))
+                continue
+            except Exception as e:
+                logging.error(f"[Dead-Letters] Retry of {entry_id} failed: {e}", exc_info=True)
+                dead_letters.mark_dead(entry_id, str(e))
+                continue
+            if status in (200, 202):
+                dead_letters.mark_retried(entry_id, body["job_id"])
+                remove_error_zip(entry)
+                logging.info(f"[Dead-Letters] Retrying {entry_id} as job {body['job_id']} (attempt {entry['attempts'] + 1})")
+            elif status == 429:
+                dead_letters.reschedule(entry_id, DEAD_LETTER_BUSY_DELAY, body.get("error"))
+            elif status == 410:
+                dead_letters.remove(entry_id, status="retrying")
+                logging.info(f"[Dead-Letters] Dropped {entry_id}: {body.get('error')}")
+            else:
+                dead_letters.mark_dead(entry_id, body.get("error"))
+                logging.warning(f"[Dead-Letters] Retry of {entry_id} could not start ({status}): {body.get('error')}")
+
+@app.route("/dead_letters", methods=["GET"])
+def list_dead_letters():
+    """Failed work awaiting a retry. Optional filters: ?status=dead|scheduled|retried&type=develop|qa&agent_id=..."""
+    entries = dead_letters.list_entries(status=request.args.get("status"), job_type=request.args.get("type"),
+                                        agent_id=request.args.get("agent_id"))
+    return jsonify({"dead_letters": entries})
+
+@app.route("/dead_letters/retry", methods=["POST"])
+def retry_dead_letters():
+    """
+    Re-enqueues dead-lettered work with backoff: {'entry_ids': [...]}, or {'all': true} (optionally
+    with 'type': develop|qa) for everything dead. 'stagger' sets the seconds between entries.
+    """
+    data = request.json or {}
+    if data.get("entry_ids"):
+        entry_ids = list(data["entry_ids"])
+    elif data.get("all") is True:
+        entry_ids = [e["entry_id"] for e in dead_letters.list_entries(status="dead", job_type=data.get("type"))]
+    else:
+        return jsonify({"error": "Expected {'entry_ids': [...]} or {'all': true}"}), 400
+    try:
+        stagger = max(float(data.get("stagger", RETRY_STAGGER)), 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "'stagger' must be a number of seconds"}), 400
+    scheduled = dead_letters.schedule(entry_ids, stagger=stagger)
+    logging.info(f"[Dead-Letters] Scheduled {len(scheduled)} of {len(entry_ids)} entries for retry")
+    return jsonify({"scheduled": scheduled, "skipped": len(entry_ids) - len(scheduled)}), 202
+
+@app.route("/dead_letters/<path:entry_id>", methods=["DELETE"])
+def discard_dead_letter(entry_id):
+    """Gives up on failed work: the agent goes back to idle (a reviewed developer back to awaiting QA)."""
+    entry = dead_letters.get(entry_id)
+    if entry is None:
+        return jsonify({"error": f"Dead letter {entry_id} not found"}), 404
+    agent_id = entry["agent_id"]
+    try:
+        if board_state.has_agent(agent_id):
+            with board_state.agent_lock(agent_id, timeout=AGENT_LOCK_TIMEOUT):
+                agent = board_state.get_agent(agent_id)
+                if agent and agent.get("state") == "error":
+                    board_state.update_agent(agent_id, expected_version=agent["version"], state="idle",
+                                             assigned_block_id=None, assigned_developer_id=None,
+                                             source_block_title=None, error_details=None, output_zip_path=None)
+            if entry["job_type"] == "qa":
+                release_reviewed_developer(entry["target"])
+    except (LockTimeout, VersionConflict) as e:
+        return jsonify({"error": f"Agent {agent_id} is busy, try again ({e})"}), 409
+    dead_letters.remove(entry_id)
+    remove_error_zip(entry)
+    return jsonify({"message": f"Discarded {entry_id}", "entry": entry}), 200
+
+
+# --- Block Dispatcher ---
+# With auto-dispatch on, idle developers claim pending blocks on every board change, no drag needed
+BLOCK_DISPATCH_ENABLED = os.getenv("AUTO_DISPATCH", "").lower() in ("1", "true", "yes", "on")
+# Seconds between dispatch passes when the board is quiet
+BLOCK_DISPATCH_IDLE_TIMEOUT = 5
+# Seconds the dispatcher waits for a developer's lock before leaving it for the next pass
+BLOCK_DISPATCH_LOCK_TIMEOUT = 1
+
+block_dispatch = {"enabled": BLOCK_DISPATCH_ENABLED}
+
+def developer_can_take_block(agent, qa_on_board):
+    """
+    Idle developers with no develop job queued or running, except those whose last block
+    still waits for a QA agent to review it.
+    """
+    if agent.get("state") != "idle" or job_scheduler.has_active_job(agent["agent_id"]):
+        return False
+    return not (qa_on_board and developer_awaits_qa(agent))
 
+def dispatch_blocks():
+    """
+    Hands the first pending blocks to idle developers, one claim per developer. A claim
+    whose job doesn't start is released, so the block stays in the pending queue.
+    Returns the number of develop jobs started.
+    """
+    if not block_dispatch["enabled"] or not board_state.count_blocks(status="pending"):
+        return 0
+    if job_scheduler.is_full("develop"):
+        return 0  # Nothing could start; don't take blocks out of the queue for nothing
+    qa_on_board = bool(board_state.find_agents(agent_type="qa"))
+    developers = [a for a in board_state.find_agents(agent_type="developer", state="idle")
+                  if developer_can_take_block(a, qa_on_board)]
+    started = 0
+    for developer in developers:
+        agent_id = developer["agent_id"]
+        try:
+            with board_state.agent_lock(agent_id, timeout=BLOCK_DISPATCH_LOCK_TIMEOUT):
+                agent = board_state.get_agent(agent_id)
+                if agent is None or not developer_can_take_block(agent, qa_on_board):
+                    continue
+                block = board_state.claim_block(agent_id, key=block_schedule_key(duration_estimator))
+                if block is None:
+                    break  # Queue drained
+                body, status = start_block_work(agent_id, block["block_id"])
+                if status not in (200, 202):
+                    board_state.release_block(block["block_id"], agent_id)
+        except LockTimeout as e:
+            logging.info(f"[Block-Dispatch] {agent_id} skipped, busy: {e}")
+            continue
+        if status == 429:
+            logging.warning(f"[Block-Dispatch] Develop job queue is full; pending blocks wait for a later pass.")
+            break
+        if status in (200, 202):
+            started += 1
+        else:
+            logging.info(f"[Block-Dispatch] {agent_id} -> {block['block_id']} not started ({status}): {body.get('error')}")
+    if started:
+        logging.info(f"[Block-Dispatch] Started {started} block(s) ({len(developers)} idle developers)")
+    return started
+
+def block_dispatch_loop():
+    version = 0
+    while True:
+        version = board_state.wait_for_change(version, timeout=BLOCK_DISPATCH_IDLE_TIMEOUT)
+        try:
+            dispatch_blocks()
+        except Exception as e:
+            logging.error(f"[Block-Dispatch] Dispatch pass failed: {e}", exc_info=True)
+
+@app.route("/dispatch", methods=["GET", "POST"])
+def block_dispatch_settings():
+    """GET: auto-dispatch status. POST {'enabled': true|false}: switches it on or off."""
+    if request.method == "POST":
+        data = request.json or {}
+        if not isinstance(data.get("enabled"), bool):
+            return jsonify({"error": "Expected {'enabled': true|false}"}), 400
+        block_dispatch["enabled"] = data["enabled"]
+        logging.info(f"Block auto-dispatch {'enabled' if data['enabled'] else 'disabled'}")
+    return jsonify({"enabled": block_dispatch["enabled"],
+                    "pending_blocks": board_state.count_blocks(status="pending")})
+
+
+# --- Remote Workers (worker.py) ---
+# Workers on other hosts lease queued jobs, run the pipelines against a copy of the agent's
+# workspace and report back here; the board itself is only ever changed by this server.
+# Set WORKER_TOKEN to require it in the X-Worker-Token header of every worker request;
+# without one, only workers on this host are served.
+WORKER_TOKEN = os.getenv("WORKER_TOKEN")
+if not WORKER_TOKEN:
+    logging.warning("WORKER_TOKEN is not set: the /worker/ endpoints only accept requests from this host")
+# Longest a lease request is held open waiting for a job
+WORKER_LEASE_MAX_WAIT = 20
+
+def is_local_request():
+    """Whether the request came from a loopback address."""
+    try:
+        address = ipaddress.ip_address(request.remote_addr or "")
+    except ValueError:
+        return False
+    return (getattr(address, "ipv4_mapped", None) or address).is_loopback
+
+def worker_route(route):
+    """
+    Rejects /worker/... requests without the shared WORKER_TOKEN, or, when none is set,
+    from other hosts (an open endpoint would let anyone take jobs and rewrite agents).
+    """
+    @functools.wraps(route)
+    def wrapper(*args, **kwargs):
+        if WORKER_TOKEN:
+            if request.headers.get("X-Worker-Token") != WORKER_TOKEN:
+                return jsonify({"error": "Invalid worker token"}), 403
+        elif not is_local_request():
+            return jsonify({"error": "Remote workers need WORKER_TOKEN set on the server"}), 403
+        return route(*args, **kwargs)
+    return wrapper
+
+def leased_job(job_id, worker_id):
+    """The job if `worker_id` holds its lease, else an error response tuple."""
+    if not worker_id:
+        return None, (jsonify({"error": "worker_id is required"}), 400)
+    job = job_scheduler.holds_lease(job_id, worker_id)
+    if job is None:
+        return None, (jsonify({"error": f"Worker {worker_id} holds no lease on job {job_id}"}), 409)
+    return job, None
+
+@app.route("/worker/lease", methods=["POST"])
+@worker_route
+def worker_lease():
+    """
+    {'worker_id', 'types': ['develop', 'qa'], 'wait': seconds}: hands out the most urgent
+    queued job (200 with the job and lease length), or 204 if none turned up in time.
+    """
+    data = request.json or {}
+    worker_id = data.get("worker_id")
+    if not worker_id:
+        return jsonify({"error": "worker_id is required"}), 400
+    wait = min(max(float(data.get("wait") or 0), 0), WORKER_LEASE_MAX_WAIT)
+    job = job_scheduler.lease(worker_id, data.get("types") or ["develop", "qa"], lease_seconds=LEASE_SECONDS, wait=wait)
+    if job is None:
+        return "", 204
+    return jsonify({"job": job, "lease_seconds": LEASE_SECONDS})
+
+@app.route("/worker/jobs/<job_id>/heartbeat", methods=["POST"])
+@worker_route
+def worker_heartbeat(job_id):
+    """Renews the lease; tells the worker whether the job was cancelled meanwhile. 409 once the lease is lost."""
+    data = request.json or {}
+    try:
+        return jsonify(job_scheduler.heartbeat(job_id, data.get("worker_id"), lease_seconds=LEASE_SECONDS))
+    except LeaseLost as e:
+        return jsonify({"error": str(e)}), 409
+
+@app.route("/worker/jobs/<job_id>/complete", methods=["POST"])
+@worker_route
+def worker_complete(job_id):
+    """{'worker_id', 'status': done|failed|cancelled|timed_out, 'error'}: ends the leased job."""
+    data = request.json or {}
+    try:
+        job = job_scheduler.complete(job_id, data.get("worker_id"), data.get("status"), data.get("error"))
+    except LeaseLost as e:
+        return jsonify({"error": str(e)}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(job)
+
+@app.route("/worker/jobs/<job_id>/artifacts", methods=["PUT"])
+@worker_route
+def worker_upload_artifacts(job_id):
+    """
+    Zip of the files a leased job produced (see core.workspace). Only the job's own agent
+    workspace (never its agent_info.json), a QA job's developer files and output/final_zips/
+    are written.
+    """
+    job, error = leased_job(job_id, request.args.get("worker_id"))
+    if error:
+        return error
+    allowed = workspace_paths(job["agent_id"]) + ["final_zips/"]
+    if job["type"] == "qa":
+        allowed.append(f"agents/{job['args']['developer_agent_id']}/files/")
+    try:
+        written = unpack_workspace(BASE_OUTPUT, request.get_data(), allowed)
+    except Exception as e:
+        logging.error(f"Bad artifact upload for job {job_id}: {e}")
+        return jsonify({"error": f"Unreadable artifact archive: {e}"}), 400
+    logging.info(f"Stored {len(written)} file(s) uploaded by worker {job['worker_id']} for job {job_id}")
+    return jsonify({"written": len(written)})
+
+@app.route("/worker/agents/<agent_id>", methods=["GET"])
+@worker_route
+def worker_get_agent(agent_id):
+    agent = board_state.get_agent(agent_id)
+    if agent is None:
+        return jsonify({"error": f"Agent {agent_id} not found"}), 404
+    return jsonify(agent)
+
+@app.route("/worker/agents/<agent_id>/workspace", methods=["GET"])
+@worker_route
+def worker_get_workspace(agent_id):
+    """The agent's task, files, logs and checkpoint as a zip, for a worker about to run its job."""
+    if not board_state.has_agent(agent_id):
+        return jsonify({"error": f"Agent {agent_id} not found"}), 404
+    return Response(pack_workspace(BASE_OUTPUT, agent_id), mimetype="application/zip")
+
+@app.route("/worker/agents/<agent_id>/update", methods=["POST"])
+@worker_route
+def worker_update_agent(agent_id):
+    """
+    {'worker_id', 'job_id', 'expected_version', 'fields'}: a state update from a leased job's
+    pipeline. Only the job's own agent can be changed; a stale version answers 409.
+    """
+    data = request.json or {}
+    job, error = leased_job(data.get("job_id"), data.get("worker_id"))
+    if error:
+        return error
+    if job.get("agent_id") != agent_id:
+        return jsonify({"error": f"Job {job['job_id']} does not belong to agent {agent_id}"}), 403
+    try:
+        with board_state.agent_lock(agent_id, timeout=AGENT_LOCK_TIMEOUT):
+            agent = board_state.update_agent(agent_id, expected_version=data.get("expected_version"),
+                                             **(data.get("fields") or {}))
+    except VersionConflict as e:
+        return jsonify({"error": str(e), "current_version": e.actual}), 409
+    except LockTimeout as e:
+        return jsonify({"error": f"Agent {agent_id} is busy, try again"}), 409
+    if agent is None:
+        return jsonify({"error": f"Agent {agent_id} not found"}), 404
+    return jsonify(agent)
+
+@app.route("/worker/agents/<agent_id>/progress", methods=["POST"])
+@worker_route
+def worker_set_progress(agent_id):
+    """{'worker_id', 'job_id', 'progress'}: live progress of a leased job (null clears it)."""
+    data = request.json or {}
+    job, error = leased_job(data.get("job_id"), data.get("worker_id"))
+    if error:
+        return error
+    if job.get("agent_id") != agent_id:
+        return jsonify({"error": f"Job {job['job_id']} does not belong to agent {agent_id}"}), 403
+    board_state.set_progress(agent_id, data.get("progress"))
+    return jsonify({"ok": True})
+
+
+# --- Background Services ---
+# BACKGROUND_SERVICES=0 serves the API without them (e.g. in tests, which drive the dispatchers themselves).
+# This process is the board's only writer (see core/state_store.py), so there are no extra web processes
+# to leave them out of; scale job execution out with worker.py instead.
+BACKGROUND_SERVICES = os.getenv("BACKGROUND_SERVICES", "1").lower() not in ("0", "false", "no", "off")
+if BACKGROUND_SERVICES:
+    llm_service.warm_up()  # Connects to the providers in the background
+    job_scheduler.start()
+    resume_interrupted_work()
+    agent_lifecycle.start()
+    threading.Thread(target=qa_dispatch_loop, name="qa-dispatcher", daemon=True).start()
+    threading.Thread(target=block_dispatch_loop, name="block-dispatcher", daemon=True).start()
+    threading.Thread(target=dead_letter_retry_loop, name="dead-letter-retrier", daemon=True).start()
 
 # --- Main Execution ---
 if __name__ == "__main__":
@@ -850,4 +1627,5 @@ if __name__ == "__main__":
     # For development, this might work, but for production, consider a proper WSGI/ASGI server (like Gunicorn or Uvicorn+Hypercorn)
     # Also, Flask context might not be available in background threads easily.
     # For now, we pass needed data explicitly. Be mindful of shared state access.
-    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True) # Add threaded=True for basic multi-thread handling in dev server
+    # No reloader: its watcher process imports this module too, and only one process may load the board
+    app.run(debug=True, use_reloader=False, host='0.0.0.0', port=5000, threaded=True) # Add threaded=True for basic multi-thread handling in dev server
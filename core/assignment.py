@@ -0,0 +1,176 @@
+"""
+assignment.py
+
+Batch assignment of finishing agents to free finish / drop-off zones.
+
+Completion requests that arrive within a short collection window are solved
+together: every free zone slot (a zone holds `capacity` agents, default 1) is
+a column, every waiting agent a row, the cost is the straight-line travel
+distance to the zone centre, and the minimum total cost matching is taken
+(Hungarian algorithm). Zones handed out are reserved until the agent is seen
+inside them, so a later batch can't give the same slot away again.
+"""
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds completions are collected before a batch is solved
+ASSIGNMENT_WINDOW = 0.2
+# Seconds a handed-out slot stays reserved if the agent never shows up in it
+RESERVATION_TTL = 10
+
+
+def min_cost_assignment(cost: list) -> list:
+    """
+    Minimum total cost matching for a rectangular cost matrix (rows x cols).
+    Returns, for each row, the matched column index or None (when rows > cols).
+    """
+    n = len(cost)
+    m = len(cost[0]) if n else 0
+    if n == 0 or m == 0:
+        return [None] * n
+    if n > m:
+        # Solve the transpose; each column picks a row, leftover rows stay unmatched
+        by_col = min_cost_assignment([[cost[i][j] for i in range(n)] for j in range(m)])
+        result = [None] * n
+        for j, i in enumerate(by_col):
+            if i is not None:
+                result[i] = j
+        return result
+
+    # Hungarian algorithm with potentials, O(n^2 * m)
+    inf = float("inf")
+    u, v = [0.0] * (n + 1), [0.0] * (m + 1)
+    p, way = [0] * (m + 1), [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = [inf] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0, delta, j1 = p[j0], inf, 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = cost[i0 - 1][j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j], way[j] = cur, j0
+                    if minv[j] < delta:
+                        delta, j1 = minv[j], j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    result = [None] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            result[p[j] - 1] = j - 1
+    return result
+
+
+def zone_center(zone: dict) -> tuple:
+    return zone["x"] + zone["width"] / 2, zone["y"] + zone["height"] / 2
+
+
+class _Request:
+    def __init__(self, agent_id: str, kind: str):
+        self.agent_id = agent_id
+        self.kind = kind
+        self.zone = None
+        self.done = threading.Event()
+
+
+class ZoneAssigner:
+    """
+    Collects zone requests for ASSIGNMENT_WINDOW seconds and solves each batch in one pass.
+    assign() blocks the calling request thread until its batch is solved.
+    """
+
+    def __init__(self, board_state, window: float = ASSIGNMENT_WINDOW):
+        self.board_state = board_state
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = []
+        self._timer = None
+        self._reservations = {}  # agent_id -> (zone_id, expires_at)
+
+    def assign(self, agent_id: str, kind: str, timeout: float = 10):
+        """
+        Returns the zone dict `agent_id` should move to ('finish' or 'dropoff'),
+        or None when every slot of that kind is taken.
+        """
+        request = _Request(agent_id, kind)
+        with self._lock:
+            self._pending.append(request)
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self._solve_pending)
+                self._timer.daemon = True
+                self._timer.start()
+        if not request.done.wait(timeout):
+            logger.warning(f"[{agent_id}] Zone assignment timed out after {timeout}s")
+        return request.zone
+
+    def release(self, agent_id: str):
+        """Drops the agent's reservation once it has moved (or given up on) its zone."""
+        with self._lock:
+            self._reservations.pop(agent_id, None)
+
+    def _solve_pending(self):
+        with self._lock:
+            batch, self._pending, self._timer = self._pending, [], None
+            try:
+                for kind in sorted({r.kind for r in batch}):
+                    self._solve(kind, [r for r in batch if r.kind == kind])
+            except Exception as e:
+                logger.error(f"Zone assignment batch failed: {e}", exc_info=True)
+            finally:
+                for request in batch:
+                    request.done.set()
+
+    def _solve(self, kind: str, requests: list):
+        """One batch of one zone kind. Caller holds self._lock."""
+        now = time.monotonic()
+        batch_agents = {r.agent_id for r in requests}
+        for agent_id in [a for a, (_, expires_at) in self._reservations.items() if expires_at < now or a in batch_agents]:
+            del self._reservations[agent_id]  # Never showed up, or asking again
+
+        # Slots: capacity minus agents already inside (other than this batch) minus live reservations
+        slots = []
+        for zone, free in self.board_state.open_zone_slots(kind, exclude_agent_ids=batch_agents):
+            occupants = self.board_state.zone_occupants(zone["id"])
+            for agent_id, (zone_id, _) in list(self._reservations.items()):
+                if zone_id != zone["id"]:
+                    continue
+                if agent_id in occupants:
+                    del self._reservations[agent_id]  # Arrived; counted as an occupant now
+                else:
+                    free -= 1
+            slots.extend([zone] * max(free, 0))
+
+        positions = []
+        for request in requests:
+            agent = self.board_state.get_agent(request.agent_id) or {}
+            x, y = agent.get("x"), agent.get("y")
+            positions.append((x, y) if isinstance(x, (int, float)) and isinstance(y, (int, float)) else (0, 0))
+
+        cost = [[math.dist(pos, zone_center(zone)) for zone in slots] for pos in positions]
+        matches = min_cost_assignment(cost)
+        for request, match in zip(requests, matches):
+            if match is not None:
+                request.zone = slots[match]
+                self._reservations[request.agent_id] = (request.zone["id"], now + RESERVATION_TTL)
+        logger.info(f"Zone assignment ({kind}): {len(requests)} agent(s), {len(slots)} free slot(s), "
+                    f"{sum(m is not None for m in matches)} assigned")
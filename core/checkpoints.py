@@ -0,0 +1,117 @@
+"""
+checkpoints.py
+
+Step checkpoints for the agent pipelines, kept in the agent's workspace.
+
+Every step (analysis, plan, each file, validation, fixes, README, ...) stores
+its output together with a hash of its inputs (the prompt). When a job runs
+again after a crash or restart, steps whose inputs hash still matches return
+the stored output instead of calling the LLM again, so the pipeline picks up
+at the first step that didn't finish. A checkpoint belongs to one task; a
+different task in the same workspace starts from scratch.
+
+    checkpoint = PipelineCheckpoint(agent_dir / "checkpoint.json", task=task_info)
+    analysis = checkpoint.step("analysis", prompt, lambda: llm.generate_sync(...))
+    ...
+    checkpoint.clear()  # Task done; the next run does everything afresh
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+from core.storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+def inputs_hash(inputs) -> str:
+    """Stable hash of any JSON-serializable step input."""
+    encoded = json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def read_checkpoint(path: Path):
+    """The stored checkpoint at `path`, or None when there is none (or it can't be read)."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable checkpoint {path}: {e}")
+        return None
+
+
+def checkpoint_summary(path: Path):
+    """
+    The steps finished in the checkpoint at `path`, oldest first, and the last of them:
+    {'steps': [...], 'last_step': name, 'last_completed_at': epoch seconds}. None without steps.
+    """
+    stored = read_checkpoint(path) or {}
+    steps = sorted((stored.get("steps") or {}).items(), key=lambda item: item[1].get("completed_at") or 0)
+    if not steps:
+        return None
+    last_name, last = steps[-1]
+    return {"steps": [name for name, _ in steps], "last_step": last_name, "last_completed_at": last.get("completed_at")}
+
+
+class PipelineCheckpoint:
+    def __init__(self, path: Path, task):
+        self.path = Path(path)
+        self.task_hash = inputs_hash(task)
+        self._lock = threading.Lock()
+        self._data = {"task_hash": self.task_hash, "steps": {}}
+        self.resumed_steps = 0  # Steps answered from the checkpoint in this run
+        stored = read_checkpoint(self.path)
+        if stored and stored.get("task_hash") == self.task_hash:
+            self._data = stored
+            if stored.get("steps"):
+                logger.info(f"Resuming from checkpoint {self.path} ({len(stored['steps'])} step(s) done)")
+        elif stored:
+            logger.info(f"Discarding checkpoint {self.path} left by a different task")
+
+    def get(self, name: str, inputs):
+        """The stored output of step `name` if it ran with these inputs, else None."""
+        with self._lock:
+            entry = self._data["steps"].get(name)
+            if entry is None or entry.get("inputs_hash") != inputs_hash(inputs):
+                return None
+            return entry["output"]
+
+    def save(self, name: str, inputs, output):
+        with self._lock:
+            self._data["steps"][name] = {"inputs_hash": inputs_hash(inputs), "output": output,
+                                         "completed_at": time.time()}
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                write_json_atomic(self.path, self._data)
+            except Exception as e:
+                logger.error(f"Failed to write checkpoint {self.path}: {e}")
+
+    def step(self, name: str, inputs, compute, keep=None):
+        """
+        Returns step `name`'s output: from the checkpoint when its inputs are unchanged,
+        otherwise from `compute()`, which is then saved unless `keep(output)` says no
+        (e.g. an error reply that should be retried next time).
+        """
+        output = self.get(name, inputs)
+        if output is not None:
+            self.resumed_steps += 1
+            logger.info(f"Checkpoint hit for step '{name}' ({self.path.parent.name})")
+            return output
+        output = compute()
+        if keep is None or keep(output):
+            self.save(name, inputs, output)
+        return output
+
+    def clear(self):
+        """Forgets the checkpoint once the task has finished."""
+        with self._lock:
+            self._data = {"task_hash": self.task_hash, "steps": {}}
+            try:
+                self.path.unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"Could not remove checkpoint {self.path}: {e}")
@@ -0,0 +1,191 @@
+"""
+dead_letters.py
+
+Dead-letter queue for developer and QA work that ended with the agent in
+'error' (a pipeline failure, a job past its deadline, a worker crash).
+
+Each entry records what to run again (job type, agent, block or reviewed
+developer), why it failed and how far the pipeline got (the last step in the
+agent's checkpoint, which a retry resumes from). An agent has at most one
+entry per piece of work: failing again replaces it and counts the attempt.
+
+Retries are scheduled rather than run at once: entry number i of a bulk retry
+becomes due after the entry's backoff (RETRY_BASE_DELAY doubled per earlier
+attempt, capped at RETRY_MAX_DELAY) plus i * RETRY_STAGGER, so re-enqueueing
+dozens of agents after a provider outage doesn't hit the provider all at once.
+Entries are kept in output/jobs/dead_letters.json.
+
+    entry status: dead -> scheduled -> retrying -> retried (the work is queued again),
+                  or back to dead when the retry couldn't start (see retry_error)
+"""
+import copy
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+
+from core.storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+# Seconds before the first retry of an entry; doubled for every earlier attempt
+RETRY_BASE_DELAY = 10
+RETRY_MAX_DELAY = 600
+# Seconds between consecutive entries of one bulk retry
+RETRY_STAGGER = 2
+
+STATUSES = ("dead", "scheduled", "retrying", "retried")
+
+
+def work_key(job_type: str, agent_id: str, target: str) -> str:
+    """Identifies a piece of work: an agent's block ('develop') or its review of a developer ('qa')."""
+    return f"{job_type}:{agent_id}:{target}"
+
+
+def retry_delay(attempts: int) -> float:
+    """Backoff before retrying work that has failed `attempts` times."""
+    return min(RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0), RETRY_MAX_DELAY)
+
+
+class DeadLetterQueue:
+    """Failed work awaiting a retry. Thread-safe; persisted on every change."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._entries = {}  # entry_id (work key) -> entry
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._entries = {entry["entry_id"]: entry for entry in json.load(f)}
+            for entry in self._entries.values():
+                if entry["status"] == "retrying":  # Stopped mid-retry; try it again
+                    entry["status"] = "scheduled"
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable dead-letter queue {self.path}: {e}")
+
+    def _save(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            write_json_atomic(self.path, sorted(self._entries.values(), key=lambda e: e["failed_at"]))
+        except Exception as e:
+            logger.error(f"Failed to save dead-letter queue: {e}")
+
+    def record(self, job_type: str, agent_id: str, target: str, **details) -> dict:
+        """
+        Adds failed work (`target`: the block id, or the reviewed developer for QA) with
+        `details` such as job_id, cause, checkpoint. Replaces an earlier entry for the same
+        work, counting the attempt. Returns a copy of the entry, or None if this failure
+        (same job_id) is already recorded.
+        """
+        entry_id = work_key(job_type, agent_id, target)
+        with self._lock:
+            previous = self._entries.get(entry_id)
+            if previous and details.get("job_id") and previous.get("job_id") == details["job_id"]:
+                return None
+            entry = {
+                "entry_id": entry_id, "job_type": job_type, "agent_id": agent_id, "target": target,
+                "status": "dead", "attempts": (previous or {}).get("attempts", 0) + 1,
+                "failed_at": time.time(), "retry_at": None, "retry_error": None, "retried_job_id": None,
+                **details,
+            }
+            self._entries[entry_id] = entry
+            self._save()
+            return copy.deepcopy(entry)
+
+    def get(self, entry_id: str):
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            return copy.deepcopy(entry) if entry else None
+
+    def list_entries(self, status: str = None, job_type: str = None, agent_id: str = None) -> list:
+        """Entries matching the filters, oldest failure first."""
+        with self._lock:
+            entries = [copy.deepcopy(e) for e in self._entries.values()
+                       if (status is None or e["status"] == status)
+                       and (job_type is None or e["job_type"] == job_type)
+                       and (agent_id is None or e["agent_id"] == agent_id)]
+        return sorted(entries, key=lambda e: e["failed_at"])
+
+    def schedule(self, entry_ids, stagger: float = RETRY_STAGGER) -> list:
+        """
+        Schedules retries of the given dead entries (others are skipped), each after its
+        backoff plus its place in the batch times `stagger`. Returns the scheduled entries.
+        """
+        now = time.time()
+        scheduled = []
+        with self._lock:
+            for entry_id in entry_ids:
+                entry = self._entries.get(entry_id)
+                if entry is None or entry["status"] != "dead":
+                    continue
+                entry.update(status="scheduled", retry_error=None,
+                             retry_at=now + retry_delay(entry["attempts"]) + len(scheduled) * stagger)
+                scheduled.append(copy.deepcopy(entry))
+            if scheduled:
+                self._save()
+                self._changed.notify_all()
+        return scheduled
+
+    def wait_due(self, timeout: float) -> list:
+        """
+        Waits up to `timeout` seconds for scheduled entries to fall due and returns them, marked
+        'retrying' so no one else picks them up. The caller reports each with mark_retried(),
+        mark_dead(), reschedule() or remove().
+        """
+        with self._lock:
+            deadline = time.time() + timeout
+            while True:
+                now = time.time()
+                due = [e for e in self._entries.values() if e["status"] == "scheduled" and e["retry_at"] <= now]
+                if due or now >= deadline:
+                    for entry in due:
+                        entry["status"] = "retrying"
+                    return [copy.deepcopy(e) for e in sorted(due, key=lambda e: e["retry_at"])]
+                upcoming = [e["retry_at"] for e in self._entries.values() if e["status"] == "scheduled"]
+                self._changed.wait(min([deadline] + upcoming) - now)
+
+    def _settle(self, entry_id: str, **fields):
+        # Only while still 'retrying': a retried job that already failed again has replaced the entry
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is not None and entry["status"] == "retrying":
+                entry.update(fields)
+                self._save()
+
+    def mark_retried(self, entry_id: str, job_id: str):
+        """The work is queued again as `job_id`; the entry stays until the work finishes or fails again."""
+        self._settle(entry_id, status="retried", retried_job_id=job_id, retry_at=None)
+
+    def mark_dead(self, entry_id: str, error: str):
+        """A retry that couldn't start; back to waiting for someone to retry it."""
+        self._settle(entry_id, status="dead", retry_at=None, retry_error=error)
+
+    def reschedule(self, entry_id: str, delay: float, error: str):
+        """A retry that should be tried again later (e.g. the job queue was full)."""
+        self._settle(entry_id, status="scheduled", retry_at=time.time() + delay, retry_error=error)
+        with self._lock:
+            self._changed.notify_all()
+
+    def remove(self, entry_id: str, status: str = None) -> bool:
+        """Drops an entry (only if it's in `status`, when given)."""
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None or (status is not None and entry["status"] != status):
+                return False
+            del self._entries[entry_id]
+            self._save()
+            return True
+
+    def forget_agent(self, agent_id: str, statuses=STATUSES) -> int:
+        """Drops the agent's entries in `statuses` (its work finished, or the agent was deleted)."""
+        with self._lock:
+            gone = [k for k, e in self._entries.items() if e["agent_id"] == agent_id and e["status"] in statuses]
+            for entry_id in gone:
+                del self._entries[entry_id]
+            if gone:
+                self._save()
+            return len(gone)
@@ -0,0 +1,637 @@
+"""
+jobs.py
+
+Bounded background job scheduler for the long-running agent pipelines.
+
+Each job type ("develop", "qa", ...) has its own handler and a fixed number of
+worker threads, so a burst of requests queues up instead of starting a thread
+per request. Jobs are written to output/jobs/<job_id>.json whenever their
+status changes (by a writer thread, so disk latency never holds the scheduler
+lock), and a restart picks the queue back up (jobs that were running when the
+process stopped are queued again).
+
+    scheduler.register("develop", run_develop_job, concurrency=4)
+    job = scheduler.submit("develop", {"agent_id": ...}, agent_id=...)
+    scheduler.get_job(job["job_id"])["status"]   # queued | running | done | failed | cancelled | timed_out
+    scheduler.cancel(job["job_id"])
+
+Limits come from JOB_CONCURRENCY_<TYPE> (e.g. JOB_CONCURRENCY_DEVELOP=4),
+JOB_QUEUE_LIMIT (queued jobs per type before submit() raises QueueFull) and
+JOB_TIMEOUT_<TYPE> (seconds a job may run before it's stopped).
+
+Queued jobs start highest `priority` first, then earliest `deadline`, then
+oldest; a burst of low-priority work doesn't hold up an urgent job submitted
+after it.
+
+Cancellation is cooperative: a running job gets a CancelToken (see
+current_cancel_token()) that long waits, LLM calls above all, watch. Cancelling
+the job or passing its deadline aborts the wait with JobCancelled, which ends
+the handler and frees the worker.
+
+Jobs can also run outside this process: a remote worker lease()s the next job,
+heartbeat()s while it runs (learning about cancellation that way) and reports
+back with complete(). A lease that isn't renewed in time puts the job back in
+the queue. JOB_CONCURRENCY_<TYPE>=0 leaves a type entirely to remote workers.
+"""
+import atexit
+import collections
+import contextlib
+import copy
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from core.storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 2
+DEFAULT_QUEUE_LIMIT = 500
+# Seconds a remote worker's lease lasts without a heartbeat, and between checks for expired ones
+LEASE_SECONDS = 60
+LEASE_CHECK_INTERVAL = 5
+# Finished jobs kept for status lookups; older ones are forgotten (and their files removed)
+MAX_FINISHED_JOBS = 1000
+# Seconds the job writer waits before retrying files it failed to write
+WRITE_RETRY_DELAY = 5.0
+
+
+FINISHED_STATUSES = ("done", "failed", "cancelled", "timed_out")
+
+
+class QueueFull(Exception):
+    """Raised by submit() when a job type already has JOB_QUEUE_LIMIT jobs waiting."""
+
+    def __init__(self, job_type: str, limit: int):
+        super().__init__(f"Job queue for '{job_type}' is full ({limit} waiting)")
+        self.job_type = job_type
+        self.limit = limit
+
+
+class LeaseLost(Exception):
+    """The job isn't (or is no longer) leased to the worker asking about it."""
+
+    def __init__(self, job_id: str, worker_id: str):
+        super().__init__(f"Job {job_id} is not leased to worker {worker_id}")
+        self.job_id = job_id
+        self.worker_id = worker_id
+
+
+class JobCancelled(BaseException):
+    """
+    Raised in a job's thread once it's cancelled or past its deadline. A BaseException
+    (like asyncio.CancelledError), so the pipelines' broad `except Exception` recovery
+    paths let it through.
+    """
+
+    def __init__(self, job_id: str, reason: str, timed_out: bool = False):
+        super().__init__(f"Job {job_id} {reason}")
+        self.job_id = job_id
+        self.reason = reason
+        self.timed_out = timed_out
+
+
+class CancelToken:
+    """Cancellation flag plus optional wall-clock deadline for one running job."""
+
+    def __init__(self, job_id: str, deadline: float = None):
+        self.job_id = job_id
+        self.deadline = deadline  # time.time() value, or None
+        self.reason = None
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+
+    def cancel(self, reason: str = "cancelled"):
+        """Flags the job and runs the registered callbacks (e.g. cancelling an in-flight LLM call)."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancel callback for job {self.job_id} failed: {e}")
+
+    @property
+    def timed_out(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or self.timed_out
+
+    def remaining(self):
+        """Seconds left before the deadline (never negative), or None without one."""
+        return None if self.deadline is None else max(self.deadline - time.time(), 0)
+
+    def sleep(self, seconds: float):
+        """Waits `seconds`, cut short by a cancel or the deadline; then raises JobCancelled if either happened."""
+        remaining = self.remaining()
+        self._event.wait(seconds if remaining is None else min(seconds, remaining))
+        self.raise_if_cancelled()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelled(self.job_id, self.reason or "cancelled")
+        if self.timed_out:
+            raise JobCancelled(self.job_id, "timed out", timed_out=True)
+
+    def add_callback(self, callback):
+        """Runs `callback()` on cancel (right away if already cancelled). Returns a function removing it."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def _discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+_current = threading.local()
+
+
+def current_cancel_token():
+    """The CancelToken of the job running on this thread, or None outside a job."""
+    return getattr(_current, "token", None)
+
+
+@contextlib.contextmanager
+def cancel_scope(token: CancelToken):
+    """Makes `token` this thread's current_cancel_token() while a job runs."""
+    previous = current_cancel_token()
+    _current.token = token
+    try:
+        yield token
+    finally:
+        _current.token = previous
+
+
+def new_job_id() -> str:
+    return f"job_{uuid.uuid4().hex[:12]}"
+
+
+def _env_int(name: str, default: int, minimum: int = 1) -> int:
+    try:
+        return max(int(os.getenv(name, default)), minimum)
+    except ValueError:
+        logger.warning(f"Ignoring non-integer {name}={os.getenv(name)!r}; using {default}")
+        return default
+
+
+class JobScheduler:
+    def __init__(self, jobs_dir: Path, queue_limit: int = None):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.queue_limit = queue_limit or _env_int("JOB_QUEUE_LIMIT", DEFAULT_QUEUE_LIMIT)
+        self._cond = threading.Condition()
+        self._handlers = {}     # job type -> callable(**args)
+        self._concurrency = {}  # job type -> worker count
+        self._queues = {}       # job type -> heap of (queue key, job id), most urgent first
+        self._running = {}      # job type -> number of jobs running
+        self._timeouts = {}     # job type -> default seconds a job may run (None: no limit)
+        self._jobs = {}         # job id -> job record
+        self._tokens = {}       # job id -> CancelToken of a running job
+        self._listeners = []    # callables(job) run when a job finishes
+        self._leases = {}       # job id -> job record, for jobs running on remote workers
+        self._finished = collections.deque()  # finished job ids, oldest first
+        self._unwritten = {}    # job id -> record copy to write, or None to remove its file
+        self._write_event = threading.Event()
+        self._write_lock = threading.Lock()  # One flush at a time, so files are written in order
+        self._writer = None
+        self._closed = False
+        self._workers = []
+        self._started = False
+
+    # --- Setup ---
+    def register(self, job_type: str, handler, concurrency: int = None, timeout: int = None):
+        """
+        Adds a job type. JOB_CONCURRENCY_<TYPE> overrides `concurrency`, JOB_TIMEOUT_<TYPE>
+        the default `timeout` (seconds a job may run; None or 0: no deadline).
+        """
+        with self._cond:
+            self._handlers[job_type] = handler
+            self._concurrency[job_type] = _env_int(f"JOB_CONCURRENCY_{job_type.upper()}",
+                                                   concurrency or DEFAULT_CONCURRENCY, minimum=0)
+            timeout_var = f"JOB_TIMEOUT_{job_type.upper()}"
+            try:
+                timeout = int(os.getenv(timeout_var, timeout or 0))
+            except ValueError:
+                logger.warning(f"Ignoring non-integer {timeout_var}={os.getenv(timeout_var)!r}")
+            self._timeouts[job_type] = timeout if timeout and timeout > 0 else None
+            self._queues.setdefault(job_type, [])
+            self._running.setdefault(job_type, 0)
+            if self._started:
+                self._start_workers(job_type)
+
+    def start(self):
+        """Reloads persisted jobs and starts the worker threads."""
+        with self._cond:
+            if self._started:
+                return self
+            self._load()
+            self._started = True
+            for job_type in self._handlers:
+                self._start_workers(job_type)
+        threading.Thread(target=self._lease_reaper_loop, name="job-lease-reaper", daemon=True).start()
+        return self
+
+    def add_listener(self, listener):
+        """Calls `listener(job)` with a copy of every job record once it has finished."""
+        with self._cond:
+            self._listeners.append(listener)
+
+    def _start_workers(self, job_type: str):
+        for i in range(self._concurrency[job_type]):
+            worker = threading.Thread(target=self._worker_loop, args=(job_type,),
+                                      name=f"job-{job_type}-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        logger.info(f"Started {self._concurrency[job_type]} '{job_type}' job worker(s)")
+
+    def _load(self):
+        jobs = []
+        for job_file in self.jobs_dir.glob("job_*.json"):
+            try:
+                with open(job_file, "r", encoding="utf-8") as f:
+                    jobs.append(json.load(f))
+            except Exception as e:
+                logger.warning(f"Could not read job file {job_file.name}: {e}")
+        requeued = 0
+        for job in sorted(jobs, key=lambda j: j.get("created_at", 0)):
+            if job.get("job_id") in self._jobs:
+                continue  # Submitted before start(); this process already has it
+            job_type = job.get("type")
+            if job_type not in self._handlers:
+                logger.warning(f"Dropping job {job.get('job_id')} of unknown type '{job_type}'")
+                continue
+            if job.get("status") in ("queued", "running"):
+                if job["status"] == "running":
+                    # The process stopped mid-job; run it again from the start
+                    job.update(status="queued", started_at=None)
+                    self._persist(job)
+                self._enqueue(job)
+                requeued += 1
+            else:
+                self._finished.append(job["job_id"])
+            self._jobs[job["job_id"]] = job
+        self._prune_finished()
+        if jobs:
+            logger.info(f"Loaded {len(self._jobs)} jobs from {self.jobs_dir} ({requeued} queued)")
+
+    # --- Submitting and querying ---
+    def is_full(self, job_type: str) -> bool:
+        with self._cond:
+            return len(self._queues[job_type]) >= self.queue_limit
+
+    def submit(self, job_type: str, args: dict, job_id: str = None, agent_id: str = None,
+               timeout: int = None, priority: int = 0, deadline: float = None) -> dict:
+        """
+        Queues a job and returns a copy of its record. `args` must be JSON-serializable;
+        they're passed to the handler as keyword arguments. Raises QueueFull when saturated.
+        The copy's queue_position counts the jobs ahead of it that no idle worker will take
+        (0: it starts right away). `timeout` overrides the type's deadline for this job;
+        `priority` and `deadline` (epoch seconds, the work's due time) order the queue.
+        """
+        with self._cond:
+            if job_type not in self._handlers:
+                raise ValueError(f"Unknown job type '{job_type}'")
+            if len(self._queues[job_type]) >= self.queue_limit:
+                raise QueueFull(job_type, self.queue_limit)
+            job = {
+                "job_id": job_id or new_job_id(), "type": job_type, "agent_id": agent_id,
+                "args": copy.deepcopy(args), "status": "queued", "error": None,
+                "timeout": timeout or self._timeouts.get(job_type), "deadline_at": None,
+                "priority": priority or 0, "deadline": deadline,
+                "created_at": time.time(), "started_at": None, "finished_at": None,
+            }
+            self._persist(job)
+            self._jobs[job["job_id"]] = job
+            self._enqueue(job)
+            idle_workers = self._concurrency[job_type] - self._running[job_type]
+            position = max(self._queue_rank(job) + 1 - idle_workers, 0)
+            self._cond.notify_all()
+            logger.info(f"Queued {job_type} job {job['job_id']} (position {position}, "
+                        f"{self._running[job_type]}/{self._concurrency[job_type]} running)")
+            return dict(copy.deepcopy(job), queue_position=position)
+
+    def cancel(self, job_id: str, reason: str = "cancelled"):
+        """
+        Cancels a job: a queued one is dropped from its queue, a running one is told to stop
+        (its LLM call is aborted and the worker moves on). Returns the job record, or None
+        for an unknown job. Finished jobs are returned unchanged.
+        """
+        finished = None
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] == "queued":
+                queue = self._queues[job["type"]]
+                queue[:] = [entry for entry in queue if entry[1] != job_id]
+                heapq.heapify(queue)
+                finished = self._finish(job, "cancelled", reason)
+                logger.info(f"Cancelled queued {job['type']} job {job_id}: {reason}")
+            token = self._tokens.get(job_id) if job["status"] == "running" else None
+            view = self._job_view(job)
+        if finished is not None:
+            self._notify(*finished)
+        if token is not None:
+            # Local jobs stop at their next check; remote ones hear about it on their next heartbeat
+            logger.info(f"Cancelling running {job['type']} job {job_id}: {reason}")
+            token.cancel(reason)
+        return view
+
+    def wait(self, job_id: str, timeout: float = None) -> bool:
+        """Blocks until the job has finished (any way). False if `timeout` passed first."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._jobs.get(job_id, {}).get("status", "done") in FINISHED_STATUSES, timeout)
+
+    def get_job(self, job_id: str) -> dict:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return self._job_view(job) if job is not None else None
+
+    def list_jobs(self, status: str = None, job_type: str = None, agent_id: str = None) -> list:
+        with self._cond:
+            return [self._job_view(job) for job in self._jobs.values()
+                    if (status is None or job["status"] == status)
+                    and (job_type is None or job["type"] == job_type)
+                    and (agent_id is None or job.get("agent_id") == agent_id)]
+
+    def has_active_job(self, agent_id: str, job_type: str = None) -> bool:
+        """Whether `agent_id` has a queued or running job (of `job_type`, if given)."""
+        with self._cond:
+            return any(job.get("agent_id") == agent_id and job["status"] in ("queued", "running")
+                       and (job_type is None or job["type"] == job_type) for job in self._jobs.values())
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {job_type: {"queued": len(self._queues[job_type]), "running": self._running[job_type],
+                               "concurrency": self._concurrency[job_type],
+                               "leased": sum(1 for job in self._leases.values() if job["type"] == job_type)}
+                    for job_type in self._handlers}
+
+    def _job_view(self, job: dict) -> dict:
+        """Copy of a job record with its current place in the queue. Caller holds the lock."""
+        view = copy.deepcopy(job)
+        if job["status"] == "queued":
+            view["queue_position"] = self._queue_rank(job) + 1
+        return view
+
+    @staticmethod
+    def _queue_key(job: dict):
+        deadline = job.get("deadline")
+        return -(job.get("priority") or 0), deadline if deadline is not None else float("inf"), job["created_at"]
+
+    def _queue_rank(self, job: dict) -> int:
+        """Number of queued jobs of the same type that start before `job`. Caller holds the lock."""
+        key = self._queue_key(job)
+        return sum(1 for entry_key, _ in self._queues[job["type"]] if entry_key < key)
+
+    def _enqueue(self, job: dict):
+        """Caller holds the lock."""
+        heapq.heappush(self._queues[job["type"]], (self._queue_key(job), job["job_id"]))
+
+    def _pop_next(self, job_type: str) -> dict:
+        """Takes the most urgent queued job of a type. Caller holds the lock."""
+        _, job_id = heapq.heappop(self._queues[job_type])
+        return self._jobs[job_id]
+
+    # --- Running ---
+    def _worker_loop(self, job_type: str):
+        while True:
+            with self._cond:
+                while not self._queues[job_type]:
+                    self._cond.wait()
+                job = self._pop_next(job_type)
+                token = self._start_job(job)
+                self._running[job_type] += 1
+                handler, args = self._handlers[job_type], copy.deepcopy(job["args"])
+
+            logger.info(f"Running {job_type} job {job['job_id']}")
+            status, error = "done", None
+            with cancel_scope(token):
+                try:
+                    handler(**args)
+                except JobCancelled as e:
+                    logger.warning(f"{job_type} job {job['job_id']} stopped: {e.reason}")
+                    status, error = ("timed_out" if e.timed_out else "cancelled"), e.reason
+                except Exception as e:
+                    logger.error(f"{job_type} job {job['job_id']} failed: {e}", exc_info=True)
+                    status, error = "failed", str(e)
+
+            with self._cond:
+                self._running[job_type] -= 1
+                finished = self._finish(job, status, error)
+            self._notify(*finished)
+
+    def _start_job(self, job: dict, worker_id: str = None) -> CancelToken:
+        """Marks a job running (on `worker_id`, or here) and returns its token. Caller holds the lock."""
+        started_at = time.time()
+        deadline = started_at + job["timeout"] if job.get("timeout") else None
+        job.update(status="running", started_at=started_at, deadline_at=deadline, worker_id=worker_id)
+        token = self._tokens[job["job_id"]] = CancelToken(job["job_id"], deadline)
+        self._persist(job)
+        return token
+
+    def _finish(self, job: dict, status: str, error: str = None):
+        """
+        Records a job's outcome and wakes anyone in wait(). Caller holds the lock and passes
+        the returned (job copy, listeners) to _notify() once it has let go of it.
+        """
+        self._tokens.pop(job["job_id"], None)
+        self._leases.pop(job["job_id"], None)
+        job.update(status=status, error=error, finished_at=time.time())
+        self._persist(job)
+        self._finished.append(job["job_id"])
+        self._prune_finished()
+        self._cond.notify_all()
+        if job.get("started_at"):
+            logger.info(f"{job['type']} job {job['job_id']} {status} in {job['finished_at'] - job['started_at']:.1f}s")
+        return copy.deepcopy(job), list(self._listeners)
+
+    def _notify(self, job: dict, listeners: list):
+        for listener in listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.error(f"Job listener failed for {job['job_id']}: {e}", exc_info=True)
+
+    # --- Remote workers ---
+    def lease(self, worker_id: str, job_types: list, lease_seconds: float = LEASE_SECONDS, wait: float = 0):
+        """
+        Hands the most urgent queued job of `job_types` to a remote worker, waiting up to `wait`
+        seconds for one. Returns a copy of the job record (with lease_expires_at), or None.
+        """
+        job_types = [t for t in job_types if t in self._handlers]
+        give_up_at = time.monotonic() + wait
+        leased, finished = None, []
+        with self._cond:
+            while True:
+                finished += self._reap_expired_leases()
+                queued = [t for t in job_types if self._queues[t]]
+                if queued:
+                    job_type = min(queued, key=lambda t: self._queues[t][0])
+                    job = self._pop_next(job_type)
+                    self._start_job(job, worker_id=worker_id)
+                    job["lease_expires_at"] = time.time() + lease_seconds
+                    self._leases[job["job_id"]] = job
+                    logger.info(f"Leased {job_type} job {job['job_id']} to worker {worker_id}")
+                    leased = copy.deepcopy(job)
+                    break
+                remaining = give_up_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        for done in finished:
+            self._notify(*done)
+        return leased
+
+    def heartbeat(self, job_id: str, worker_id: str, lease_seconds: float = LEASE_SECONDS) -> dict:
+        """
+        Renews a lease. Returns {'cancelled': bool, 'reason': str or None} so the worker can
+        stop a job cancelled here. Raises LeaseLost if the lease expired or went to someone else.
+        """
+        with self._cond:
+            job = self._leases.get(job_id)
+            if job is None or job.get("worker_id") != worker_id:
+                raise LeaseLost(job_id, worker_id)
+            job["lease_expires_at"] = time.time() + lease_seconds
+            token = self._tokens[job_id]
+            return {"cancelled": token.cancelled, "reason": token.reason or ("timed out" if token.timed_out else None)}
+
+    def complete(self, job_id: str, worker_id: str, status: str, error: str = None) -> dict:
+        """A remote worker's outcome for its leased job. Raises LeaseLost for a stale worker."""
+        if status not in FINISHED_STATUSES:
+            raise ValueError(f"Unknown job status '{status}'")
+        with self._cond:
+            job = self._leases.get(job_id)
+            if job is None or job.get("worker_id") != worker_id:
+                raise LeaseLost(job_id, worker_id)
+            finished = self._finish(job, status, error)
+        self._notify(*finished)
+        return finished[0]
+
+    def holds_lease(self, job_id: str, worker_id: str) -> dict:
+        """A copy of the job if it's currently leased to `worker_id`, else None."""
+        with self._cond:
+            job = self._leases.get(job_id)
+            return copy.deepcopy(job) if job is not None and job.get("worker_id") == worker_id else None
+
+    def _reap_expired_leases(self) -> list:
+        """
+        Queues jobs whose worker stopped renewing its lease again; ones cancelled or past their
+        deadline meanwhile finish instead. Caller holds the lock and passes each returned
+        (job copy, listeners) to _notify() once it has let go of it.
+        """
+        now = time.time()
+        finished = []
+        for job_id, job in list(self._leases.items()):
+            if job["lease_expires_at"] >= now:
+                continue
+            token = self._tokens.get(job_id)
+            if token is not None and token.cancelled:
+                logger.warning(f"Lease on {job['type']} job {job_id} expired after it was stopped")
+                timed_out = token.timed_out and not token.reason
+                finished.append(self._finish(job, "timed_out" if timed_out else "cancelled",
+                                             "timed out" if timed_out else token.reason))
+                continue
+            logger.warning(f"Lease on {job['type']} job {job_id} (worker {job.get('worker_id')}) expired; re-queueing")
+            del self._leases[job_id]
+            self._tokens.pop(job_id, None)
+            job.update(status="queued", started_at=None, deadline_at=None, worker_id=None, lease_expires_at=None)
+            self._persist(job)
+            self._enqueue(job)
+            self._cond.notify_all()
+        return finished
+
+    def _lease_reaper_loop(self):
+        while True:
+            time.sleep(LEASE_CHECK_INTERVAL)
+            with self._cond:
+                finished = self._reap_expired_leases()
+            for done in finished:
+                self._notify(*done)
+
+    def _prune_finished(self):
+        while len(self._finished) > MAX_FINISHED_JOBS:
+            job_id = self._finished.popleft()
+            self._jobs.pop(job_id, None)
+            self._unwritten[job_id] = None
+            self._write_event.set()
+
+    # --- Persistence ---
+    def _persist(self, job: dict):
+        """Queues a copy of the record for the writer thread. Caller holds the lock."""
+        self._unwritten[job["job_id"]] = copy.deepcopy(job)
+        self._write_event.set()
+        self._start_writer()
+
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._writer_loop, name="job-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _writer_loop(self):
+        while not self._closed:
+            self._write_event.wait()
+            if self._closed:
+                break
+            try:
+                if not self.flush():
+                    threading.Event().wait(WRITE_RETRY_DELAY)  # The failed writes are pending again
+            except Exception as e:
+                logger.error(f"Job writer pass failed: {e}", exc_info=True)
+                threading.Event().wait(WRITE_RETRY_DELAY)
+
+    def flush(self) -> bool:
+        """
+        Writes every pending job file (and removes pruned ones). Safe to call from any thread.
+        Files that fail stay pending unless a newer copy replaced them; returns False when there were any.
+        """
+        with self._write_lock:
+            with self._cond:
+                self._write_event.clear()
+                pending, self._unwritten = self._unwritten, {}
+            failed = {}
+            for job_id, job in pending.items():
+                path = self.jobs_dir / f"{job_id}.json"
+                try:
+                    if job is None:
+                        path.unlink(missing_ok=True)
+                    else:
+                        write_json_atomic(path, job)
+                except Exception as e:
+                    logger.error(f"Failed to persist job {job_id}: {e}")
+                    failed[job_id] = job
+            if failed:
+                with self._cond:
+                    for job_id, job in failed.items():
+                        self._unwritten.setdefault(job_id, job)
+                    self._write_event.set()
+            return not failed
+
+    def close(self):
+        """Writes outstanding job files and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._write_event.set()
+        if not self.flush():
+            logger.error("Some job files could not be written before closing")
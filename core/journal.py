@@ -0,0 +1,233 @@
+"""
+journal.py
+
+Append-only journal of board events with periodic compact snapshots.
+
+Layout under output/journal/:
+    snapshot.json                 - the whole board as of event `seq` (atomic replace)
+    snapshot.previous.json        - the snapshot before it, the fallback if it can't be read
+    events-000000000001.jsonl     - one JSON event per line, segment starting at that seq
+    transitions-000000000001.jsonl - the state-transition events of a compacted segment
+
+Every mutation of the board state store becomes one event:
+    {"seq": 42, "ts": 1713390000.1, "type": "agent_update", "agent_id": "...",
+     "fields": {...}, "transition": {"from": "working", "to": "finished_work", "agent_type": "developer"}}
+
+Startup loads the latest snapshot and replays only the events after it instead
+of rescanning the output/ tree. A new snapshot is written (and a new segment
+started) every SNAPSHOT_EVERY events. Segments are kept back to the previous
+snapshot, so either snapshot plus the segments after it rebuilds the board; older
+ones are compacted down to their transition events, so the journal still doubles
+as a time series of agent state transitions (see `transitions`).
+"""
+import itertools
+import json
+import logging
+import os
+from pathlib import Path
+
+from core.storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = "snapshot.json"
+PREVIOUS_SNAPSHOT_FILENAME = "snapshot.previous.json"
+SEGMENT_PREFIX = "events-"
+SEGMENT_SUFFIX = ".jsonl"
+TRANSITIONS_PREFIX = "transitions-"
+
+# Events between compact snapshots; bounds how much a restart has to replay
+SNAPSHOT_EVERY = 1000
+
+
+class BoardJournal:
+    def __init__(self, journal_dir: Path, snapshot_every: int = SNAPSHOT_EVERY):
+        self.journal_dir = Path(journal_dir)
+        self.journal_dir.mkdir(parents=True, exist_ok=True)
+        self.snapshot_file = self.journal_dir / SNAPSHOT_FILENAME
+        self.previous_snapshot_file = self.journal_dir / PREVIOUS_SNAPSHOT_FILENAME
+        self.snapshot_every = snapshot_every
+        self.events_since_snapshot = 0
+        self._segment = None  # Path of the segment currently appended to
+        self._snapshot_seq = None  # seq of the newest snapshot, once known
+
+    # --- Reading ---
+    def _segments(self, prefix: str = SEGMENT_PREFIX) -> list:
+        return sorted(self.journal_dir.glob(f"{prefix}*{SEGMENT_SUFFIX}"))
+
+    @staticmethod
+    def _segment_start(path: Path) -> int:
+        return int(path.name[path.name.index("-") + 1:-len(SEGMENT_SUFFIX)])
+
+    @staticmethod
+    def _read_segment(segment: Path, after_seq: int = 0):
+        with open(segment, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a torn last line; everything before it is intact
+                    logger.warning(f"Skipping unreadable journal line in {segment.name}")
+                    continue
+                if event.get("seq", 0) > after_seq:
+                    yield event
+
+    def iter_events(self, after_seq: int = 0):
+        """Yields events with seq > after_seq in order, skipping segments that end before it."""
+        segments = self._segments()
+        for i, segment in enumerate(segments):
+            if i + 1 < len(segments) and self._segment_start(segments[i + 1]) <= after_seq + 1:
+                continue  # Every event in this segment is older than after_seq
+            yield from self._read_segment(segment, after_seq)
+
+    def _read_snapshot(self):
+        """The newest readable snapshot: snapshot.json, else the previous one. None if neither."""
+        for path in (self.snapshot_file, self.previous_snapshot_file):
+            if not path.exists():
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.error(f"Could not read journal snapshot {path}: {e}")
+        return None
+
+    def load(self):
+        """
+        Returns (snapshot, tail_events): the latest snapshot dict (None if there is
+        none yet) and the events recorded after it.
+        """
+        snapshot = self._read_snapshot()
+        if snapshot is None:
+            return None, []
+
+        self._snapshot_seq = snapshot.get("seq", 0)
+        tail = list(self.iter_events(self._snapshot_seq))
+        self.events_since_snapshot = len(tail)
+        segments = self._segments()
+        self._segment = segments[-1] if segments else None
+        return snapshot, tail
+
+    def transitions(self, agent_id: str = None, since: float = None, until: float = None) -> list:
+        """
+        Agent state transitions recorded in the journal, oldest first:
+        [{"seq", "ts", "agent_id", "agent_type", "from", "to"}, ...]
+        """
+        result = []
+        compacted = self._segments(TRANSITIONS_PREFIX)
+        events = itertools.chain(*(self._read_segment(path) for path in compacted), self.iter_events())
+        for event in events:
+            transition = event.get("transition")
+            if not transition:
+                continue
+            if agent_id is not None and event.get("agent_id") != agent_id:
+                continue
+            ts = event.get("ts", 0)
+            if (since is not None and ts < since) or (until is not None and ts > until):
+                continue
+            result.append({
+                "seq": event["seq"], "ts": ts, "agent_id": event.get("agent_id"),
+                "agent_type": transition.get("agent_type"),
+                "from": transition.get("from"), "to": transition.get("to"),
+            })
+        return result
+
+    # --- Writing (writer thread only) ---
+    def append(self, events: list):
+        """Appends a batch of events to the current segment and syncs it to disk."""
+        if not events:
+            return
+        if self._segment is None:
+            self._segment = self.journal_dir / f"{SEGMENT_PREFIX}{events[0]['seq']:012d}{SEGMENT_SUFFIX}"
+        with open(self._segment, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(event, separators=(",", ":")) + "\n" for event in events))
+            f.flush()
+            os.fsync(f.fileno())
+        self.events_since_snapshot += len(events)
+
+    def write_snapshot(self, seq: int, state: dict):
+        """
+        Stores the board as of event `seq` and starts a new segment for the
+        events after it. `state` holds "agents", "blocks" and "zones". The
+        snapshot it replaces is kept as the previous one; segments older than
+        that are compacted.
+        """
+        previous_seq = self._snapshot_seq
+        if self.snapshot_file.exists():
+            os.replace(self.snapshot_file, self.previous_snapshot_file)
+        write_json_atomic(self.snapshot_file, dict(state, seq=seq))
+        self._snapshot_seq = seq
+        self._segment = None  # Next append opens events-<seq+1>.jsonl
+        self.events_since_snapshot = 0
+        logger.info(f"Journal snapshot written at seq {seq}")
+        if previous_seq is not None:
+            self._compact(previous_seq)
+
+    def _compact(self, up_to_seq: int):
+        """
+        Replaces each segment whose events all have seq <= up_to_seq (no snapshot we
+        keep needs them) with a transitions-<start>.jsonl holding just its transitions.
+        """
+        segments = self._segments()
+        for segment, following in zip(segments, segments[1:]):
+            if self._segment_start(following) - 1 > up_to_seq:
+                break
+            try:
+                lines = [json.dumps(event, separators=(",", ":")) + "\n"
+                         for event in self._read_segment(segment) if event.get("transition")]
+                if lines:
+                    target = self.journal_dir / f"{TRANSITIONS_PREFIX}{self._segment_start(segment):012d}{SEGMENT_SUFFIX}"
+                    tmp = target.with_name(f".{target.name}.tmp")
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        f.write("".join(lines))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp, target)
+                segment.unlink()
+                logger.info(f"Compacted journal segment {segment.name} ({len(lines)} transitions kept)")
+            except OSError as e:
+                logger.warning(f"Could not compact journal segment {segment.name}: {e}")
+                break
+
+
+def replay(state: dict, events) -> dict:
+    """
+    Applies journal events to a plain {"agents", "blocks", "zones"} state in place.
+    Returns what the events touched, so it can be re-persisted:
+    {"agents": set, "deleted_agents": set, "blocks": set, "deleted_blocks": set, "zones": bool}
+    """
+    agents, blocks = state["agents"], state["blocks"]
+    touched = {"agents": set(), "deleted_agents": set(), "blocks": set(), "deleted_blocks": set(), "zones": False}
+    for event in events:
+        kind = event.get("type")
+        if kind == "agent_put":
+            agents[event["agent_id"]] = event["data"]
+            touched["agents"].add(event["agent_id"])
+            touched["deleted_agents"].discard(event["agent_id"])
+        elif kind == "agent_update":
+            if event["agent_id"] in agents:
+                agents[event["agent_id"]].update(event["fields"])
+                touched["agents"].add(event["agent_id"])
+        elif kind == "agent_delete":
+            agents.pop(event["agent_id"], None)
+            touched["agents"].discard(event["agent_id"])
+            touched["deleted_agents"].add(event["agent_id"])
+        elif kind == "blocks_replace":
+            new_blocks = {b["block_id"]: b for b in event["blocks"]}
+            touched["deleted_blocks"] |= set(blocks) - set(new_blocks)
+            touched["deleted_blocks"] -= set(new_blocks)
+            blocks.clear()
+            blocks.update(new_blocks)
+            touched["blocks"] = set(new_blocks)
+        elif kind == "block_update":
+            if event["block_id"] in blocks:
+                blocks[event["block_id"]].update(event["fields"])
+                touched["blocks"].add(event["block_id"])
+        elif kind == "zones_set":
+            state["zones"] = event["zones"]
+            touched["zones"] = True
+        else:
+            logger.warning(f"Unknown journal event type '{kind}' at seq {event.get('seq')}")
+    return touched
@@ -0,0 +1,129 @@
+"""
+lifecycle.py
+
+Server-side agent lifecycle: the states an agent moves through and the hooks
+that run when it enters one.
+
+    developer: idle -> working -> finished_work -> idle (awaiting_qa) -> under_qa -> idle
+    qa:        idle -> working_qa -> finished_qa_work -> idle
+
+The board state store reports every state change. Hooks run on a small pool
+of lifecycle threads, never on the thread that made the change, so a worker
+finishing a block doesn't wait for its own zone move. A periodic sweep re-runs
+the hooks for agents still sitting in a hooked state (a hook failed, or the
+server restarted in between), so the pipeline keeps moving without a browser.
+
+    lifecycle = AgentLifecycle(board_state)
+
+    @lifecycle.on_enter("finished_work")
+    def move_to_finish_zone(agent_id): ...
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Allowed moves between agent states; anything else is logged as unexpected
+TRANSITIONS = {
+    None: {"idle"},  # New agent
+    "unknown": {"idle", "error"},
+    "idle": {"working", "working_qa", "under_qa", "error"},
+    "working": {"finished_work", "idle", "error"},
+    "finished_work": {"idle", "error"},
+    "under_qa": {"idle", "error"},
+    "working_qa": {"finished_qa_work", "idle", "error"},
+    "finished_qa_work": {"idle", "error"},
+    "error": {"idle", "working", "working_qa"},
+}
+
+# Seconds between sweeps for agents left in a hooked state
+SWEEP_INTERVAL = 10
+# Hooks running at once; completions arriving together can then share a zone assignment batch
+HOOK_WORKERS = 8
+
+
+def is_valid_transition(from_state, to_state) -> bool:
+    return to_state in TRANSITIONS.get(from_state, ())
+
+
+class AgentLifecycle:
+    def __init__(self, board_state, sweep_interval: float = SWEEP_INTERVAL, workers: int = HOOK_WORKERS):
+        self.board_state = board_state
+        self.sweep_interval = sweep_interval
+        self.workers = workers
+        self._hooks = {}  # state -> [callable(agent_id)]
+        self._queue = queue.Queue()
+        self._in_flight = set()  # (agent_id, state) with hooks queued or running
+        self._in_flight_lock = threading.Lock()
+        self._pool = None
+        board_state.add_transition_listener(self._on_transition)
+
+    def on_enter(self, state: str):
+        """Decorator registering `hook(agent_id)` to run whenever an agent enters `state`."""
+        def register(hook):
+            self._hooks.setdefault(state, []).append(hook)
+            return hook
+        return register
+
+    def start(self):
+        """Starts the lifecycle threads; the first sweep picks up agents stuck from before a restart."""
+        if self._pool is not None:
+            return self
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="agent-lifecycle")
+        threading.Thread(target=self._dispatch_loop, name="agent-lifecycle-dispatch", daemon=True).start()
+        return self
+
+    # --- Transition feed (called by the store under its lock; must stay quick) ---
+    def _on_transition(self, agent_id: str, from_state, to_state, agent_type):
+        if not is_valid_transition(from_state, to_state):
+            logger.warning(f"[{agent_id}] Unexpected {agent_type or 'agent'} transition {from_state} -> {to_state}")
+        if to_state in self._hooks:
+            self._queue.put((agent_id, to_state))
+
+    # --- Running hooks ---
+    def _dispatch_loop(self):
+        next_sweep = time.monotonic()
+        while True:
+            # Checked every pass, so a steady stream of transitions can't hold the sweep off
+            if time.monotonic() >= next_sweep:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    logger.error(f"Lifecycle sweep failed: {e}", exc_info=True)
+                next_sweep = time.monotonic() + self.sweep_interval
+            try:
+                agent_id, state = self._queue.get(timeout=max(next_sweep - time.monotonic(), 0))
+            except queue.Empty:
+                continue
+            self._schedule(agent_id, state)
+
+    def sweep(self):
+        """Schedules the hooks again for every agent currently in a hooked state."""
+        for state in self._hooks:
+            for agent in self.board_state.find_agents(state=state):
+                self._schedule(agent["agent_id"], state)
+
+    def _schedule(self, agent_id: str, state: str):
+        key = (agent_id, state)
+        with self._in_flight_lock:
+            if key in self._in_flight:
+                return  # Already queued or running for this entry into the state
+            self._in_flight.add(key)
+        self._pool.submit(self._run_hooks, agent_id, state)
+
+    def _run_hooks(self, agent_id: str, state: str):
+        try:
+            agent = self.board_state.get_agent(agent_id)
+            if agent is None or agent.get("state") != state:
+                return  # Moved on (or deleted) before the hook got to run
+            for hook in self._hooks.get(state, ()):
+                try:
+                    hook(agent_id)
+                except Exception as e:
+                    logger.error(f"[{agent_id}] Lifecycle hook {hook.__name__} for '{state}' failed: {e}", exc_info=True)
+        finally:
+            with self._in_flight_lock:
+                self._in_flight.discard((agent_id, state))
@@ -0,0 +1,177 @@
+"""
+llm_cache.py
+
+Content-addressed cache of LLM responses, so an identical request (same
+provider, model, prompt and generation parameters) is answered without
+calling the provider again: re-running a block, a retried job, a QA review of
+unchanged files, a board regenerated after a crash.
+
+Two tiers:
+  - memory: an LRU of the most recent responses (LLM_CACHE_MEMORY_ENTRIES);
+  - disk:   one JSON file per response under output/llm_cache/ (LLM_CACHE_DIR),
+            expiring after LLM_CACHE_TTL seconds and bounded to LLM_CACHE_MAX_MB,
+            least recently used first out.
+
+Only successful responses are stored ("Error: ..." replies are not). LLM_CACHE=0
+turns the cache off; a single call opts out with generate(..., use_cache=False).
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from core.storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = Path("output") / "llm_cache"
+DEFAULT_MEMORY_ENTRIES = 256
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_MB = 200
+
+
+def cache_key(provider: str, model: str, prompt: str, params: dict = None) -> str:
+    """Key of a request: hash of provider, model, the prompt's hash and the generation parameters."""
+    request = {
+        "provider": provider, "model": model, "params": params or {},
+        "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _env_number(name: str, default):
+    try:
+        return type(default)(os.getenv(name, default))
+    except ValueError:
+        logger.warning(f"Ignoring invalid {name}={os.getenv(name)!r}; using {default}")
+        return default
+
+
+class ResponseCache:
+    """Memory LRU in front of a size-bounded, expiring disk store. Thread-safe."""
+
+    def __init__(self, directory: Path = None, memory_entries: int = None, ttl: float = None, max_bytes: int = None):
+        self.directory = Path(directory or os.getenv("LLM_CACHE_DIR") or DEFAULT_CACHE_DIR)
+        self.memory_entries = memory_entries if memory_entries is not None else _env_number("LLM_CACHE_MEMORY_ENTRIES", DEFAULT_MEMORY_ENTRIES)
+        self.ttl = ttl if ttl is not None else _env_number("LLM_CACHE_TTL", DEFAULT_TTL)
+        self.max_bytes = max_bytes if max_bytes is not None else int(_env_number("LLM_CACHE_MAX_MB", float(DEFAULT_MAX_MB)) * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> (response, created_at), most recently used last
+        self._disk = OrderedDict()  # key -> size in bytes, least recently used first
+        self._disk_bytes = 0
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        self._scan()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json"
+
+    def _scan(self):
+        """Indexes the disk tier (oldest access first) so size bounds hold across restarts."""
+        found = []
+        for path in self.directory.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(found):
+            self._disk[key] = size
+            self._disk_bytes += size
+        if found:
+            logger.info(f"LLM response cache: {len(found)} entries ({self._disk_bytes / 1e6:.1f} MB) in {self.directory}")
+
+    def get(self, key: str):
+        """The cached response for `key`, or None (missing or expired)."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                self._forget(key)
+                self._stats["expired"] += 1
+            if key not in self._disk:
+                self._stats["misses"] += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    stored = json.load(f)
+            except Exception as e:
+                logger.warning(f"Dropping unreadable LLM cache entry {path}: {e}")
+                self._forget(key)
+                self._stats["misses"] += 1
+                return None
+            if now - stored.get("created_at", 0) > self.ttl:
+                self._forget(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._disk.move_to_end(key)
+            try:
+                os.utime(path)  # Access time for the LRU order after a restart
+            except OSError:
+                pass
+            self._remember(key, stored["response"], stored["created_at"])
+            self._stats["disk_hits"] += 1
+            return stored["response"]
+
+    def put(self, key: str, response: str, **meta):
+        """Stores a response in both tiers; `meta` (provider, model, ...) is kept alongside on disk."""
+        created_at = time.time()
+        record = dict(meta, response=response, created_at=created_at)
+        path = self._path(key)
+        with self._lock:
+            self._remember(key, response, created_at)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            write_json_atomic(path, record)
+            size = path.stat().st_size
+        except Exception as e:
+            logger.error(f"Failed to write LLM cache entry {path}: {e}")
+            return
+        with self._lock:
+            self._disk_bytes += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            self._stats["stores"] += 1
+            while self._disk_bytes > self.max_bytes and len(self._disk) > 1:
+                oldest = next(iter(self._disk))
+                self._forget(oldest)
+                self._stats["evictions"] += 1
+
+    def _remember(self, key: str, response: str, created_at: float):
+        self._memory[key] = (response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _forget(self, key: str):
+        """Drops `key` from both tiers. Caller holds the lock."""
+        self._memory.pop(key, None)
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+            try:
+                self._path(key).unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"Could not remove LLM cache entry {key}: {e}")
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._disk):
+                self._forget(key)
+            self._memory.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["memory_hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            hits = self._stats["memory_hits"] + self._stats["disk_hits"]
+            return dict(self._stats, hit_rate=round(hits / lookups, 3) if lookups else None,
+                        memory_entries=len(self._memory), disk_entries=len(self._disk), disk_bytes=self._disk_bytes,
+                        max_bytes=self.max_bytes, ttl=self.ttl)
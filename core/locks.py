@@ -0,0 +1,138 @@
+"""
+locks.py
+
+Named, fine-grained locks that hold across threads *and* processes.
+
+Each name gets an in-process re-entrant lock plus an OS file lock on
+output/locks/<name>.lock (fcntl.flock on POSIX, msvcrt.locking on Windows),
+so separate server or worker processes sharing the same output/ directory
+serialize on the same agent without one global lock.
+
+    with lock_manager.lock("agent_1a2b3c"):
+        ...read, check, write...
+"""
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:  # POSIX
+    msvcrt = None
+
+logger = logging.getLogger(__name__)
+
+# How often a blocked file lock is retried while waiting with a timeout
+FILE_LOCK_POLL_INTERVAL = 0.05
+
+# Lock names become file names, so keep them to a safe character set
+_VALID_LOCK_NAME = re.compile(r"[A-Za-z0-9_.-]+")
+
+
+class LockTimeout(TimeoutError):
+    """Raised when a named lock could not be acquired within the timeout."""
+
+
+class _NamedLock:
+    """In-process RLock plus the file handle while the outermost holder owns the OS lock."""
+
+    def __init__(self):
+        self.rlock = threading.RLock()
+        self.depth = 0
+        self.handle = None
+
+
+class LockManager:
+    def __init__(self, lock_dir: Path):
+        self.lock_dir = Path(lock_dir)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self._guard = threading.Lock()
+        self._locks = {}  # name -> _NamedLock
+
+    def _named(self, name: str) -> _NamedLock:
+        if not _VALID_LOCK_NAME.fullmatch(name) or name in (".", ".."):
+            raise ValueError(f"Invalid lock name: {name!r}")
+        with self._guard:
+            named = self._locks.get(name)
+            if named is None:
+                named = self._locks[name] = _NamedLock()
+            return named
+
+    def acquire_exclusive(self, name: str):
+        """
+        Takes the OS file lock `name` without waiting, for a holder that keeps it until
+        release_exclusive() (or the process exits). Raises LockTimeout if another holder has it.
+        """
+        self._named(name)  # Validates the name
+        return self._acquire_file_lock(name, deadline=time.monotonic())
+
+    def release_exclusive(self, handle):
+        self._release_file_lock(handle)
+
+    @contextmanager
+    def lock(self, name: str, timeout: float = None):
+        """
+        Holds `name` for the duration of the block. Re-entrant within a thread.
+        Raises LockTimeout if it is not acquired within `timeout` seconds (None waits forever).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        named = self._named(name)
+        if not named.rlock.acquire(timeout=-1 if timeout is None else timeout):
+            raise LockTimeout(f"Timed out waiting for lock '{name}'")
+        try:
+            if named.depth == 0:
+                named.handle = self._acquire_file_lock(name, deadline)
+            named.depth += 1
+            try:
+                yield
+            finally:
+                named.depth -= 1
+                if named.depth == 0:
+                    self._release_file_lock(named.handle)
+                    named.handle = None
+        finally:
+            named.rlock.release()
+
+    def _acquire_file_lock(self, name: str, deadline):
+        if fcntl is None and msvcrt is None:
+            return None  # No OS locking available; in-process lock only
+        handle = open(self.lock_dir / f"{name}.lock", "a+b")
+        try:
+            while True:
+                try:
+                    if fcntl is not None:
+                        flags = fcntl.LOCK_EX if deadline is None else fcntl.LOCK_EX | fcntl.LOCK_NB
+                        fcntl.flock(handle.fileno(), flags)
+                    else:
+                        handle.seek(0)
+                        msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                    return handle
+                except OSError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise LockTimeout(f"Timed out waiting for file lock '{name}'")
+                    time.sleep(FILE_LOCK_POLL_INTERVAL)
+        except BaseException:
+            handle.close()
+            raise
+
+    @staticmethod
+    def _release_file_lock(handle):
+        if handle is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+            else:
+                handle.seek(0)
+                msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError as e:
+            logger.warning(f"Could not release file lock {handle.name}: {e}")
+        finally:
+            handle.close()
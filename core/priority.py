@@ -0,0 +1,122 @@
+"""
+priority.py
+
+Urgency of blocks and the jobs started for them.
+
+Blocks may carry a `priority` (a number, higher goes first, or one of
+"low" / "normal" / "high" / "urgent") and an optional `deadline` (epoch
+seconds or an ISO 8601 timestamp). The pending queue is ordered by priority,
+then by latest start time (deadline minus the estimated run time, so a long
+block with a near deadline starts before a short one with the same deadline),
+then by board order. Blocks without a deadline come after those with one.
+
+Run time estimates are learned from finished jobs: an exponentially weighted
+mean of the durations per job type and task size, kept in
+output/jobs/durations.json so they survive restarts.
+"""
+import json
+import logging
+import math
+import threading
+from datetime import datetime
+from pathlib import Path
+
+from core.storage import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_NAMES = {"low": -1, "normal": 0, "high": 1, "urgent": 2}
+# Weight of the newest run in the duration estimate
+ESTIMATE_ALPHA = 0.3
+# Seconds assumed for a job type nothing has been learned about yet
+DEFAULT_ESTIMATES = {"develop": 300, "qa": 120}
+DEFAULT_ESTIMATE = 300
+
+
+def block_priority(block: dict) -> int:
+    """The block's priority as a number (0 when missing or unreadable)."""
+    value = block.get("priority", 0)
+    if isinstance(value, str):
+        if value.lower() in PRIORITY_NAMES:
+            return PRIORITY_NAMES[value.lower()]
+        try:
+            return int(value)
+        except ValueError:
+            return 0
+    return int(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else 0
+
+
+def parse_deadline(value):
+    """Epoch seconds for a deadline given as a number or ISO 8601 string; None if absent or invalid."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            pass
+    logger.warning(f"Ignoring unreadable deadline {value!r}")
+    return None
+
+
+def task_size(block: dict) -> int:
+    """Rough size of a block's task, used to bucket duration estimates."""
+    return len(block.get("title") or "") + len(block.get("description") or "")
+
+
+class DurationEstimator:
+    """Learned run times per job type and task size bucket. Thread-safe."""
+
+    def __init__(self, path: Path, alpha: float = ESTIMATE_ALPHA):
+        self.path = Path(path)
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._stats = {}  # "type" or "type:bucket" -> {"mean": seconds, "count": runs}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._stats = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable duration estimates {self.path}: {e}")
+
+    @staticmethod
+    def _bucket(size: int) -> int:
+        return int(math.log2(size)) if size > 0 else 0
+
+    def record(self, job_type: str, size: int, seconds: float):
+        with self._lock:
+            for key in (job_type, f"{job_type}:{self._bucket(size)}"):
+                entry = self._stats.get(key)
+                if entry is None:
+                    self._stats[key] = {"mean": seconds, "count": 1}
+                else:
+                    entry["mean"] += self.alpha * (seconds - entry["mean"])
+                    entry["count"] += 1
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                write_json_atomic(self.path, self._stats)
+            except Exception as e:
+                logger.error(f"Failed to save duration estimates: {e}")
+
+    def estimate(self, job_type: str, size: int = 0) -> float:
+        """Seconds a job is expected to run: its size bucket, else its type, else the default."""
+        with self._lock:
+            entry = self._stats.get(f"{job_type}:{self._bucket(size)}") or self._stats.get(job_type)
+            if entry:
+                return entry["mean"]
+        return DEFAULT_ESTIMATES.get(job_type, DEFAULT_ESTIMATE)
+
+
+def block_schedule_key(estimator: DurationEstimator):
+    """
+    Sort key for pending blocks (smallest goes first): priority, then latest start
+    (deadline minus the estimated develop time), then board order (block id).
+    """
+    def key(block: dict):
+        deadline = parse_deadline(block.get("deadline"))
+        latest_start = math.inf if deadline is None else deadline - estimator.estimate("develop", task_size(block))
+        return -block_priority(block), latest_start, block.get("block_id", "")
+    return key
@@ -0,0 +1,274 @@
+"""
+rate_limits.py
+
+Client-side rate limiting for LLM providers, so every agent thread shares one
+view of the quota instead of each discovering it through 429 errors.
+
+For each provider and model:
+  - a requests-per-minute and a tokens-per-minute token bucket (the token cost
+    of a request is estimated from its prompt up front and corrected from the
+    reply's length afterwards);
+  - a pause after a 429, for the provider's Retry-After, so queued requests wait
+    it out instead of all retrying into the limit again.
+And for each provider, a cap on requests in flight.
+
+Limits come from LLM_RATE_LIMITS, a JSON object keyed by provider or
+"provider/model" (the more specific key wins, field by field), e.g.
+
+    {"anthropic": {"rpm": 50, "tpm": 80000, "concurrency": 8},
+     "openai/gpt-4.1": {"tpm": 30000}}
+
+rpm / tpm left out (or null) means no limit. concurrency is per provider (set it
+under the provider's key) and defaults to DEFAULT_CONCURRENCY. The limiter runs
+on the LLM service's event loop, which every thread's calls go through.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+# Rough size of a token, for estimating a request's cost before sending it
+CHARS_PER_TOKEN = 4
+# Reply tokens reserved up front; corrected once the reply is in
+EXPECTED_OUTPUT_TOKENS = 1000
+# Retry backoff: doubles per attempt from the caller's initial delay, capped, with jitter
+MAX_BACKOFF = 60
+# Longest a queued request sleeps before looking at the budget again (settled replies give tokens back)
+RECHECK_INTERVAL = 0.5
+
+TRANSIENT_STATUSES = (408, 409, 429)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def load_limits() -> dict:
+    """LLM_RATE_LIMITS parsed, or {} (no rpm / tpm limits) when unset or invalid."""
+    raw = os.getenv("LLM_RATE_LIMITS")
+    if not raw:
+        return {}
+    try:
+        limits = json.loads(raw)
+        if not isinstance(limits, dict) or not all(isinstance(v, dict) for v in limits.values()):
+            raise ValueError("expected an object of objects")
+        return limits
+    except ValueError as e:
+        logger.warning(f"Ignoring invalid LLM_RATE_LIMITS: {e}")
+        return {}
+
+
+def status_code(error: Exception):
+    """The HTTP status of a provider error, if it has one."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        code = getattr(error, "code", None)  # google.api_core errors; OpenAI's `code` is a string
+        status = code if isinstance(code, int) else None
+    return status
+
+
+def retry_after(error: Exception):
+    """Seconds the provider asked us to wait (Retry-After / retry-after-ms), or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass  # An HTTP date; the backoff applies instead
+    return None
+
+
+def is_rate_limited(error: Exception) -> bool:
+    if status_code(error) == 429:
+        return True
+    message = str(error).lower()
+    return "rate_limit" in message or "resource exhausted" in message or "resource_exhausted" in message
+
+
+def is_transient(error: Exception) -> bool:
+    """Whether retrying `error` may succeed: rate limits, overload, server errors, network trouble."""
+    if getattr(error, "code", None) == "insufficient_quota":  # OpenAI answers 429 for an exhausted budget too
+        return False
+    status = status_code(error)
+    if status is not None:
+        return status in TRANSIENT_STATUSES or status >= 500
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    if "Connection" in type(error).__name__ or "Timeout" in type(error).__name__:  # APIConnectionError, APITimeoutError
+        return True
+    message = str(error).lower()
+    return is_rate_limited(error) or any(s in message for s in ("server error", "overloaded", "unavailable", "503"))
+
+
+def backoff_delay(attempt: int, initial_delay: float, error: Exception = None) -> float:
+    """
+    Seconds before retry number `attempt` (1-based): the provider's Retry-After when given,
+    otherwise initial_delay doubled per attempt; both jittered so callers that failed
+    together don't retry together.
+    """
+    requested = retry_after(error) if error is not None else None
+    if requested is not None:
+        return requested + random.uniform(0, max(1.0, requested * 0.1))
+    base = min(initial_delay * 2 ** (attempt - 1), MAX_BACKOFF)
+    return base / 2 + random.uniform(0, base / 2)
+
+
+class TokenBucket:
+    """`per_minute` units a minute, holding at most a minute's worth. Usage above a reservation puts it in debt."""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.rate = per_minute / 60
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` units are available (a request bigger than the bucket waits for a full one)."""
+        self._refill(now)
+        missing = min(amount, self.per_minute) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def take(self, amount: float):
+        self.level -= amount
+
+
+class _ModelLimits:
+    def __init__(self, limits: dict):
+        self.requests = TokenBucket(limits["rpm"]) if limits.get("rpm") else None
+        self.tokens = TokenBucket(limits["tpm"]) if limits.get("tpm") else None
+        self.paused_until = 0.0
+        self.turn = asyncio.Lock()  # Waiters are served first come, first served
+
+
+class Lease:
+    """A request admitted by the limiter; settle() corrects its token estimate once the reply is in."""
+
+    def __init__(self, limiter, provider: str, model: str, reserved_tokens: int):
+        self._limiter = limiter
+        self.provider = provider
+        self.model = model
+        self.reserved_tokens = reserved_tokens
+
+    def settle(self, tokens_used: int):
+        bucket = self._limiter._model(self.provider, self.model).tokens
+        if bucket is not None:
+            bucket.take(tokens_used - self.reserved_tokens)
+        self._limiter._count(self.provider, self.model, tokens=tokens_used - self.reserved_tokens)
+        self.reserved_tokens = tokens_used
+
+
+class RateLimiter:
+    """Request / token budgets and in-flight caps shared by all calls on the LLM event loop."""
+
+    def __init__(self, limits: dict = None):
+        self.limits = load_limits() if limits is None else limits
+        self._models = {}  # (provider, model) -> _ModelLimits
+        self._slots = {}  # provider -> asyncio.Semaphore
+        self._stats_lock = threading.Lock()  # stats() is read from other threads
+        self._stats = {}  # "provider/model" -> counters
+
+    def limits_for(self, provider: str, model: str) -> dict:
+        limits = {"rpm": None, "tpm": None, "concurrency": DEFAULT_CONCURRENCY}
+        limits.update(self.limits.get(provider, {}))
+        limits.update(self.limits.get(f"{provider}/{model}", {}))
+        return limits
+
+    def _model(self, provider: str, model: str) -> _ModelLimits:
+        key = (provider, model)
+        if key not in self._models:
+            self._models[key] = _ModelLimits(self.limits_for(provider, model))
+        return self._models[key]
+
+    def _slot(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self._slots:
+            self._slots[provider] = asyncio.Semaphore(self.limits_for(provider, None)["concurrency"] or DEFAULT_CONCURRENCY)
+        return self._slots[provider]
+
+    def _count(self, provider: str, model: str, **deltas):
+        with self._stats_lock:
+            stats = self._stats.setdefault(f"{provider}/{model}", {
+                "requests": 0, "tokens": 0, "waiting": 0, "in_flight": 0, "waited": 0,
+                "total_wait": 0.0, "max_wait": 0.0, "rate_limited": 0, "retries": 0})
+            for name, delta in deltas.items():
+                if name == "max_wait":
+                    stats[name] = max(stats[name], delta)
+                else:
+                    stats[name] += delta
+
+    def pause(self, provider: str, model: str, seconds: float):
+        """Holds back new requests to the model for `seconds` (the provider said it's over its limit)."""
+        limits = self._model(provider, model)
+        limits.paused_until = max(limits.paused_until, time.monotonic() + seconds)
+        self._count(provider, model, rate_limited=1)
+        logger.warning(f"LLM rate limit hit for {provider}/{model}; holding requests for {seconds:.1f}s")
+
+    def note_retry(self, provider: str, model: str):
+        self._count(provider, model, retries=1)
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, provider: str, model: str, prompt: str):
+        """
+        Waits for the model's request and token budget and a free provider slot, then yields a
+        Lease for the call. A rate-limit error raised inside pauses the model for its Retry-After.
+        """
+        limits = self._model(provider, model)
+        tokens = estimate_tokens(prompt) + EXPECTED_OUTPUT_TOKENS
+        started = time.monotonic()
+        self._count(provider, model, waiting=1)
+        try:
+            async with limits.turn:
+                while True:
+                    now = time.monotonic()
+                    delay = max(limits.paused_until - now,
+                                limits.requests.wait_time(1, now) if limits.requests else 0.0,
+                                limits.tokens.wait_time(tokens, now) if limits.tokens else 0.0)
+                    if delay <= 0:
+                        break
+                    await asyncio.sleep(min(delay, RECHECK_INTERVAL))
+                if limits.requests:
+                    limits.requests.take(1)
+                if limits.tokens:
+                    limits.tokens.take(tokens)
+            await self._slot(provider).acquire()
+        finally:
+            self._count(provider, model, waiting=-1)
+        waited = time.monotonic() - started
+        self._count(provider, model, requests=1, tokens=tokens, in_flight=1, total_wait=waited,
+                    max_wait=waited, waited=1 if waited >= 0.01 else 0)
+        try:
+            yield Lease(self, provider, model, tokens)
+        except Exception as e:
+            if is_rate_limited(e):
+                requested = retry_after(e)
+                self.pause(provider, model, requested if requested is not None else 1.0)
+            raise
+        finally:
+            self._slot(provider).release()
+            self._count(provider, model, in_flight=-1)
+
+    def stats(self) -> dict:
+        """Per provider/model: requests admitted, queue waits (count waited, total, max seconds), 429s, retries."""
+        with self._stats_lock:
+            stats = {key: dict(s) for key, s in self._stats.items()}
+        for key, s in stats.items():
+            s["avg_wait"] = round(s["total_wait"] / s["requests"], 3) if s["requests"] else None
+            s["total_wait"] = round(s["total_wait"], 3)
+            s["max_wait"] = round(s["max_wait"], 3)
+            provider, model = key.split("/", 1)
+            s["limits"] = self.limits_for(provider, model)
+        return stats
@@ -0,0 +1,162 @@
+"""
+spatial.py
+
+Zone occupancy index for the board.
+
+Zone rectangles are bucketed into a uniform grid (cell -> zones overlapping it),
+so mapping an agent's position to the zones containing it only looks at one
+cell. Each zone keeps the set of agents inside it, and the zones of each kind
+("finish" = anything not typed 'dropoff', "dropoff") that still have room
+(fewer agents than their `capacity`, default 1) are kept as a set. Moving an
+agent updates only the zones it left and entered, and finding a free zone no
+longer scans every agent against every zone.
+"""
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+# Grid cell edge in board pixels; zones are ~100px squares
+DEFAULT_CELL_SIZE = 100
+
+ZONE_KEYS = ("id", "x", "y", "width", "height")
+
+
+def zone_kind(zone: dict) -> str:
+    """'dropoff' for QA drop-off zones, 'finish' for every other zone."""
+    return "dropoff" if zone.get("type") == "dropoff" else "finish"
+
+
+def zone_capacity(zone: dict) -> int:
+    """How many agents a zone holds; 1 unless the layout says otherwise."""
+    capacity = zone.get("capacity", 1)
+    return capacity if isinstance(capacity, int) and capacity > 0 else 1
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ZoneOccupancyIndex:
+    """Not thread-safe on its own; the board state store calls it under its lock."""
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self._zones = {}       # zone id -> zone dict (valid zones only)
+        self._rank = {}        # zone id -> position in the layout order
+        self._by_kind = {"finish": [], "dropoff": []}  # kind -> zone ids in layout order
+        self._grid = {}        # (cx, cy) -> list of zone ids overlapping the cell
+        self._cells = {}       # zone id -> the grid cells it was added to
+        self._occupants = {}   # zone id -> set of agent ids inside it
+        self._agent_zones = {} # agent id -> tuple of zone ids containing it
+        self._positions = {}   # agent id -> (x, y)
+        self._open = {"finish": set(), "dropoff": set()}  # zones with room for another agent
+
+    def _cell(self, x: float, y: float):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def set_zones(self, zones: list):
+        """Rebuilds the grid for a new zone layout and re-derives occupancy from known positions."""
+        self._zones, self._rank, self._grid, self._cells = {}, {}, {}, {}
+        self._by_kind = {"finish": [], "dropoff": []}
+        for zone in zones:
+            if not all(k in zone for k in ZONE_KEYS) or not all(_is_number(zone[k]) for k in ZONE_KEYS[1:]):
+                logger.warning(f"Skipping invalid zone data in occupancy index: {zone}")
+                continue
+            zone_id = zone["id"]
+            if zone_id in self._zones:
+                # A repeated id replaces the earlier entry rather than indexing the zone twice
+                self._by_kind[zone_kind(self._zones[zone_id])].remove(zone_id)
+                for cell in self._cells.pop(zone_id):
+                    self._grid[cell].remove(zone_id)
+            self._by_kind[zone_kind(zone)].append(zone_id)
+            self._zones[zone_id] = zone
+            self._rank.setdefault(zone_id, len(self._rank))
+            x0, y0 = self._cell(zone["x"], zone["y"])
+            x1, y1 = self._cell(zone["x"] + zone["width"], zone["y"] + zone["height"])
+            cells = [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+            for cell in cells:
+                self._grid.setdefault(cell, []).append(zone_id)
+            self._cells[zone_id] = cells
+
+        self._occupants = {zone_id: set() for zone_id in self._zones}
+        self._agent_zones = {}
+        for agent_id, (x, y) in self._positions.items():
+            inside = self.zones_at(x, y)
+            self._agent_zones[agent_id] = inside
+            for zone_id in inside:
+                self._occupants[zone_id].add(agent_id)
+        self._open = {"finish": set(), "dropoff": set()}
+        for zone_id in self._zones:
+            self._refresh_open(zone_id)
+
+    def zones_at(self, x: float, y: float) -> tuple:
+        """Ids of the zones containing the point (same half-open test the board always used)."""
+        result = []
+        for zone_id in self._grid.get(self._cell(x, y), ()):
+            zone = self._zones[zone_id]
+            if zone["x"] <= x < zone["x"] + zone["width"] and zone["y"] <= y < zone["y"] + zone["height"]:
+                result.append(zone_id)
+        return tuple(result)
+
+    def move_agent(self, agent_id: str, x, y):
+        """Records an agent's position. Non-numeric coordinates take it off the board."""
+        if not (_is_number(x) and _is_number(y)):
+            self.remove_agent(agent_id)
+            return
+        if self._positions.get(agent_id) == (x, y):
+            return
+        self._positions[agent_id] = (x, y)
+        self._set_agent_zones(agent_id, self.zones_at(x, y))
+
+    def remove_agent(self, agent_id: str):
+        self._positions.pop(agent_id, None)
+        self._set_agent_zones(agent_id, ())
+        self._agent_zones.pop(agent_id, None)
+
+    def _set_agent_zones(self, agent_id: str, inside: tuple):
+        previous = self._agent_zones.get(agent_id, ())
+        if previous == inside:
+            return
+        for zone_id in set(previous) - set(inside):
+            self._occupants[zone_id].discard(agent_id)
+            self._refresh_open(zone_id)
+        for zone_id in set(inside) - set(previous):
+            self._occupants[zone_id].add(agent_id)
+            self._refresh_open(zone_id)
+        self._agent_zones[agent_id] = inside
+
+    def _refresh_open(self, zone_id: str):
+        zone = self._zones[zone_id]
+        if len(self._occupants[zone_id]) < zone_capacity(zone):
+            self._open[zone_kind(zone)].add(zone_id)
+        else:
+            self._open[zone_kind(zone)].discard(zone_id)
+
+    def agent_zone_ids(self, agent_id: str) -> tuple:
+        return self._agent_zones.get(agent_id, ())
+
+    def occupants(self, zone_id: str) -> set:
+        return set(self._occupants.get(zone_id, ()))
+
+    def open_slots(self, kind: str, ignore_agent_ids=()) -> list:
+        """
+        [(zone_id, free_slots), ...] for zones of `kind` with room left, in layout order.
+        Agents in `ignore_agent_ids` (e.g. the ones about to move) don't take up room.
+        """
+        ignore = set(ignore_agent_ids)
+        candidates = set(self._open.get(kind, ()))
+        for agent_id in ignore:
+            candidates.update(z for z in self._agent_zones.get(agent_id, ()) if zone_kind(self._zones[z]) == kind)
+        result = []
+        for zone_id in sorted(candidates, key=self._rank.get):
+            free = zone_capacity(self._zones[zone_id]) - len(self._occupants[zone_id] - ignore)
+            if free > 0:
+                result.append((zone_id, free))
+        return result
+
+    def zone(self, zone_id: str) -> dict:
+        return self._zones.get(zone_id)
+
+    def zone_count(self, kind: str) -> int:
+        return len(self._by_kind.get(kind, ()))
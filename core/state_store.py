@@ -0,0 +1,937 @@
+"""
+state_store.py
+
+Process-wide, in-memory board state for agents, blocks and zones.
+
+The store loads the board once from a storage backend (see core/storage.py:
+the original output/ JSON layout, or SQLite) and then serves every read from
+memory. Writes update memory immediately and are persisted through the backend
+by a background writer thread, so request handlers and worker threads never
+wait on disk. Agents and blocks are also indexed by the fields the board is
+queried by (see `find_agents` / `find_blocks`).
+
+Each agent record carries its own `version`, bumped on every write. Callers
+doing read-check-write take the agent's lock (`agent_lock`) and pass
+`expected_version` so a concurrent writer turns into a VersionConflict instead
+of a lost update.
+
+The store is the board's only writer: load() takes an exclusive lock on the
+output directory (output/locks/board-writer.lock) until close(), and a second
+process loading the same output/ fails with BoardInUse. Versions checked
+against memory are therefore the board's real versions; other processes (remote
+workers) go through the server's API.
+
+Every mutation bumps a monotonically increasing board `version` and stamps the
+changed agent/block/zone with it, so clients can ask for just the changes
+since the version they last saw (see `delta_since`).
+
+Every mutation is also recorded as an event in an append-only journal
+(core/journal.py, disable with BOARD_JOURNAL=off). On startup the store loads
+the journal's latest snapshot and replays the tail instead of reading the
+whole storage backend; the journal then wins over the backend, which is
+brought back in step for anything the tail touched.
+"""
+import atexit
+import copy
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import namedtuple
+from pathlib import Path
+
+from core.journal import BoardJournal, replay
+from core.locks import LockManager, LockTimeout
+from core.spatial import ZoneOccupancyIndex, zone_kind
+from core.storage import FailedWrites, StorageBackend, create_storage
+
+logger = logging.getLogger(__name__)
+
+BASE_OUTPUT = Path("output")
+
+# How many deletions are remembered for delta responses before older
+# clients are told to fetch a full snapshot instead.
+MAX_TOMBSTONES = 5000
+
+# /state payloads are serialized (and gzipped) once per board version and shared by all clients.
+# Holds the full snapshot plus the deltas for the few distinct 'since' values clients are on.
+MAX_CACHED_PAYLOADS = 32
+GZIP_LEVEL = 6
+
+EncodedState = namedtuple("EncodedState", "epoch version full body gzipped")
+
+INITIAL_AGENT_X = 50
+INITIAL_AGENT_Y = 50
+
+# Seconds between checks for zone layout edits made outside the server (zones.json by hand)
+ZONES_FILE_CHECK_INTERVAL = 2.0
+
+# Seconds the writer waits before retrying writes that failed (full disk, locked database, ...)
+STORAGE_RETRY_DELAY = 5.0
+
+# Lock (under output/locks/) held by the one process that has the board loaded
+WRITER_LOCK = "board-writer"
+
+# --- Define Finish Zones (Example Coordinates) ---
+# Used whenever the storage backend has no (valid) zone layout.
+DEFAULT_FINISH_ZONES = [
+    {"id": "finish-zone-1", "x": 50,  "y": 50, "width": 100, "height": 100, "label": "Zone 1"},
+    {"id": "finish-zone-2", "x": 200, "y": 50, "width": 100, "height": 100, "label": "Zone 2"},
+    {"id": "finish-zone-3", "x": 350, "y": 50, "width": 100, "height": 100, "label": "Zone 3"},
+    {"id": "finish-zone-4", "x": 500, "y": 50, "width": 100, "height": 100, "label": "Zone 4"},
+    {"id": "finish-zone-5", "x": 650, "y": 50, "width": 100, "height": 100, "label": "Zone 5"},
+    {"id": "finish-zone-6", "x": 800, "y": 50, "width": 100, "height": 100, "label": "Zone 6"},
+]
+
+
+class VersionConflict(Exception):
+    """A compare-and-swap update found the agent at a different version than expected."""
+
+    def __init__(self, agent_id: str, expected: int, actual: int):
+        super().__init__(f"Agent {agent_id} is at version {actual}, expected {expected}")
+        self.agent_id = agent_id
+        self.expected = expected
+        self.actual = actual
+
+
+class BoardInUse(RuntimeError):
+    """Another process (or store) already owns the board under this output directory."""
+
+    def __init__(self, base_output: Path):
+        super().__init__(f"The board under {base_output} is already loaded by another process; "
+                         f"only one process may write it")
+        self.base_output = base_output
+
+
+class _FieldIndex:
+    """value -> set of record ids for one field, kept in step with the records."""
+
+    def __init__(self, field: str, default=None):
+        self.field = field
+        self.default = default
+        self._keys = {}     # record id -> indexed value
+        self._buckets = {}  # indexed value -> set of record ids
+
+    def set(self, item_id: str, record: dict):
+        value = record.get(self.field, self.default)
+        old = self._keys.get(item_id, _MISSING)
+        if old == value:
+            return
+        if old is not _MISSING:
+            self._buckets[old].discard(item_id)
+        self._keys[item_id] = value
+        self._buckets.setdefault(value, set()).add(item_id)
+
+    def discard(self, item_id: str):
+        old = self._keys.pop(item_id, _MISSING)
+        if old is not _MISSING:
+            self._buckets[old].discard(item_id)
+
+    def find(self, value) -> set:
+        return set(self._buckets.get(value, ()))
+
+
+_MISSING = object()
+
+# Fields agents and blocks can be looked up by without scanning every record
+AGENT_INDEX_FIELDS = {"state": "unknown", "agent_type": None, "assigned_block_id": None}
+BLOCK_INDEX_FIELDS = {"status": "pending"}
+
+
+class BoardStateStore:
+    """
+    Authoritative in-memory copy of the board.
+    All public methods are thread-safe and return copies, never internal dicts.
+    """
+
+    def __init__(self, base_output: Path = BASE_OUTPUT, flush_interval: float = 0.25,
+                 storage: StorageBackend = None, journal: BoardJournal = None):
+        self.base_output = Path(base_output)
+        self.storage = storage
+        self.journal = journal
+        self.flush_interval = flush_interval
+        self.locks = LockManager(self.base_output / "locks")
+
+        self._lock = threading.RLock()
+        self._version_changed = threading.Condition(self._lock)  # Notified on every version bump
+        self._agents = {}        # agent_id -> raw agent_info dict
+        self._blocks = {}        # block_id -> raw block dict
+        self._block_order = []   # block ids sorted like the old sorted(glob) listing
+        self._zones = []
+        self._agent_index = {f: _FieldIndex(f, d) for f, d in AGENT_INDEX_FIELDS.items()}
+        self._block_index = {f: _FieldIndex(f, d) for f, d in BLOCK_INDEX_FIELDS.items()}
+        self._zone_index = ZoneOccupancyIndex()  # Which agents stand in which zone
+        self._transition_listeners = []  # callables(agent_id, from_state, to_state, agent_type)
+
+        # Versioning for delta responses. The epoch changes on every process start,
+        # so a version number from a previous run is never mistaken for this one.
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._changed = {"agents": {}, "blocks": {}, "zones": {}}   # kind -> id -> version
+        self._tombstones = {"agents": {}, "blocks": {}, "zones": {}}  # kind -> id -> version
+        self._delta_floor = 0  # deltas from versions below this are no longer answerable
+        self._encoded = {}  # (since or None, version) -> EncodedState, current version only
+
+        # Live progress of work in flight (agent_id -> dict), outside the versioned records
+        self._progress = {}
+        self._progress_version = 0
+
+        # Journal events not yet appended to disk, and the last sequence number handed out
+        self._journal_pending = []
+        self._journal_seq = 0
+
+        # Pending persistence work, drained by the writer thread
+        self._flush_lock = threading.Lock()  # One flush at a time keeps journal and storage writes in order
+        self._dirty_agents = set()
+        self._deleted_agents = set()
+        self._dirty_blocks = set()
+        self._deleted_blocks = set()
+        self._zones_dirty = False
+        self._dirty_event = threading.Event()
+        self._closed = False
+        self._writer = None
+        self._owner_lock = None  # File handle holding WRITER_LOCK while the store is loaded
+
+    # --- Loading ---
+    def load(self):
+        """
+        Loads the board once at startup: from the journal's snapshot plus tail when
+        there is one, otherwise from the storage backend (seeding a first snapshot).
+        Raises BoardInUse if another process already has the board loaded.
+        """
+        try:
+            self._owner_lock = self.locks.acquire_exclusive(WRITER_LOCK)
+        except LockTimeout:
+            raise BoardInUse(self.base_output) from None
+        try:
+            return self._load()
+        except BaseException:
+            self.locks.release_exclusive(self._owner_lock)
+            self._owner_lock = None
+            raise
+
+    def _load(self):
+        if self.storage is None:
+            self.storage = create_storage(self.base_output)
+        if self.journal is None and os.getenv("BOARD_JOURNAL", "on").strip().lower() not in ("0", "off", "false", "no"):
+            self.journal = BoardJournal(self.base_output / "journal")
+
+        snapshot, tail = self.journal.load() if self.journal is not None else (None, [])
+        if snapshot is not None:
+            state = {"agents": snapshot.get("agents", {}), "blocks": snapshot.get("blocks", {}),
+                     "zones": snapshot.get("zones")}
+            touched = replay(state, tail)
+            agents, blocks, zones = state["agents"], state["blocks"], state["zones"]
+            self._journal_seq = tail[-1]["seq"] if tail else snapshot.get("seq", 0)
+            self._drop_agents_without_workspace(agents, touched)
+            # The backend may be behind the journal after a crash; rewrite what the tail touched
+            self._dirty_agents |= touched["agents"]
+            self._deleted_agents |= touched["deleted_agents"]
+            self._dirty_blocks |= touched["blocks"]
+            self._deleted_blocks |= touched["deleted_blocks"]
+            self._zones_dirty = touched["zones"]
+            source = f"journal (snapshot seq {snapshot.get('seq', 0)} + {len(tail)} events)"
+        else:
+            agents, blocks, zones = self.storage.load_all()
+            source = f"{self.storage.name} storage"
+        if zones is None:
+            zones = copy.deepcopy(DEFAULT_FINISH_ZONES)
+        if snapshot is None and self.journal is not None:
+            self.journal.write_snapshot(self._journal_seq, {"agents": agents, "blocks": blocks, "zones": zones})
+
+        with self._lock:
+            self._agents = agents
+            self._blocks = blocks
+            self._block_order = sorted(blocks)
+            self._zones = zones
+            self._zone_index.set_zones(zones)
+            for agent_id, info in agents.items():
+                self._index_agent(agent_id)
+            for block_id in blocks:
+                self._index_block(block_id)
+            self._bump_version()
+            self._delta_floor = self.version
+        logger.info(f"Board state loaded from {source}: "
+                    f"{len(agents)} agents, {len(blocks)} blocks, {len(zones)} zones")
+        if self._dirty_agents or self._deleted_agents or self._dirty_blocks or self._deleted_blocks or self._zones_dirty:
+            self._dirty_event.set()
+        self._start_writer()
+        return self
+
+    def _drop_agents_without_workspace(self, agents: dict, touched: dict):
+        """An agent's directory is its workspace; one removed while we were down is gone for good."""
+        agents_dir = self.base_output / "agents"
+        for agent_id in [a for a in agents if not (agents_dir / a).is_dir()]:
+            logger.warning(f"Agent {agent_id} is in the journal but its directory is missing. Dropping it.")
+            del agents[agent_id]
+            touched["agents"].discard(agent_id)
+            touched["deleted_agents"].add(agent_id)
+            self._journal_seq += 1
+            self._journal_pending.append({"seq": self._journal_seq, "ts": time.time(),
+                                          "type": "agent_delete", "agent_id": agent_id})
+
+    # --- Journal ---
+    def _record(self, event_type: str, **payload):
+        """Queues a journal event for the writer thread. Caller holds the lock; payload must be a private copy."""
+        if self.journal is None:
+            return
+        self._journal_seq += 1
+        self._journal_pending.append(dict(payload, seq=self._journal_seq, ts=time.time(), type=event_type))
+
+    def transitions(self, agent_id: str = None, since: float = None, until: float = None) -> list:
+        """Agent state transitions from the journal (time series for throughput analysis)."""
+        if self.journal is None:
+            return []
+        self.flush()  # Make sure recent events are on disk before reading them back
+        with self._flush_lock:  # A snapshot written meanwhile could compact the segments being read
+            return self.journal.transitions(agent_id=agent_id, since=since, until=until)
+
+    # --- Agent reads ---
+    @staticmethod
+    def _agent_view(agent_id: str, info: dict) -> dict:
+        """Agent record as served to clients, with the same defaults list_agents always applied."""
+        agent_data = {
+            "agent_id": agent_id, "name": "Agent " + agent_id[-6:],
+            "state": "unknown", "assigned_block_id": None,
+            "source_block_title": None, "x": INITIAL_AGENT_X, "y": INITIAL_AGENT_Y,
+            "version": 0,
+        }
+        agent_data.update(copy.deepcopy(info))
+        agent_data["x"] = agent_data.get("x", INITIAL_AGENT_X)
+        agent_data["y"] = agent_data.get("y", INITIAL_AGENT_Y)
+        return agent_data
+
+    def has_agent(self, agent_id: str) -> bool:
+        with self._lock:
+            return agent_id in self._agents
+
+    def get_agent(self, agent_id: str):
+        """Returns a copy of the agent record, or None if unknown."""
+        with self._lock:
+            info = self._agents.get(agent_id)
+            return None if info is None else self._agent_view(agent_id, info)
+
+    def list_agents(self) -> list:
+        with self._lock:
+            return [self._agent_view(agent_id, info) for agent_id, info in self._agents.items()]
+
+    def find_agents(self, **criteria) -> list:
+        """
+        Agents matching every indexed field given, e.g. find_agents(state="idle", agent_type="qa").
+        Answered from the in-memory indexes instead of scanning every record.
+        """
+        with self._lock:
+            ids = self._lookup(self._agent_index, criteria, self._agents)
+            return [self._agent_view(agent_id, self._agents[agent_id]) for agent_id in sorted(ids)]
+
+    def _index_agent(self, agent_id: str):
+        info = self._agents[agent_id]
+        for index in self._agent_index.values():
+            index.set(agent_id, info)
+        self._zone_index.move_agent(agent_id, info.get("x", INITIAL_AGENT_X), info.get("y", INITIAL_AGENT_Y))
+
+    @staticmethod
+    def _lookup(indexes: dict, criteria: dict, records: dict) -> set:
+        ids = set(records)
+        for field, value in criteria.items():
+            if field not in indexes:
+                raise ValueError(f"'{field}' is not an indexed field")
+            ids &= indexes[field].find(value)
+        return ids
+
+    # --- Agent writes ---
+    def add_transition_listener(self, listener):
+        """
+        Calls `listener(agent_id, from_state, to_state, agent_type)` on every agent state change.
+        Listeners run under the store lock, so they must only hand the event off (e.g. to a queue).
+        """
+        with self._lock:
+            self._transition_listeners.append(listener)
+
+    def _notify_transition(self, agent_id: str, transition):
+        if not transition:
+            return
+        for listener in self._transition_listeners:
+            try:
+                listener(agent_id, transition["from"], transition["to"], transition.get("agent_type"))
+            except Exception as e:
+                logger.error(f"Agent transition listener failed for {agent_id}: {e}")
+
+    def agent_lock(self, agent_id: str, timeout: float = None):
+        """
+        Context manager holding this agent's lock (threads and processes).
+        Use around read-check-write sequences together with `expected_version`.
+        """
+        return self.locks.lock(agent_id, timeout=timeout)
+
+    def put_agent(self, agent_id: str, data: dict) -> dict:
+        """Creates or replaces an agent record."""
+        with self._lock:
+            previous = self._agents.get(agent_id, {})
+            data = copy.deepcopy(data)
+            data["version"] = max(previous.get("version", 0), data.get("version", 0)) + 1
+            self._agents[agent_id] = data
+            transition = None
+            if data.get("state") != previous.get("state"):
+                transition = {"from": previous.get("state"), "to": data.get("state"), "agent_type": data.get("agent_type")}
+            self._record("agent_put", agent_id=agent_id, data=copy.deepcopy(data), transition=transition)
+            self._notify_transition(agent_id, transition)
+            self._index_agent(agent_id)
+            self._deleted_agents.discard(agent_id)
+            self._mark_changed("agents", agent_id)
+            self._mark_agent_dirty(agent_id)
+            return self._agent_view(agent_id, self._agents[agent_id])
+
+    def update_agent(self, agent_id: str, expected_version: int = None, **fields):
+        """
+        Merges `fields` into the agent record and bumps its version.
+        With `expected_version`, only applies if the record is still at that
+        version (compare-and-swap) and raises VersionConflict otherwise.
+        Returns the updated record, or None if the agent does not exist.
+        """
+        with self._lock:
+            info = self._agents.get(agent_id)
+            if info is None:
+                return None
+            current = info.get("version", 0)
+            if expected_version is not None and current != expected_version:
+                raise VersionConflict(agent_id, expected_version, current)
+            fields.pop("version", None)  # The version is owned by the store
+            transition = None
+            if "state" in fields and fields["state"] != info.get("state"):
+                transition = {"from": info.get("state"), "to": fields["state"], "agent_type": info.get("agent_type")}
+            info.update(copy.deepcopy(fields))
+            info["version"] = current + 1
+            self._record("agent_update", agent_id=agent_id, transition=transition,
+                         fields=dict(copy.deepcopy(fields), version=info["version"]))
+            self._notify_transition(agent_id, transition)
+            self._index_agent(agent_id)
+            self._mark_changed("agents", agent_id)
+            self._mark_agent_dirty(agent_id)
+            return self._agent_view(agent_id, info)
+
+    def delete_agent(self, agent_id: str) -> bool:
+        """Forgets an agent. The caller owns removing its workspace directory."""
+        with self._lock:
+            existed = self._agents.pop(agent_id, None) is not None
+            self._dirty_agents.discard(agent_id)
+            self.set_progress(agent_id, None)
+            if existed:
+                for index in self._agent_index.values():
+                    index.discard(agent_id)
+                self._zone_index.remove_agent(agent_id)
+                self._record("agent_delete", agent_id=agent_id)
+                self._mark_deleted("agents", agent_id)
+                self._deleted_agents.add(agent_id)
+                self._dirty_event.set()
+            return existed
+
+    # --- Progress ---
+    def set_progress(self, agent_id: str, progress: dict = None):
+        """
+        Sets the agent's live progress (None clears it). Unlike agent fields it isn't
+        versioned, journaled or persisted and wakes no /state consumers, so it can change
+        every second; GET /state/progress serves it.
+        """
+        with self._lock:
+            if progress is None:
+                if self._progress.pop(agent_id, None) is None:
+                    return
+            elif agent_id in self._agents:
+                self._progress[agent_id] = copy.deepcopy(progress)
+            else:
+                return
+            self._progress_version += 1
+
+    def get_progress(self) -> tuple:
+        """(progress version, agent_id -> progress) for the agents with work in flight."""
+        with self._lock:
+            return self._progress_version, copy.deepcopy(self._progress)
+
+    def _mark_agent_dirty(self, agent_id: str):
+        self._dirty_agents.add(agent_id)
+        self._dirty_event.set()
+
+    # --- Block reads ---
+    def get_block(self, block_id: str):
+        with self._lock:
+            block = self._blocks.get(block_id)
+            return None if block is None else copy.deepcopy(block)
+
+    def list_blocks(self) -> list:
+        """All blocks in file-name order, each tagged with its 'server_index'."""
+        with self._lock:
+            blocks = []
+            for idx, block_id in enumerate(self._block_order):
+                data = copy.deepcopy(self._blocks[block_id])
+                data["server_index"] = idx
+                blocks.append(data)
+            return blocks
+
+    def find_blocks(self, **criteria) -> list:
+        """Blocks matching every indexed field given, e.g. find_blocks(status="pending"), in board order."""
+        with self._lock:
+            ids = self._lookup(self._block_index, criteria, self._blocks)
+            blocks = []
+            for idx, block_id in enumerate(self._block_order):
+                if block_id in ids:
+                    data = copy.deepcopy(self._blocks[block_id])
+                    data["server_index"] = idx
+                    blocks.append(data)
+            return blocks
+
+    def count_blocks(self, **criteria) -> int:
+        """Number of blocks matching every indexed field given, without copying them."""
+        with self._lock:
+            return len(self._lookup(self._block_index, criteria, self._blocks))
+
+    def _index_block(self, block_id: str):
+        for index in self._block_index.values():
+            index.set(block_id, self._blocks[block_id])
+
+    # --- Block writes ---
+    def replace_blocks(self, blocks: list, keep_fields=()):
+        """
+        Makes `blocks` the complete block set (the POST /blocks semantics).
+        Each block must carry its 'block_id'. Fields in `keep_fields` that a posted
+        block leaves out keep their current value (e.g. a claim made since the
+        client loaded the board). Returns (saved_ids, deleted_ids).
+        """
+        with self._lock:
+            new_blocks = {b["block_id"]: copy.deepcopy(b) for b in blocks}
+            for block_id, block in new_blocks.items():
+                current = self._blocks.get(block_id, {})
+                for field in keep_fields:
+                    if field not in block and field in current:
+                        block[field] = copy.deepcopy(current[field])
+            deleted = set(self._blocks) - set(new_blocks)
+            old_blocks, old_order = self._blocks, self._block_order
+            self._blocks = new_blocks
+            self._block_order = sorted(new_blocks)
+            for block_id in deleted:
+                for index in self._block_index.values():
+                    index.discard(block_id)
+            for block_id in new_blocks:
+                self._index_block(block_id)
+            self._record("blocks_replace", blocks=copy.deepcopy(list(new_blocks.values())))
+            self._mark_blocks_changed(old_blocks, old_order, deleted)
+            self._dirty_blocks = (self._dirty_blocks - deleted) | set(new_blocks)
+            self._deleted_blocks = (self._deleted_blocks | deleted) - set(new_blocks)
+            self._dirty_event.set()
+            return list(new_blocks), sorted(deleted)
+
+    def update_block(self, block_id: str, **fields):
+        """Merges `fields` into a block. Returns the updated block, or None if unknown."""
+        with self._lock:
+            if block_id not in self._blocks:
+                return None
+            return self._update_block(block_id, fields)
+
+    def _update_block(self, block_id: str, fields: dict) -> dict:
+        """update_block for a known block. Caller holds the lock."""
+        block = self._blocks[block_id]
+        block.update(copy.deepcopy(fields))
+        self._index_block(block_id)
+        self._record("block_update", block_id=block_id, fields=copy.deepcopy(fields))
+        self._mark_changed("blocks", block_id)
+        self._dirty_blocks.add(block_id)
+        self._dirty_event.set()
+        return copy.deepcopy(block)
+
+    def claim_block(self, agent_id: str, block_id: str = None, key=None):
+        """
+        Atomically marks a block 'taken' by `agent_id`: `block_id` unless another
+        agent holds it, or else the first pending block (the dispatch queue, read
+        from the status index) by `key(block)`, or in board order without one.
+        Returns the claimed block, or None when it's taken / nothing is pending.
+        """
+        with self._lock:
+            if block_id is None:
+                pending = self._block_index["status"].find("pending")
+                if not pending:
+                    return None
+                if key is None:
+                    block_id = min(pending)  # _block_order is the sorted ids
+                else:
+                    block_id = min(pending, key=lambda b: key(self._blocks[b]))
+            block = self._blocks.get(block_id)
+            if block is None:
+                return None
+            if block.get("status") == "taken" and block.get("agent_id") != agent_id:
+                return None
+            return self._update_block(block_id, {"status": "taken", "agent_id": agent_id, "claimed_at": time.time()})
+
+    def release_block(self, block_id: str, agent_id: str, status: str = "pending", from_statuses=("taken",)):
+        """
+        Ends `agent_id`'s claim on a block with `status` ('pending' puts it back
+        in the queue, 'done' / 'failed' / 'cancelled' finish it). Only applies while
+        the block is still the agent's and in one of `from_statuses`; otherwise
+        does nothing and returns None.
+        """
+        with self._lock:
+            block = self._blocks.get(block_id)
+            if block is None or block.get("status") not in from_statuses or block.get("agent_id") != agent_id:
+                return None
+            fields = {"status": status}
+            if status == "pending":
+                fields.update(agent_id=None, claimed_at=None, finished_at=None)
+            else:
+                fields["finished_at"] = time.time()
+            return self._update_block(block_id, fields)
+
+    # --- Zones ---
+    def get_zones(self) -> list:
+        with self._lock:
+            return copy.deepcopy(self._zones)
+
+    def open_zone_slots(self, kind: str, exclude_agent_ids=()) -> list:
+        """
+        [(zone, free_slots), ...] for zones of `kind` ("finish" or "dropoff") with room
+        left, in layout order, from the incremental occupancy index. Agents in
+        `exclude_agent_ids` don't count as occupants.
+        """
+        with self._lock:
+            slots = self._zone_index.open_slots(kind, ignore_agent_ids=exclude_agent_ids)
+            return [(copy.deepcopy(self._zone_index.zone(zone_id)), free) for zone_id, free in slots]
+
+    def zone_occupants(self, zone_id: str) -> set:
+        with self._lock:
+            return self._zone_index.occupants(zone_id)
+
+    def agent_in_zone(self, agent_id: str, kind: str) -> bool:
+        """Whether the agent stands inside a zone of `kind` ("finish" or "dropoff")."""
+        with self._lock:
+            return any(zone_kind(self._zone_index.zone(z)) == kind for z in self._zone_index.agent_zone_ids(agent_id))
+
+    def count_zones(self, kind: str) -> int:
+        with self._lock:
+            return self._zone_index.zone_count(kind)
+
+    def set_zones(self, zones: list, persist: bool = True):
+        """
+        Replaces the zone layout. `persist=False` is for a layout that was just read
+        from storage (an external edit), so it isn't written straight back.
+        """
+        with self._lock:
+            old_zones = {str(z.get("id")): z for z in self._zones}
+            self._zones = copy.deepcopy(zones)
+            self._record("zones_set", zones=copy.deepcopy(self._zones))
+            self._zone_index.set_zones(self._zones)
+            new_zones = {str(z.get("id")): z for z in self._zones}
+            self._bump_version()
+            for zone_id, zone in new_zones.items():
+                if old_zones.get(zone_id) != zone:
+                    self._changed["zones"][zone_id] = self.version
+                    self._tombstones["zones"].pop(zone_id, None)
+            for zone_id in set(old_zones) - set(new_zones):
+                self._mark_deleted("zones", zone_id)
+            if persist:
+                self._zones_dirty = True
+                self._dirty_event.set()
+
+    def _reload_external_zones(self):
+        """Picks up a zone layout edited on disk by hand (writer thread)."""
+        with self._flush_lock:  # Not while our own flush is writing the same file
+            try:
+                zones = self.storage.zones_changed_externally()
+            except Exception as e:
+                logger.error(f"Could not check the stored zone layout for changes: {e}")
+                return
+            if zones is None:
+                return
+            with self._lock:
+                if zones == self._zones:
+                    return
+                self.set_zones(zones, persist=False)
+            logger.info(f"Zone layout reloaded from {self.storage.name} storage: {len(zones)} zones")
+
+    # --- Versioning ---
+    def _bump_version(self) -> int:
+        """Advances the board version and wakes stream waiters. Caller holds the lock."""
+        self.version += 1
+        self._version_changed.notify_all()
+        return self.version
+
+    def _mark_changed(self, kind: str, item_id: str):
+        """Bumps the board version and stamps `item_id` with it. Caller holds the lock."""
+        self._bump_version()
+        self._changed[kind][item_id] = self.version
+        self._tombstones[kind].pop(item_id, None)
+
+    def _mark_deleted(self, kind: str, item_id: str):
+        self._bump_version()
+        self._changed[kind].pop(item_id, None)
+        self._tombstones[kind][item_id] = self.version
+        self._prune_tombstones()
+
+    def _mark_blocks_changed(self, old_blocks: dict, old_order: list, deleted: set):
+        """
+        Stamps blocks whose content or 'server_index' changed after a replace.
+        server_index follows the sorted ids, so an insert or delete shifts later blocks too.
+        """
+        old_index = {block_id: idx for idx, block_id in enumerate(old_order)}
+        self._bump_version()
+        for idx, block_id in enumerate(self._block_order):
+            if old_blocks.get(block_id) != self._blocks[block_id] or old_index.get(block_id) != idx:
+                self._changed["blocks"][block_id] = self.version
+                self._tombstones["blocks"].pop(block_id, None)
+        for block_id in deleted:
+            self._changed["blocks"].pop(block_id, None)
+            self._tombstones["blocks"][block_id] = self.version
+        self._prune_tombstones()
+
+    def _prune_tombstones(self):
+        """Keeps tombstone memory bounded; clients older than the pruned range get a full snapshot."""
+        total = sum(len(t) for t in self._tombstones.values())
+        if total <= MAX_TOMBSTONES:
+            return
+        everything = sorted(
+            (v, kind, item_id) for kind, t in self._tombstones.items() for item_id, v in t.items()
+        )
+        for v, kind, item_id in everything[: total - MAX_TOMBSTONES]:
+            del self._tombstones[kind][item_id]
+            self._delta_floor = max(self._delta_floor, v + 1)
+
+    def wait_for_change(self, version: int, timeout: float = None) -> int:
+        """
+        Blocks until the board version moves past `version` (or `timeout` elapses)
+        and returns the current version. Used by the /state/stream push channel.
+        """
+        with self._version_changed:
+            self._version_changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def etag(self) -> str:
+        """Entity tag for the current board version."""
+        with self._lock:
+            return f"{self.epoch}-{self.version}"
+
+    # --- Snapshot ---
+    def snapshot(self) -> dict:
+        """Blocks, agents and zones as one consistent view (the /state payload)."""
+        with self._lock:
+            return {
+                "epoch": self.epoch,
+                "version": self.version,
+                "full": True,
+                "blocks": self.list_blocks(),
+                "agents": self.list_agents(),
+                "zones": self.get_zones(),
+            }
+
+    def delta_since(self, since: int, epoch: str = None) -> dict:
+        """
+        Only the agents, blocks and zones changed after version `since`, plus the
+        ids deleted since then. Falls back to a full snapshot when the client's
+        version is from another process run or older than the retained history.
+        """
+        with self._lock:
+            if not self._delta_answerable(since, epoch):
+                return self.snapshot()
+
+            changed_agents = [a for a, v in self._changed["agents"].items() if v > since and a in self._agents]
+            changed_zones = {z for z, v in self._changed["zones"].items() if v > since}
+            block_index = {block_id: idx for idx, block_id in enumerate(self._block_order)}
+            blocks = []
+            for block_id, v in self._changed["blocks"].items():
+                if v > since and block_id in self._blocks:
+                    data = copy.deepcopy(self._blocks[block_id])
+                    data["server_index"] = block_index[block_id]
+                    blocks.append(data)
+
+            return {
+                "epoch": self.epoch,
+                "version": self.version,
+                "full": False,
+                "blocks": sorted(blocks, key=lambda b: b["server_index"]),
+                "agents": [self._agent_view(a, self._agents[a]) for a in changed_agents],
+                "zones": [copy.deepcopy(z) for z in self._zones if str(z.get("id")) in changed_zones],
+                "deleted": {
+                    kind: [item_id for item_id, v in t.items() if v > since]
+                    for kind, t in self._tombstones.items()
+                },
+            }
+
+    def _delta_answerable(self, since: int, epoch: str = None) -> bool:
+        return (epoch is None or epoch == self.epoch) and self._delta_floor <= since <= self.version
+
+    def encoded_state(self, since: int = None, epoch: str = None) -> EncodedState:
+        """
+        The /state payload (snapshot, or delta when `since` is given) as JSON bytes
+        plus a gzipped copy. Built once per board version and 'since' value, so
+        serving N clients on the same version costs one serialization.
+        """
+        with self._lock:
+            if since is not None and not self._delta_answerable(since, epoch):
+                since = None
+            key = (since, self.version)
+            cached = self._encoded.get(key)
+            if cached is not None:
+                return cached
+            payload = self.snapshot() if since is None else self.delta_since(since, epoch)
+
+        # Serialize outside the lock; the payload is already a private copy
+        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        encoded = EncodedState(payload["epoch"], payload["version"], payload["full"],
+                               body, gzip.compress(body, compresslevel=GZIP_LEVEL))
+        with self._lock:
+            if encoded.version == self.version:
+                # Entries for older versions can never be served again
+                stale = [k for k in self._encoded if k[1] != self.version]
+                for k in stale:
+                    del self._encoded[k]
+                if len(self._encoded) < MAX_CACHED_PAYLOADS:
+                    self._encoded[key] = encoded
+        return encoded
+
+    # --- Background persistence ---
+    def _start_writer(self):
+        if self._writer is not None:
+            return
+        self._writer = threading.Thread(target=self._writer_loop, name="board-state-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _writer_loop(self):
+        next_zone_check = time.monotonic() + ZONES_FILE_CHECK_INTERVAL
+        while not self._closed:
+            self._dirty_event.wait(max(next_zone_check - time.monotonic(), 0))
+            if self._closed:
+                break
+            try:
+                if self._dirty_event.is_set():
+                    # Short pause so bursts of updates to the same record coalesce into one write
+                    threading.Event().wait(self.flush_interval)
+                    if not self.flush():
+                        threading.Event().wait(STORAGE_RETRY_DELAY)  # The failed writes are pending again
+                if time.monotonic() >= next_zone_check:
+                    self._reload_external_zones()
+                    next_zone_check = time.monotonic() + ZONES_FILE_CHECK_INTERVAL
+            except Exception as e:
+                # Keep the writer alive; whatever wasn't written stays pending
+                logger.error(f"Board state writer pass failed: {e}", exc_info=True)
+                threading.Event().wait(STORAGE_RETRY_DELAY)
+
+    def flush(self) -> bool:
+        """
+        Appends pending journal events, then writes every pending change through
+        the storage backend. Safe to call from any thread. Writes that fail stay
+        pending for the next flush; returns False when there were any.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._dirty_event.clear()
+                events, self._journal_pending = self._journal_pending, []
+                agents = {a: copy.deepcopy(self._agents[a]) for a in self._dirty_agents if a in self._agents}
+                deleted_agents = set(self._deleted_agents)
+                blocks = {b: copy.deepcopy(self._blocks[b]) for b in self._dirty_blocks if b in self._blocks}
+                deleted_blocks = set(self._deleted_blocks)
+                zones = copy.deepcopy(self._zones) if self._zones_dirty else None
+                self._dirty_agents.clear()
+                self._deleted_agents.clear()
+                self._dirty_blocks.clear()
+                self._deleted_blocks.clear()
+                self._zones_dirty = False
+                snapshot = None
+                if self.journal is not None and self.journal.events_since_snapshot + len(events) >= self.journal.snapshot_every:
+                    snapshot = (self._journal_seq, {"agents": copy.deepcopy(self._agents),
+                                                    "blocks": copy.deepcopy(self._blocks),
+                                                    "zones": copy.deepcopy(self._zones)})
+
+            written = True
+            if self.journal is not None:
+                try:
+                    self.journal.append(events)
+                except Exception as e:
+                    logger.error(f"Failed to append {len(events)} events to the journal: {e}")
+                    with self._lock:
+                        self._journal_pending[:0] = events
+                    snapshot = None  # It would skip past the events that aren't on disk yet
+                    written = False
+            if self.storage is not None and (agents or deleted_agents or blocks or deleted_blocks or zones is not None):
+                try:
+                    failed = self.storage.apply_changes(agents, deleted_agents, blocks, deleted_blocks, zones)
+                except Exception as e:
+                    logger.error(f"Failed to persist board changes: {e}", exc_info=True)
+                    failed = FailedWrites(set(agents), set(deleted_agents), set(blocks), set(deleted_blocks),
+                                          zones is not None)
+                if failed is not None:
+                    self._mark_unwritten(failed)
+                    written = False
+            if snapshot is not None:
+                try:
+                    self.journal.write_snapshot(*snapshot)
+                except Exception as e:
+                    logger.error(f"Failed to write journal snapshot: {e}")
+            return written
+
+    def _mark_unwritten(self, failed: FailedWrites):
+        """Queues writes the backend failed for the next flush, unless newer changes superseded them."""
+        with self._lock:
+            self._dirty_agents |= {a for a in failed.agents if a in self._agents}
+            self._deleted_agents |= {a for a in failed.deleted_agents if a not in self._agents}
+            self._dirty_blocks |= {b for b in failed.blocks if b in self._blocks}
+            self._deleted_blocks |= {b for b in failed.deleted_blocks if b not in self._blocks}
+            self._zones_dirty = self._zones_dirty or failed.zones
+            self._dirty_event.set()
+
+    def close(self):
+        """Flushes outstanding writes and stops the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._dirty_event.set()
+        if not self.flush():
+            logger.error("Some board changes could not be written before closing")
+        if self.storage is not None:
+            self.storage.close()
+        self.locks.release_exclusive(self._owner_lock)
+        self._owner_lock = None
+
+
+def update_assigned_agent(board_state, agent_id: str, assignment: dict, **fields):
+    """
+    Applies `fields` to the agent under its lock with a CAS update, provided it still holds
+    `assignment` (e.g. {"assigned_block_id": block_id}), so a job finishing late doesn't
+    overwrite newer work. Returns the updated agent, or None when the agent is gone or was
+    re-assigned (left as is). Works with any board_state (local store or a worker's proxy);
+    VersionConflict propagates.
+    """
+    with board_state.agent_lock(agent_id):
+        agent = board_state.get_agent(agent_id)
+        if agent is None:
+            logger.warning(f"Agent {agent_id} no longer exists; not applying {sorted(fields)}")
+            return None
+        changed = {key: agent.get(key) for key, value in assignment.items() if agent.get(key) != value}
+        if changed:
+            logger.warning(f"Agent {agent_id} was re-assigned ({changed}); not applying {sorted(fields)}")
+            return None
+        return board_state.update_agent(agent_id, expected_version=agent["version"], **fields)
+
+
+# --- Process-wide instance ---
+_board_state = None
+_board_state_lock = threading.Lock()
+
+
+def get_board_state() -> BoardStateStore:
+    """Returns the process-wide store, loading it from disk on first use."""
+    global _board_state
+    if _board_state is None:
+        with _board_state_lock:
+            if _board_state is None:
+                _board_state = BoardStateStore().load()
+    return _board_state
+
+
+def set_board_state(board_state):
+    """
+    Makes get_board_state() return `board_state` instead of a local store, e.g. the
+    HTTP proxy a remote worker uses (worker.RemoteBoardState). Call before any use.
+    """
+    global _board_state
+    with _board_state_lock:
+        _board_state = board_state
@@ -0,0 +1,316 @@
+"""
+storage.py
+
+Pluggable persistence backends for the board state store.
+
+The store keeps the authoritative board in memory; a backend only has to load
+everything once at startup and apply batches of changes from the writer thread.
+
+    JsonFileStorage  - the original layout under output/ (agent_info.json per
+                       agent dir, block_*.json, layout/zones.json)
+    SqliteStorage    - one SQLite database in WAL mode with indexed columns for
+                       agent state / agent_type / assigned_block_id and block status
+
+Pick one with BOARD_STORAGE=json|sqlite (default json). The first time the
+SQLite backend starts without a database, the JSON tree is imported into it.
+It can also be imported by hand:
+
+    python -m core.storage import --db output/board.sqlite3
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+AGENT_INFO_FILENAME = "agent_info.json"
+DEFAULT_DB_FILENAME = "board.sqlite3"
+
+# What apply_changes couldn't write: sets of agent / block ids, and whether the zones failed
+FailedWrites = namedtuple("FailedWrites", "agents deleted_agents blocks deleted_blocks zones")
+
+
+def no_failed_writes() -> FailedWrites:
+    return FailedWrites(set(), set(), set(), set(), False)
+
+
+def write_json_atomic(path: Path, data) -> None:
+    """
+    Write JSON to a temp file next to `path` and swap it into place,
+    so readers never see a half-written file.
+    """
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class StorageBackend:
+    """
+    Interface every backend implements.
+    load_all() returns (agents, blocks, zones): agent_id -> info dict,
+    block_id -> block dict, and the zone list (None when nothing is stored yet).
+    """
+    name = "base"
+
+    def load_all(self):
+        raise NotImplementedError
+
+    def apply_changes(self, agents: dict, deleted_agents, blocks: dict, deleted_blocks, zones=None):
+        """
+        Persists one batch of changes from the writer thread. `zones` is None when unchanged.
+        Returns None when everything was written, otherwise the FailedWrites to retry.
+        """
+        raise NotImplementedError
+
+    def zones_changed_externally(self):
+        """
+        The zone layout, if it was edited outside this process since the backend last
+        read or wrote it; None otherwise. Backends without a hand-editable layout return None.
+        """
+        return None
+
+    def close(self):
+        pass
+
+
+class JsonFileStorage(StorageBackend):
+    """The original JSON-files-under-output/ layout."""
+    name = "json"
+
+    def __init__(self, base_output: Path):
+        self.base_output = Path(base_output)
+        self.agents_dir = self.base_output / "agents"
+        self.blocks_dir = self.base_output / "blocks"
+        self.zones_file = self.base_output / "layout" / "zones.json"
+        for d in (self.agents_dir, self.blocks_dir, self.zones_file.parent):
+            d.mkdir(parents=True, exist_ok=True)
+        self._zones_mtime = self._zones_file_mtime()  # Edits made after this point count as external
+
+    def load_all(self):
+        agents = {}
+        for agent_dir in self.agents_dir.glob("agent_*"):
+            if not agent_dir.is_dir():
+                continue
+            info = {}
+            info_file = agent_dir / AGENT_INFO_FILENAME
+            if info_file.exists():
+                try:
+                    with open(info_file, "r") as f:
+                        info = json.load(f)
+                except Exception as e:
+                    logger.warning(f"Could not read or parse agent info for {agent_dir.name}: {e}")
+            agents[agent_dir.name] = info
+
+        blocks = {}
+        for block_file in self.blocks_dir.glob("block_*.json"):
+            try:
+                with open(block_file, "r") as f:
+                    blocks[block_file.stem] = json.load(f)
+            except Exception as e:
+                logger.warning(f"Could not read block file {block_file.name}: {e}")
+
+        return agents, blocks, self._read_zones_file()
+
+    def _zones_file_mtime(self):
+        try:
+            return self.zones_file.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def zones_changed_externally(self):
+        mtime = self._zones_file_mtime()
+        if mtime is None or mtime == self._zones_mtime:
+            return None
+        logger.info(f"{self.zones_file} changed on disk. Reloading zone layout.")
+        return self._read_zones_file()
+
+    def _read_zones_file(self):
+        self._zones_mtime = self._zones_file_mtime()
+        if not self.zones_file.exists():
+            logger.info("Zones file not found. Using default positions.")
+            return None
+        try:
+            with open(self.zones_file, "r") as f:
+                zones = json.load(f)
+            if isinstance(zones, list):
+                return zones
+            logger.warning(f"Invalid format in {self.zones_file}. Using defaults.")
+        except Exception as e:
+            logger.error(f"Error reading {self.zones_file}: {e}. Using defaults.")
+        return None
+
+    def apply_changes(self, agents: dict, deleted_agents, blocks: dict, deleted_blocks, zones=None):
+        failed = no_failed_writes()
+        for agent_id, info in agents.items():
+            agent_dir = self.agents_dir / agent_id
+            if not agent_dir.is_dir():
+                continue  # Agent was deleted after the update was queued
+            try:
+                write_json_atomic(agent_dir / AGENT_INFO_FILENAME, info)
+            except Exception as e:
+                logger.error(f"Failed to persist agent info for {agent_id}: {e}")
+                failed.agents.add(agent_id)
+        # Deleted agents disappear with their directory, which the caller removes
+
+        for block_id, data in blocks.items():
+            try:
+                write_json_atomic(self.blocks_dir / f"{block_id}.json", data)
+            except Exception as e:
+                logger.error(f"Failed to persist block {block_id}: {e}")
+                failed.blocks.add(block_id)
+        for block_id in deleted_blocks:
+            try:
+                (self.blocks_dir / f"{block_id}.json").unlink(missing_ok=True)
+            except Exception as e:
+                logger.warning(f"Could not delete old block {block_id}: {e}")
+                failed.deleted_blocks.add(block_id)
+
+        if zones is not None:
+            try:
+                write_json_atomic(self.zones_file, zones)
+                self._zones_mtime = self._zones_file_mtime()  # Our own write, not an external edit
+                logger.info(f"Saved {len(zones)} zones to {self.zones_file}")
+            except Exception as e:
+                logger.error(f"Error writing to {self.zones_file}: {e}")
+                failed = failed._replace(zones=True)
+        return failed if any(failed) else None
+
+
+class SqliteStorage(StorageBackend):
+    """
+    SQLite database in WAL mode. Records are stored as JSON text; the fields
+    the board is queried by are duplicated into indexed columns.
+    """
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS agents (
+            agent_id          TEXT PRIMARY KEY,
+            state             TEXT,
+            agent_type        TEXT,
+            assigned_block_id TEXT,
+            data              TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_agents_state ON agents(state);
+        CREATE INDEX IF NOT EXISTS idx_agents_agent_type ON agents(agent_type);
+        CREATE INDEX IF NOT EXISTS idx_agents_assigned_block ON agents(assigned_block_id);
+
+        CREATE TABLE IF NOT EXISTS blocks (
+            block_id TEXT PRIMARY KEY,
+            status   TEXT,
+            data     TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_blocks_status ON blocks(status);
+
+        CREATE TABLE IF NOT EXISTS zones (
+            position INTEGER PRIMARY KEY,
+            zone_id  TEXT,
+            data     TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Used from the loading thread and the writer thread, never concurrently (guarded by _lock)
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._conn.commit()
+
+    def is_empty(self) -> bool:
+        with self._lock:
+            for table in ("agents", "blocks", "zones"):
+                if self._conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    return False
+            return True
+
+    def load_all(self):
+        with self._lock:
+            agents = {row[0]: json.loads(row[1]) for row in self._conn.execute("SELECT agent_id, data FROM agents")}
+            blocks = {row[0]: json.loads(row[1]) for row in self._conn.execute("SELECT block_id, data FROM blocks")}
+            zones = [json.loads(row[0]) for row in self._conn.execute("SELECT data FROM zones ORDER BY position")]
+        return agents, blocks, zones or None
+
+    def apply_changes(self, agents: dict, deleted_agents, blocks: dict, deleted_blocks, zones=None):
+        with self._lock:
+            try:
+                with self._conn:  # One transaction per batch
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO agents (agent_id, state, agent_type, assigned_block_id, data) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [(agent_id, info.get("state"), info.get("agent_type"), info.get("assigned_block_id"),
+                          json.dumps(info)) for agent_id, info in agents.items()],
+                    )
+                    self._conn.executemany("DELETE FROM agents WHERE agent_id = ?",
+                                           [(agent_id,) for agent_id in deleted_agents])
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO blocks (block_id, status, data) VALUES (?, ?, ?)",
+                        [(block_id, data.get("status"), json.dumps(data)) for block_id, data in blocks.items()],
+                    )
+                    self._conn.executemany("DELETE FROM blocks WHERE block_id = ?",
+                                           [(block_id,) for block_id in deleted_blocks])
+                    if zones is not None:
+                        self._conn.execute("DELETE FROM zones")
+                        self._conn.executemany(
+                            "INSERT INTO zones (position, zone_id, data) VALUES (?, ?, ?)",
+                            [(idx, str(zone.get("id")), json.dumps(zone)) for idx, zone in enumerate(zones)],
+                        )
+            except sqlite3.Error as e:
+                logger.error(f"Failed to persist board changes to {self.db_path}: {e}")
+                # The transaction rolled back as a whole
+                return FailedWrites(set(agents), set(deleted_agents), set(blocks), set(deleted_blocks), zones is not None)
+        return None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def import_json_tree(base_output: Path, target: StorageBackend) -> tuple:
+    """One-shot import of the output/ JSON tree into `target`. Returns (agents, blocks, zones) counts."""
+    agents, blocks, zones = JsonFileStorage(base_output).load_all()
+    if target.apply_changes(agents, [], blocks, [], zones) is not None:
+        logger.error(f"Import into {target.name} storage was incomplete (see the errors above)")
+    logger.info(f"Imported {len(agents)} agents, {len(blocks)} blocks, {len(zones or [])} zones into {target.name} storage")
+    return len(agents), len(blocks), len(zones or [])
+
+
+def create_storage(base_output: Path) -> StorageBackend:
+    """Backend chosen by BOARD_STORAGE (json|sqlite). BOARD_DB_PATH overrides the SQLite file location."""
+    kind = os.getenv("BOARD_STORAGE", "json").strip().lower()
+    if kind == "sqlite":
+        db_path = Path(os.getenv("BOARD_DB_PATH") or Path(base_output) / DEFAULT_DB_FILENAME)
+        storage = SqliteStorage(db_path)
+        if storage.is_empty():
+            logger.info(f"SQLite board database {db_path} is empty, importing the JSON tree once.")
+            import_json_tree(base_output, storage)
+        return storage
+    if kind != "json":
+        logger.warning(f"Unknown BOARD_STORAGE '{kind}'. Using JSON files.")
+    return JsonFileStorage(base_output)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Board storage utilities.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    import_cmd = sub.add_parser("import", help="Import the output/ JSON tree into a SQLite database.")
+    import_cmd.add_argument("--output", default="output", help="Base output directory (default: output)")
+    import_cmd.add_argument("--db", default=None, help=f"SQLite file (default: <output>/{DEFAULT_DB_FILENAME})")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        db = SqliteStorage(Path(args.db or Path(args.output) / DEFAULT_DB_FILENAME))
+        counts = import_json_tree(Path(args.output), db)
+        db.close()
+        print(f"Imported {counts[0]} agents, {counts[1]} blocks, {counts[2]} zones into {db.db_path}")
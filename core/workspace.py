@@ -0,0 +1,96 @@
+"""
+workspace.py
+
+Moving agent workspaces between the board server and remote workers.
+
+Only the parts a pipeline reads or writes travel: the generated files, the
+logs, the step checkpoint and task.json. agent_info.json stays with the
+server, which owns the agent record. Archives use paths relative to the
+output directory ("agents/<agent_id>/files/index.html",
+"final_zips/<name>.zip"), and unpack_workspace() only writes the paths it's
+allowed (see workspace_paths()), so a worker can't write outside its own
+agent's workspace or over the board's files.
+"""
+import io
+import logging
+import shutil
+import zipfile
+from pathlib import Path, PurePosixPath
+
+logger = logging.getLogger(__name__)
+
+WORKSPACE_DIRS = ("files", "logs")
+WORKSPACE_ENTRIES = WORKSPACE_DIRS + ("checkpoint.json", "task.json")
+
+
+def pack_workspace(output_dir: Path, agent_id: str, extra_paths=()) -> bytes:
+    """
+    Zips agent `agent_id`'s workspace under `output_dir`, plus any `extra_paths`
+    (relative to `output_dir`, e.g. a QA agent's final zip). Returns the archive bytes.
+    """
+    output_dir = Path(output_dir)
+    agent_dir = output_dir / "agents" / agent_id
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for entry in WORKSPACE_ENTRIES:
+            path = agent_dir / entry
+            if path.is_file():
+                paths = [path]
+            elif path.is_dir():
+                paths = sorted(p for p in path.rglob("*") if p.is_file())
+            else:
+                continue
+            for file_path in paths:
+                archive.write(file_path, file_path.relative_to(output_dir).as_posix())
+        for extra in extra_paths:
+            file_path = output_dir / extra
+            if file_path.is_file():
+                archive.write(file_path, PurePosixPath(extra).as_posix())
+    return buffer.getvalue()
+
+
+def workspace_paths(agent_id: str) -> list:
+    """The archive paths of agent `agent_id`'s workspace: directory prefixes (ending in '/') and single files."""
+    paths = []
+    for entry in WORKSPACE_ENTRIES:
+        path = f"agents/{agent_id}/{entry}"
+        paths.append(path + "/" if entry in WORKSPACE_DIRS else path)
+    return paths
+
+
+def _allowed(name: str, allowed_prefixes) -> bool:
+    path = PurePosixPath(name)
+    if path.is_absolute() or ".." in path.parts or not name or name.endswith("/"):
+        return False
+    return any(name.startswith(prefix) if prefix.endswith("/") else name == prefix for prefix in allowed_prefixes)
+
+
+def unpack_workspace(output_dir: Path, data: bytes, allowed_prefixes) -> list:
+    """
+    Writes an archive from pack_workspace() under `output_dir`. An agent's files/
+    directory is replaced as a whole when the archive has one (so files a run deleted
+    don't linger). Only entries under a directory prefix (ending in '/') or equal to a file
+    path in `allowed_prefixes` are written; the rest are skipped. Returns the paths written.
+    """
+    output_dir = Path(output_dir)
+    written = []
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        names = [n for n in archive.namelist() if not n.endswith("/")]
+        rejected = [n for n in names if not _allowed(n, allowed_prefixes)]
+        if rejected:
+            logger.warning(f"Skipping {len(rejected)} workspace entries outside {list(allowed_prefixes)}: {rejected[:5]}")
+        names = [n for n in names if n not in rejected]
+        files_dirs = set()
+        for name in names:
+            parts = PurePosixPath(name).parts
+            if len(parts) > 3 and parts[0] == "agents" and parts[2] == "files":
+                files_dirs.add(output_dir.joinpath(*parts[:3]))
+        for files_dir in files_dirs:
+            shutil.rmtree(files_dir, ignore_errors=True)
+        for name in names:
+            target = output_dir / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            with archive.open(name) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            written.append(name)
+    return written
@@ -407,14 +407,54 @@ import shutil
 import time      # <-- Import time
 import threading # <-- Import threading
 import random    # <-- Import random for zone selection
-from llm_service import LLMService
+from llm_service import get_llm_service
 # ... (existing imports like agent_do_analysis, read_block) ...
 from core.agent import agent_do_analysis
 from core.blocks import read_block
-import asyncio
+from core.state_store import get_board_state, update_assigned_agent
+from core.checkpoints import PipelineCheckpoint
+from core.jobs import current_cancel_token
 import re
-llm_service = LLMService()
-def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker_id):
+import functools
+llm_service = get_llm_service()  # Shared service; calls run on its long-lived event loop
+
+# Seconds between progress updates (GET /state/progress) while a file streams in
+PROGRESS_INTERVAL = 1.0
+
+
+class StreamedFile:
+    """Writes a generated file chunk by chunk as the LLM streams it, reporting how much has arrived."""
+
+    def __init__(self, path, report):
+        self.path = Path(path)
+        self.report = report  # report(bytes=..., chunks=...), at most every PROGRESS_INTERVAL
+        self.bytes = 0
+        self.chunks = 0
+        self._reported_at = 0.0
+        self._file = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+        return self
+
+    def write(self, chunk):
+        self._file.write(chunk)
+        self._file.flush()  # Readable from files/ while it's still being generated
+        self.bytes += len(chunk.encode("utf-8"))
+        self.chunks += 1
+        now = time.monotonic()
+        if now - self._reported_at >= PROGRESS_INTERVAL:
+            self._reported_at = now
+            self.report(bytes=self.bytes, chunks=self.chunks)
+
+    def __exit__(self, exc_type, exc, tb):
+        self._file.close()
+        if exc_type is not None:
+            self.path.unlink(missing_ok=True)  # Don't leave half a file behind
+
+
+def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker_id, use_cache=True):
     """
     Runs in a background thread. Uses an enhanced multi-step LLM process:
     1. Analyze task requirements
@@ -422,8 +462,9 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
     3. Generate each file sequentially with specialized guidance
     4. Validate integration between files
     5. Update agent state
+    use_cache=False sends every LLM call to the provider (a retry of failed work).
     """
-    agent_info_file = agent_dir / "agent_info.json"
+    board_state = get_board_state()
     agent_files_dir = agent_dir / "files"
     agent_logs_dir = agent_dir / "logs"
     agent_files_dir.mkdir(exist_ok=True)
@@ -433,6 +474,34 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
     task_description = task_info.get("description", "")
     generated_files_content = {}
 
+    # Every LLM step is checkpointed in the workspace; a re-run of the same task
+    # (restart, re-queued job) reuses finished steps instead of paying for them again
+    checkpoint = PipelineCheckpoint(agent_dir / "checkpoint.json", task=task_info)
+    # Set when running as a job: cancelling it (or its deadline) aborts the current LLM call
+    # with JobCancelled, which the step-level `except Exception` handlers don't catch
+    cancel_token = current_cancel_token()
+
+    def generate_step(step_name, prompt):
+        return checkpoint.step(step_name, prompt,
+                               lambda: llm_service.generate_sync(llm_type='anthropic', prompt=prompt,
+                                                                 cancel_token=cancel_token, use_cache=use_cache),
+                               keep=lambda response: not response.startswith("Error:"))
+
+    def stream_step(step_name, prompt, on_chunk):
+        # Like generate_step, but `on_chunk` sees the reply as it arrives (not when resumed from the checkpoint)
+        return checkpoint.step(step_name, prompt,
+                               lambda: llm_service.generate_stream_sync(llm_type='anthropic', prompt=prompt,
+                                                                        on_chunk=on_chunk, cancel_token=cancel_token,
+                                                                        use_cache=use_cache),
+                               keep=lambda response: not response.startswith("Error:"))
+
+    def report_progress(**progress):
+        # Best effort: a missed update only makes the progress shown by GET /state/progress stale
+        try:
+            board_state.set_progress(agent_id, dict(progress, updated_at=time.time()) if progress else None)
+        except Exception as e:
+            logging.warning(f"[{agent_id}] Could not report progress: {e}")
+
     try:
         logging.info(f"[{agent_id}] Starting enhanced work for Block {block_id} (Marker: {marker_id})")
 
@@ -455,9 +524,7 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
         """
         
         try:
-            task_analysis = asyncio.run(llm_service.generate(
-                llm_type='anthropic', prompt=analysis_prompt
-            ))
+            task_analysis = generate_step("analysis", analysis_prompt)
             if task_analysis.startswith("Error:"):
                 raise ValueError(f"LLM Analysis Error: {task_analysis}")
             logging.info(f"[{agent_id}] Task analysis completed")
@@ -501,9 +568,7 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
         """
         
         try:
-            planning_response = asyncio.run(llm_service.generate(
-                llm_type='anthropic', prompt=planning_prompt
-            ))
+            planning_response = generate_step("plan", planning_prompt)
             
             if planning_response.startswith("Error:"):
                 raise ValueError(f"LLM Planning Error: {planning_response}")
@@ -581,9 +646,7 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
                 Do not include any other text in your response.
                 """
                 
-                fallback_response = asyncio.run(llm_service.generate(
-                    llm_type='anthropic', prompt=fallback_prompt
-                ))
+                fallback_response = generate_step("plan_fallback", fallback_prompt)
                 
                 for name in fallback_response.split(','):
                     clean_name = name.strip().strip('\'"')
@@ -668,7 +731,7 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
         # --- Step 4: Generate Files Sequentially ---
         logging.info(f"[{agent_id}] Step 4: Generating {len(file_generation_order)} files...")
         
-        for filename in file_generation_order:
+        for files_done, filename in enumerate(file_generation_order):
             logging.info(f"[{agent_id}] Generating file: {filename}...")
             
             # Final validation before generation
@@ -781,12 +844,12 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
             """
             
             try:
-                file_content = asyncio.run(llm_service.generate(
-                    llm_type='anthropic', prompt=generation_prompt
-                ))
-                
-                if file_content.startswith("Error:"):
-                    raise ValueError(f"LLM Generation Error: {file_content}")
+                report = functools.partial(report_progress, step=f"file:{filename}", file=filename,
+                                           files_done=files_done, files_total=len(file_generation_order))
+                with StreamedFile(agent_files_dir / filename, report) as streamed:
+                    file_content = stream_step(f"file:{filename}", generation_prompt, streamed.write)
+                    if file_content.startswith("Error:"):
+                        raise ValueError(f"LLM Generation Error: {file_content}")
                 
                 # Remove markdown code block formatting if present
                 if file_content.startswith("```") and "```" in file_content[3:]:
@@ -836,9 +899,7 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
                     Return ONLY the raw file content with no explanations or markdown formatting.
                     """
                     
-                    recovery_content = asyncio.run(llm_service.generate(
-                        llm_type='anthropic', prompt=recovery_prompt
-                    ))
+                    recovery_content = generate_step(f"recovery:{filename}", recovery_prompt)
                     
                     if not recovery_content.startswith("Error:"):
                         # Remove markdown if present
@@ -914,9 +975,7 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
             """
             
             try:
-                validation_response = asyncio.run(llm_service.generate(
-                    llm_type='anthropic', prompt=validation_prompt
-                ))
+                validation_response = generate_step("validation", validation_prompt)
                 
                 logging.info(f"[{agent_id}] Integration validation completed")
                 
@@ -949,9 +1008,7 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
                         """
                         
                         try:
-                            fixed_content = asyncio.run(llm_service.generate(
-                                llm_type='anthropic', prompt=fix_prompt
-                            ))
+                            fixed_content = generate_step(f"fix:{filename}", fix_prompt)
                             
                             if not fixed_content.startswith("Error:"):
                                 # Remove markdown if present
@@ -1004,9 +1061,7 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
             """
             
             try:
-                readme_content = asyncio.run(llm_service.generate(
-                    llm_type='anthropic', prompt=readme_prompt
-                ))
+                readme_content = generate_step("readme", readme_prompt)
                 
                 if not readme_content.startswith("Error:"):
                     # Save README.md
@@ -1024,32 +1079,30 @@ def perform_agent_work_and_move(agent_id, agent_dir, task_info, block_id, marker
         # --- Step 7: Signal completion ---
         logging.info(f"[{agent_id}] Successfully completed work for Block {block_id}")
         
-        if agent_info_file.exists():
-            with open(agent_info_file, "r+") as f:
-                agent_data = json.load(f)
-                agent_data["state"] = "finished_work"
-                agent_data["completed_marker_id"] = marker_id
-                f.seek(0)
-                json.dump(agent_data, f, indent=2)
-                f.truncate()
+        # Skipped if the agent was re-assigned while we worked; the newer assignment stands
+        report_progress()  # Cleared before the state change, so nothing shows stale progress
+        if update_assigned_agent(board_state, agent_id, {"assigned_block_id": block_id},
+                                 state="finished_work", completed_marker_id=marker_id):
             logging.info(f"[{agent_id}] Agent state updated to 'finished_work'")
-        else:
-            logging.error(f"[{agent_id}] Agent info file missing! Cannot update state.")
+        checkpoint.clear()
+        if checkpoint.resumed_steps:
+            logging.info(f"[{agent_id}] {checkpoint.resumed_steps} step(s) were reused from the checkpoint")
             
     except Exception as e:
         # General error handling for the whole process
         logging.error(f"[{agent_id}] Critical error during work: {e}", exc_info=True)
-        if agent_info_file.exists():
-            try:
-                with open(agent_info_file, "r+") as f:
-                    agent_data = json.load(f)
-                    agent_data["state"] = "error"
-                    agent_data["assigned_block_id"] = block_id
-                    agent_data["source_block_title"] = f"Error processing: {task_title}"
-                    agent_data["completed_marker_id"] = None
-                    f.seek(0)
-                    json.dump(agent_data, f, indent=2)
-                    f.truncate()
+        try:
+            if update_assigned_agent(
+                board_state,
+                agent_id,
+                {"assigned_block_id": block_id},
+                state="error",
+                source_block_title=f"Error processing: {task_title}",
+                completed_marker_id=None,
+                error_details=str(e),
+            ):
                 logging.info(f"[{agent_id}] Agent state set to 'error'")
-            except Exception as e_update:
-                logging.error(f"[{agent_id}] Failed to update agent state to error: {e_update}")
\ No newline at end of file
+        except Exception as e_update:
+            logging.error(f"[{agent_id}] Failed to update agent state to error: {e_update}")
+    finally:
+        report_progress()  # Also when the job was cancelled
\ No newline at end of file
@@ -1,9 +1,17 @@
 
 import os
 import asyncio
+import concurrent.futures
+import functools
 import logging
+import queue
+import threading
+import time
 from dotenv import load_dotenv
 
+from core.llm_cache import ResponseCache, cache_key
+from core.rate_limits import DEFAULT_CONCURRENCY, RateLimiter, backoff_delay, estimate_tokens, is_transient
+
 # Import specific clients - assuming standard installations
 # Make sure you have installed these:
 # pip install google-generativeai python-dotenv openai anthropic
@@ -21,6 +29,10 @@ try:
 except ImportError:
     AsyncAnthropic = None # Handle import error gracefully
     AnthropicError = None
+try:
+    import httpx  # Installed with the openai / anthropic libraries
+except ImportError:
+    httpx = None
 
 # --- Basic Logging Setup ---
 # Configure logging for better traceability of API calls and errors
@@ -29,11 +41,43 @@ except ImportError:
 logger = logging.getLogger(__name__) # Use the standard Python logger
 # --- ---
 
+# Model used when a call doesn't name one
+DEFAULT_MODELS = {
+    "gemini": "gemini-2.5-pro-preview-03-25", # Check Google's current recommended models
+    "openai": "gpt-4.1",
+    "anthropic": "claude-3-7-sonnet-20250219",
+}
+# Fixed generation settings per provider; part of the response cache key
+GENERATION_PARAMS = {
+    "anthropic": {"max_tokens": 8192},
+}
+# Seconds an idle provider connection is kept open (LLM_KEEPALIVE_EXPIRY). httpx's own
+# default is 5s, after which the next request pays for a new TLS handshake.
+DEFAULT_KEEPALIVE_EXPIRY = 120
+
 class LLMService:
     """
     Handles interaction with Google Gemini, OpenAI, and Anthropic models.
     Loads API keys from .env file and provides a unified interface.
     Includes enhanced logging for debugging.
+
+    All calls run on one long-lived event loop owned by the service (started on
+    first use), so the async clients keep their connection pools between calls
+    and calls from different worker threads run concurrently. Worker threads use
+    generate_sync() or submit() instead of asyncio.run(generate(...)).
+    get_llm_service() returns the process-wide instance; warm_up() connects to the
+    providers ahead of the first request.
+
+    Identical requests in flight at the same time (e.g. duplicated blocks starting
+    together) are coalesced: one call goes to the provider and every caller gets
+    its result.
+
+    Requests to each provider go through a shared rate limiter (requests and tokens
+    per minute per model, requests in flight per provider; see core/rate_limits.py),
+    and transient errors are retried with jittered backoff that honours Retry-After.
+
+    generate_stream() / generate_stream_sync() deliver a reply chunk by chunk as the
+    provider produces it, for callers that show or write output as it arrives.
     """
     def __init__(self):
         """
@@ -47,11 +91,29 @@ class LLMService:
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         self.anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
 
+        # Request / token budgets shared by every call from every thread (LLM_RATE_LIMITS);
+        # the client connection pools are sized from its in-flight caps
+        self.limiter = RateLimiter()
+
         # --- Configure Clients ---
         self.google_client = self._configure_google_client()
+        self._gemini_models = {}  # model name -> GenerativeModel, built once (loop thread only)
         self.openai_client = self._configure_openai_client()
         self.anthropic_client = self._configure_anthropic_client()
 
+        # Responses to identical requests are served from here (see core/llm_cache.py); LLM_CACHE=0 disables it
+        self.cache = None
+        if os.getenv("LLM_CACHE", "1").lower() not in ("0", "false", "no", "off"):
+            self.cache = ResponseCache()
+        # Identical requests running at the same time share one provider call (loop thread only)
+        self._in_flight = {}  # (request key, use_cache) -> _Flight
+        self._flight_stats = {"provider_calls": 0, "coalesced": 0}
+
+        # Event loop thread that owns the async clients (see submit)
+        self._loop = None
+        self._loop_thread = None
+        self._loop_lock = threading.Lock()
+
         if not any([self.google_client, self.openai_client, self.anthropic_client]):
             logger.error("LLMService initialized, but NO API clients could be configured. Check API keys.")
         else:
@@ -82,7 +144,8 @@ class LLMService:
             logger.error("openai library not installed or incomplete. OpenAI API will be unavailable.")
             return None
         try:
-            client = AsyncOpenAI(api_key=self.openai_api_key)
+            # Retries are ours (generate), so they go through the rate limiter
+            client = AsyncOpenAI(api_key=self.openai_api_key, max_retries=0, http_client=self._http_client("openai"))
             logger.info("OpenAI client configured.")
             return client
         except OpenAIError as e:
@@ -101,7 +164,8 @@ class LLMService:
              logger.error("anthropic library not installed or incomplete. Anthropic API will be unavailable.")
              return None
         try:
-            client = AsyncAnthropic(api_key=self.anthropic_api_key)
+            client = AsyncAnthropic(api_key=self.anthropic_api_key, max_retries=0,  # generate() retries, through the rate limiter
+                                    http_client=self._http_client("anthropic"))
             logger.info("Anthropic client configured.")
             return client
         except AnthropicError as e:
@@ -111,8 +175,328 @@ class LLMService:
             logger.error(f"An unexpected error occurred during Anthropic client configuration: {e}")
             return None
 
+    def _http_client(self, provider: str):
+        """
+        Connection pool for a provider's client: enough connections for its in-flight cap, kept
+        open between calls. None (the library's default client) when httpx isn't available.
+        """
+        if httpx is None:
+            return None
+        slots = self.limiter.limits_for(provider, None)["concurrency"] or DEFAULT_CONCURRENCY
+        try:
+            keepalive_expiry = float(os.getenv("LLM_KEEPALIVE_EXPIRY", DEFAULT_KEEPALIVE_EXPIRY))
+        except ValueError:
+            logger.warning(f"Ignoring invalid LLM_KEEPALIVE_EXPIRY; using {DEFAULT_KEEPALIVE_EXPIRY}")
+            keepalive_expiry = DEFAULT_KEEPALIVE_EXPIRY
+        limits = httpx.Limits(max_connections=slots * 2, max_keepalive_connections=slots,
+                              keepalive_expiry=keepalive_expiry)
+        return httpx.AsyncClient(limits=limits, follow_redirects=True)
+
+    def _gemini_model(self, model_name: str):
+        """The GenerativeModel for `model_name`, created on first use."""
+        model = self._gemini_models.get(model_name)
+        if model is None:
+            model = self._gemini_models[model_name] = self.google_client.GenerativeModel(model_name)
+        return model
+
+    def warm_up(self):
+        """
+        Starts the event loop and, in the background, opens a connection to each configured
+        provider (a model lookup, no tokens used), so the first jobs don't pay for the TLS
+        handshakes. Returns a concurrent.futures.Future, or None when LLM_WARMUP=0.
+        """
+        if os.getenv("LLM_WARMUP", "1").lower() in ("0", "false", "no", "off"):
+            return None
+        return asyncio.run_coroutine_threadsafe(self._warm_up(), self._get_loop())
+
+    async def _warm_up(self):
+        started = time.monotonic()
+        probes = {}
+        if self.google_client:
+            model_name = DEFAULT_MODELS["gemini"]
+            self._gemini_model(model_name)
+            probes["gemini"] = asyncio.get_running_loop().run_in_executor(
+                None, self.google_client.get_model, f"models/{model_name}")
+        if self.openai_client:
+            probes["openai"] = self.openai_client.models.retrieve(DEFAULT_MODELS["openai"])
+        if self.anthropic_client and hasattr(self.anthropic_client, "models"):  # Older libraries have no models API
+            probes["anthropic"] = self.anthropic_client.models.retrieve(DEFAULT_MODELS["anthropic"])
+        results = await asyncio.gather(*probes.values(), return_exceptions=True)
+        for provider, result in zip(probes, results):
+            if isinstance(result, Exception):
+                logger.warning(f"LLM warm-up: could not reach {provider}: {result}")
+        logger.info(f"LLM warm-up done ({', '.join(probes) or 'no providers configured'}) "
+                    f"in {time.monotonic() - started:.1f}s")
+
+    # --- Shared event loop ---
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Returns the service's event loop, starting its thread on first use."""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name="llm-event-loop", daemon=True)
+                self._loop_thread.start()
+                logger.info("LLMService event loop started.")
+            return self._loop
+
+    def submit(self, llm_type: str, prompt: str, model_name: str = None, **kwargs) -> concurrent.futures.Future:
+        """Schedules generate() on the service's event loop from any thread. Returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(
+            self.generate(llm_type, prompt, model_name=model_name, **kwargs), self._get_loop())
+
+    def generate_sync(self, llm_type: str, prompt: str, model_name: str = None, timeout: float = None,
+                      cancel_token=None, **kwargs) -> str:
+        """
+        Blocking generate() for worker threads. Returns the text, or an "Error: ..." string
+        like generate() does (also when `timeout` seconds pass first).
+        With a job's `cancel_token` (core.jobs.CancelToken), cancelling the job or reaching its
+        deadline aborts the in-flight request and raises JobCancelled.
+        """
+        if threading.current_thread() is self._loop_thread:
+            raise RuntimeError("generate_sync() called on the LLM event loop; await generate() instead")
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+            remaining = cancel_token.remaining()
+            if remaining is not None:
+                timeout = remaining if timeout is None else min(timeout, remaining)
+        future = self.submit(llm_type, prompt, model_name=model_name, **kwargs)
+        remove_callback = cancel_token.add_callback(future.cancel) if cancel_token is not None else None
+        try:
+            return future.result(timeout)
+        except concurrent.futures.CancelledError:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            raise
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()  # The job's deadline, not the call's own timeout
+            logger.error(f"LLM call to {llm_type} timed out after {timeout}s")
+            return f"Error: LLM call to {llm_type} timed out after {timeout}s"
+        finally:
+            if remove_callback is not None:
+                remove_callback()
+
+    def generate_stream_sync(self, llm_type: str, prompt: str, on_chunk, model_name: str = None,
+                             timeout: float = None, cancel_token=None, use_cache: bool = True) -> str:
+        """
+        Blocking generate_stream() for worker threads: calls `on_chunk(text)` on the calling
+        thread for every chunk as it arrives and returns the whole reply, or an "Error: ..."
+        string like generate_sync(). A stream that fails before its first chunk falls back to
+        generate() (with its retries) and hands over the reply in one piece.
+        """
+        if threading.current_thread() is self._loop_thread:
+            raise RuntimeError("generate_stream_sync() called on the LLM event loop; use generate_stream() instead")
+        if cancel_token is not None:
+            cancel_token.raise_if_cancelled()
+            remaining = cancel_token.remaining()
+            if remaining is not None:
+                timeout = remaining if timeout is None else min(timeout, remaining)
+        chunks = queue.Queue()
+
+        async def pump():
+            received = False
+            try:
+                async for chunk in self.generate_stream(llm_type, prompt, model_name=model_name, use_cache=use_cache):
+                    received = True
+                    chunks.put(chunk)
+            except Exception as e:
+                if received:
+                    raise
+                logger.warning(f"LLM DEBUG: streaming from '{llm_type}' failed before the first chunk ({e}); "
+                               f"falling back to generate()")
+                reply = await self.generate(llm_type, prompt, model_name=model_name, use_cache=use_cache)
+                if reply.startswith("Error:"):
+                    return reply
+                chunks.put(reply)
+            return None
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._get_loop())
+        future.add_done_callback(lambda _: chunks.put(_STREAM_END))  # Also when cancelled before it started
+        remove_callback = cancel_token.add_callback(future.cancel) if cancel_token is not None else None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        parts = []
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    future.cancel()
+                    if cancel_token is not None:
+                        cancel_token.raise_if_cancelled()  # The job's deadline, not the call's own timeout
+                    logger.error(f"LLM stream from {llm_type} timed out after {timeout}s")
+                    return f"Error: LLM stream from {llm_type} timed out after {timeout}s"
+                if chunk is _STREAM_END:
+                    break
+                parts.append(chunk)
+                try:
+                    on_chunk(chunk)
+                except BaseException:
+                    future.cancel()
+                    raise
+            try:
+                error = future.result()
+            except concurrent.futures.CancelledError:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+                raise
+            except Exception as e:
+                logger.error(f"LLM DEBUG: stream from '{llm_type}' broke off after {len(parts)} chunks: {e}", exc_info=True)
+                return f"Error: LLM stream from {llm_type} failed: {e}"
+            return error or "".join(parts).strip()
+        finally:
+            if remove_callback is not None:
+                remove_callback()
+
+    async def generate_stream(self, llm_type: str, prompt: str, model_name: str = None, use_cache: bool = True):
+        """
+        Async iterator over the reply's text chunks, as the provider sends them. A cached reply
+        comes as a single chunk; a complete streamed reply is stored in the cache. Provider errors
+        are raised (there is no retry once output has started). Not coalesced with other calls.
+        """
+        streamers = {"gemini": (self.google_client, self._stream_gemini),
+                     "openai": (self.openai_client, self._stream_openai),
+                     "anthropic": (self.anthropic_client, self._stream_anthropic)}
+        if llm_type not in streamers:
+            raise ValueError(f"LLM type '{llm_type}' is not supported.")
+        client, stream = streamers[llm_type]
+        if not client:
+            raise RuntimeError(f"Client for '{llm_type}' is not configured or API key/library missing")
+        model_to_use = model_name or DEFAULT_MODELS[llm_type]
+        key = cache_key(llm_type, model_to_use, prompt, GENERATION_PARAMS.get(llm_type))
+        use_cache = use_cache and self.cache is not None
+        loop = asyncio.get_running_loop()
+        if use_cache:
+            cached = await loop.run_in_executor(None, self.cache.get, key)
+            if cached is not None:
+                logger.info(f"LLM DEBUG: response cache hit for '{llm_type}' stream (model: {model_to_use})")
+                yield cached
+                return
+        logger.info(f"LLM DEBUG: streaming from {llm_type}: {model_to_use}")
+        parts = []
+        async with self.limiter.acquire(llm_type, model_to_use, prompt) as lease:  # Held for the whole stream
+            async for chunk in stream(prompt, model_to_use):
+                if chunk:
+                    parts.append(chunk)
+                    yield chunk
+            lease.settle(estimate_tokens(prompt) + estimate_tokens("".join(parts)))
+        text = "".join(parts).strip()  # Stored like the non-streamed reply, which is stripped
+        logger.info(f"LLM DEBUG: {llm_type} stream completed, {len(parts)} chunks, length: {len(text)}")
+        if use_cache and text:
+            await loop.run_in_executor(None, functools.partial(self.cache.put, key, text,
+                                                               provider=llm_type, model=model_to_use))
+
+    async def _stream_gemini(self, prompt: str, model_name: str):
+        """The Google client streams synchronously; its chunks are relayed from an executor thread."""
+        model = self._gemini_model(model_name)
+        loop = asyncio.get_running_loop()
+        relay = asyncio.Queue()
+
+        def read_stream():
+            try:
+                for chunk in model.generate_content(prompt, stream=True):
+                    loop.call_soon_threadsafe(relay.put_nowait, chunk.text)
+                loop.call_soon_threadsafe(relay.put_nowait, _STREAM_END)
+            except Exception as e:  # Includes blocked content (ValueError on .text)
+                loop.call_soon_threadsafe(relay.put_nowait, e)
+
+        loop.run_in_executor(None, read_stream)
+        while True:
+            item = await relay.get()
+            if item is _STREAM_END:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def _stream_openai(self, prompt: str, model_name: str):
+        stream = await self.openai_client.chat.completions.create(
+            model=model_name, messages=[{"role": "user", "content": prompt}], stream=True)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    async def _stream_anthropic(self, prompt: str, model_name: str):
+        async with self.anthropic_client.messages.stream(
+                model=model_name, max_tokens=GENERATION_PARAMS["anthropic"]["max_tokens"],
+                messages=[{"role": "user", "content": prompt}]) as stream:
+            async for text in stream.text_stream:
+                yield text
+
+    async def generate(self, llm_type: str, prompt: str, model_name: str = None, max_retries: int = 3,
+                       initial_delay: int = 1, use_cache: bool = True) -> str:
+        """
+        Returns the model's reply to `prompt`, or an "Error: ..." string. An identical earlier
+        request (provider, model, prompt, generation settings) is answered from the response
+        cache; `use_cache=False` always calls the provider and leaves the cache untouched.
+        """
+        model_to_use = model_name or DEFAULT_MODELS.get(llm_type)
+        key = cache_key(llm_type, model_to_use, prompt, GENERATION_PARAMS.get(llm_type))
+        use_cache = use_cache and self.cache is not None and llm_type in DEFAULT_MODELS
+        if use_cache:
+            cached = await asyncio.get_running_loop().run_in_executor(None, self.cache.get, key)
+            if cached is not None:
+                logger.info(f"LLM DEBUG: response cache hit for '{llm_type}' (model: {model_to_use})")
+                return cached
+
+        flight_key = (key, use_cache)
+        flight = self._in_flight.get(flight_key)
+        if flight is None or flight.waiters == 0:  # No flight, or one its last caller abandoned (being cancelled)
+            task = asyncio.ensure_future(self._generate_and_store(
+                llm_type, prompt, model_name, max_retries, initial_delay, key if use_cache else None))
+            flight = self._in_flight[flight_key] = _Flight(task)
+            task.add_done_callback(functools.partial(self._flight_landed, flight_key, flight))
+            self._flight_stats["provider_calls"] += 1
+        else:
+            self._flight_stats["coalesced"] += 1
+            logger.info(f"LLM DEBUG: joined an identical in-flight '{llm_type}' request ({flight.waiters} waiting)")
+        flight.waiters += 1
+        try:
+            # Shielded: one caller giving up (its job was cancelled) doesn't cancel the others' call
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()  # Every caller gave up
+
+    def _flight_landed(self, flight_key, flight, _task):
+        if self._in_flight.get(flight_key) is flight:
+            del self._in_flight[flight_key]
+
+    async def _generate_and_store(self, llm_type: str, prompt: str, model_name: str, max_retries: int,
+                                  initial_delay: int, store_key: str = None) -> str:
+        """One provider call; a successful reply goes into the cache under `store_key` (None: not cached)."""
+        result = await self._generate_uncached(llm_type, prompt, model_name, max_retries, initial_delay)
+        if store_key is not None and not result.startswith("Error:"):
+            await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+                self.cache.put, store_key, result, provider=llm_type, model=model_name or DEFAULT_MODELS[llm_type]))
+        return result
+
+    def cache_stats(self) -> dict:
+        """Hit / miss counts and sizes of the response cache."""
+        if self.cache is None:
+            return {"enabled": False}
+        return dict(self.cache.stats(), enabled=True)
+
+    def stats(self) -> dict:
+        """
+        Response cache stats, in-flight coalescing counts (calls made vs. requests that joined
+        one) and rate limiter counts (queue waits, requests in flight, 429s, retries).
+        """
+        return {"cache": self.cache_stats(),
+                "single_flight": dict(self._flight_stats, in_flight=len(self._in_flight)),
+                "rate_limits": self.limiter.stats()}
+
+    async def _call_limited(self, llm_type: str, prompt: str, model_name: str) -> str:
+        """One provider call, once the rate limiter admits it."""
+        call = {"gemini": self._call_gemini, "openai": self._call_openai, "anthropic": self._call_anthropic}[llm_type]
+        async with self.limiter.acquire(llm_type, model_name, prompt) as lease:
+            result = await call(prompt, model_name)
+            lease.settle(estimate_tokens(prompt) + estimate_tokens(result))
+            return result
+
     # --- START DEBUG --- Enhanced generate method with more detailed logging
-    async def generate(self, llm_type: str, prompt: str, model_name: str = None, max_retries: int = 3, initial_delay: int = 1) -> str:
+    async def _generate_uncached(self, llm_type: str, prompt: str, model_name: str = None, max_retries: int = 3, initial_delay: int = 1) -> str:
         """
         Enhanced generate method with more detailed logging for debugging.
         """
@@ -123,7 +507,6 @@ class LLMService:
         # --- End Debug Logging ---
 
         attempt = 0
-        delay = initial_delay
 
         # Before entering the retry loop, verify the client exists
         client_exists = False
@@ -156,34 +539,33 @@ class LLMService:
                 # --- End Debug Logging ---
 
                 if llm_type == 'gemini':
-                    # Default model adjusted - check Google's current recommended models
-                    model_to_use = model_name if model_name else "gemini-2.5-pro-preview-03-25"
+                    model_to_use = model_name if model_name else DEFAULT_MODELS['gemini']
                     # --- Start Debug Logging ---
                     logger.info(f"LLM DEBUG: Calling gemini: {model_to_use}")
                     # --- End Debug Logging ---
-                    result = await self._call_gemini(prompt, model_to_use)
+                    result = await self._call_limited('gemini', prompt, model_to_use)
                     # --- Start Debug Logging ---
                     logger.info(f"LLM DEBUG: gemini call completed (attempt {attempt+1}), result length: {len(result)}")
                     # --- End Debug Logging ---
                     return result # Return on first success
 
                 elif llm_type == 'openai':
-                    model_to_use = model_name if model_name else "gpt-4.1" # Or your preferred default
+                    model_to_use = model_name if model_name else DEFAULT_MODELS['openai']
                     # --- Start Debug Logging ---
                     logger.info(f"LLM DEBUG: Calling openai: {model_to_use}")
                     # --- End Debug Logging ---
-                    result = await self._call_openai(prompt, model_to_use)
+                    result = await self._call_limited('openai', prompt, model_to_use)
                     # --- Start Debug Logging ---
                     logger.info(f"LLM DEBUG: openai call completed (attempt {attempt+1}), result length: {len(result)}")
                     # --- End Debug Logging ---
                     return result # Return on first success
 
                 elif llm_type == 'anthropic':
-                    model_to_use = model_name if model_name else "claude-3-7-sonnet-20250219" # Or sonnet/opus
+                    model_to_use = model_name if model_name else DEFAULT_MODELS['anthropic']
                     # --- Start Debug Logging ---
                     logger.info(f"LLM DEBUG: Calling anthropic: {model_to_use}")
                     # --- End Debug Logging ---
-                    result = await self._call_anthropic(prompt, model_to_use)
+                    result = await self._call_limited('anthropic', prompt, model_to_use)
                     # --- Start Debug Logging ---
                     logger.info(f"LLM DEBUG: anthropic call completed (attempt {attempt+1}), result length: {len(result)}")
                     # --- End Debug Logging ---
@@ -200,28 +582,21 @@ class LLMService:
                 logger.error(f"LLM DEBUG: Exception during attempt {attempt+1}: {error_details}", exc_info=True)
                 # --- End Debug Logging ---
 
-                # Basic transient error check (refine based on specific API error codes/types)
-                is_transient = False
-                if OpenAIError and isinstance(e, OpenAIError): # Example check for OpenAI
-                    # Add specific status codes if known (e.g., 429, 500, 503)
-                    is_transient = True # Assume OpenAIError might be transient
-                elif AnthropicError and isinstance(e, AnthropicError): # Example check for Anthropic
-                    is_transient = True
-                # Add checks for Gemini specific errors if available
-                elif "rate_limit" in error_details.lower() or "server error" in error_details.lower():
-                    is_transient = True
+                # Rate limits, overload, 5xx and network errors; not bad requests, auth or an exhausted budget
+                transient = is_transient(e)
 
                 # --- Start Debug Logging ---
-                logger.info(f"LLM DEBUG: Error classified as transient: {is_transient}")
+                logger.info(f"LLM DEBUG: Error classified as transient: {transient}")
                 # --- End Debug Logging ---
 
-                if is_transient and attempt < max_retries - 1:
+                if transient and attempt < max_retries - 1:
                     attempt += 1
+                    delay = backoff_delay(attempt, initial_delay, e)
+                    self.limiter.note_retry(llm_type, model_name or DEFAULT_MODELS[llm_type])
                     # --- Start Debug Logging ---
-                    logger.warning(f"LLM DEBUG: Retrying (Attempt {attempt+1}/{max_retries}). Delay: {delay}s")
+                    logger.warning(f"LLM DEBUG: Retrying (Attempt {attempt+1}/{max_retries}). Delay: {delay:.1f}s")
                     # --- End Debug Logging ---
                     await asyncio.sleep(delay)
-                    delay *= 2 # Exponential backoff
                 else: # Non-transient error or max retries reached
                     error_msg = f"LLM call failed after {attempt+1} attempts for {llm_type}: {error_details}"
                     # --- Start Debug Logging ---
@@ -246,9 +621,9 @@ class LLMService:
             # --- Start Debug Logging ---
             logger.info(f"LLM DEBUG: _call_gemini - Using model: {model_name}")
             # --- End Debug Logging ---
-            model = self.google_client.GenerativeModel(model_name)
+            model = self._gemini_model(model_name)
             # --- Start Debug Logging ---
-            logger.info("LLM DEBUG: Google model instance created")
+            logger.info("LLM DEBUG: Google model instance ready")
             # --- End Debug Logging ---
 
             loop = asyncio.get_running_loop()
@@ -339,7 +714,7 @@ class LLMService:
             # Note: Max tokens might need adjustment or be passed as a parameter
             response = await self.anthropic_client.messages.create(
                 model=model_name,
-                max_tokens=8192, # Adjusted default max_tokens
+                max_tokens=GENERATION_PARAMS["anthropic"]["max_tokens"],
                 messages=[
                     {
                         "role": "user",
@@ -379,6 +754,33 @@ class LLMService:
             raise # Re-raise for retry logic
     # --- END DEBUG ---
 
+# Marks the end of a relayed stream
+_STREAM_END = object()
+
+
+class _Flight:
+    """A provider call shared by identical concurrent requests."""
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+# --- Process-wide instance ---
+_llm_service = None
+_llm_service_lock = threading.Lock()
+
+
+def get_llm_service() -> LLMService:
+    """Returns the process-wide service (one set of clients, one event loop)."""
+    global _llm_service
+    if _llm_service is None:
+        with _llm_service_lock:
+            if _llm_service is None:
+                _llm_service = LLMService()
+    return _llm_service
+
+
 # Example usage (if running this file directly for testing)
 # if __name__ == '__main__':
 #     async def main():
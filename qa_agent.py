@@ -3,7 +3,6 @@
 # --- Standard Imports ---
 import json
 import logging
-import asyncio
 import zipfile
 import re
 from pathlib import Path
@@ -14,9 +13,12 @@ import time
 import sys
 
 # --- Import the CLASS from the module ---
-from llm_service import LLMService # <-- CHANGE HERE
+from llm_service import get_llm_service
+from core.state_store import get_board_state, update_assigned_agent
+from core.checkpoints import PipelineCheckpoint
+from core.jobs import current_cancel_token
 
-def perform_qa_work(qa_agent_id, qa_agent_dir, developer_agent_id, developer_agent_dir_path_str):
+def perform_qa_work(qa_agent_id, qa_agent_dir, developer_agent_id, developer_agent_dir_path_str, use_cache=True):
     """
     Performs QA review on files generated by a developer agent.
     Args:
@@ -32,7 +34,7 @@ def perform_qa_work(qa_agent_id, qa_agent_dir, developer_agent_id, developer_age
     qa_logs_dir = qa_agent_dir / "logs"
     developer_files_dir = developer_agent_dir / "files"
     developer_task_file = developer_agent_dir / "task.json"
-    qa_agent_info_file = qa_agent_dir / "agent_info.json"
+    board_state = get_board_state()
 
     # Create a final zips directory (assuming BASE_OUTPUT is defined appropriately where app runs)
     # If running this standalone, adjust the base path. For now, use relative "output".
@@ -40,8 +42,8 @@ def perform_qa_work(qa_agent_id, qa_agent_dir, developer_agent_id, developer_age
     qa_logs_dir.mkdir(parents=True, exist_ok=True)
     final_zips_dir.mkdir(parents=True, exist_ok=True)
 
-    # --- Instantiate the LLM Service ---
-    llm_service_instance = LLMService() # <-- ADD THIS INSTANTIATION
+    # --- Shared LLM Service (one event loop and connection pool for every agent) ---
+    llm_service_instance = get_llm_service()
     # --- ---
 
     logging.info(f"[{qa_agent_id}] Starting QA work for Developer {developer_agent_id}")
@@ -65,16 +67,11 @@ def perform_qa_work(qa_agent_id, qa_agent_dir, developer_agent_id, developer_age
             with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zipf:
                 zipf.write(error_file_path, arcname=f"error_report.txt")
 
-            # Update QA agent state
-            if qa_agent_info_file.exists():
-                with open(qa_agent_info_file, "r+") as f:
-                    qa_agent_data = json.load(f)
-                    qa_agent_data["state"] = "error"
-                    qa_agent_data["error_details"] = error_report
-                    qa_agent_data["output_zip_path"] = str(zip_filepath)
-                    f.seek(0)
-                    json.dump(qa_agent_data, f, indent=2)
-                    f.truncate()
+            # Update QA agent state (unless it was re-assigned meanwhile)
+            update_assigned_agent(
+                board_state, qa_agent_id, {"assigned_developer_id": developer_agent_id},
+                state="error", error_details=error_report, output_zip_path=str(zip_filepath)
+            )
 
             return str(zip_filepath) # Exit early
 
@@ -192,33 +189,45 @@ def perform_qa_work(qa_agent_id, qa_agent_dir, developer_agent_id, developer_age
         max_retries = 3
         llm_response = None
 
-        while retry_count < max_retries:
-            try:
-                # --- Call the generate method ON THE INSTANCE ---
-                llm_response = asyncio.run(llm_service_instance.generate( # <-- CHANGE HERE
-                    llm_type='gemini', prompt=qa_prompt
-                ))
-                # --- ---
-
-                if not llm_response.startswith("Error:"):
-                    break # Success
-
-                logging.warning(f"[{qa_agent_id}] LLM service returned error: {llm_response}. Retrying ({retry_count+1}/{max_retries})")
-                retry_count += 1
-                time.sleep(2) # Wait before retry
+        # A review of the same files that already came back before a restart isn't paid for twice
+        checkpoint = PipelineCheckpoint(qa_agent_dir / "checkpoint.json", task={"developer_agent_id": developer_agent_id})
+        llm_response = checkpoint.get("review", qa_prompt)
+        if llm_response is not None:
+            logging.info(f"[{qa_agent_id}] Reusing the checkpointed QA review")
+        else:
+            cancel_token = current_cancel_token()  # Job cancellation / deadline aborts the call
+            while retry_count < max_retries:
+                try:
+                    # --- Call the generate method ON THE INSTANCE ---
+                    llm_response = llm_service_instance.generate_sync(
+                        llm_type='gemini', prompt=qa_prompt, cancel_token=cancel_token, use_cache=use_cache
+                    )
+                    # --- ---
+
+                    if not llm_response.startswith("Error:"):
+                        checkpoint.save("review", qa_prompt, llm_response)
+                        break # Success
+
+                    logging.warning(f"[{qa_agent_id}] LLM service returned error: {llm_response}. Retrying ({retry_count+1}/{max_retries})")
+                    retry_count += 1
+                    # Wait before retry (a cancel cuts it short)
+                    if cancel_token: cancel_token.sleep(2)
+                    else: time.sleep(2)
 
-            except Exception as e:
-                logging.error(f"[{qa_agent_id}] Error calling LLM service: {str(e)}")
-                retry_count += 1
-                time.sleep(2) # Wait before retry
+                except Exception as e:
+                    logging.error(f"[{qa_agent_id}] Error calling LLM service: {str(e)}")
+                    retry_count += 1
+                    # Wait before retry (a cancel cuts it short)
+                    if cancel_token: cancel_token.sleep(2)
+                    else: time.sleep(2)
 
-        if retry_count >= max_retries:
-             # Raise error if retries exhausted (caught by global handler)
-             raise ValueError(f"Failed to get response from LLM after {max_retries} attempts")
+            if retry_count >= max_retries:
+                 # Raise error if retries exhausted (caught by global handler)
+                 raise ValueError(f"Failed to get response from LLM after {max_retries} attempts")
 
-        if llm_response is None:
-             # Raise error if no response (caught by global handler)
-             raise ValueError("No response received from LLM service")
+            if llm_response is None:
+                 # Raise error if no response (caught by global handler)
+                 raise ValueError("No response received from LLM service")
 
 
         # Step 5: Parse LLM Response
@@ -366,20 +375,19 @@ def perform_qa_work(qa_agent_id, qa_agent_dir, developer_agent_id, developer_age
 
         # Step 8: Update QA Agent State
         zip_filepath_str = str(zip_filepath)
-        if qa_agent_info_file.exists():
-            with open(qa_agent_info_file, "r+") as f:
-                qa_agent_data = json.load(f)
-                qa_agent_data["state"] = "finished_qa_work"
-                qa_agent_data["output_zip_path"] = zip_filepath_str
-                qa_agent_data["assigned_developer_id"] = None
-                qa_agent_data["corrections_made"] = corrections_made
-                qa_agent_data["corrected_files"] = list(corrected_files.keys()) if corrected_files else []
-                f.seek(0)
-                json.dump(qa_agent_data, f, indent=2)
-                f.truncate()
+        qa_agent_data = update_assigned_agent(
+            board_state,
+            qa_agent_id,
+            {"assigned_developer_id": developer_agent_id},
+            state="finished_qa_work",
+            output_zip_path=zip_filepath_str,
+            # assigned_developer_id stays set: complete_qa_and_move uses it to release the developer
+            corrections_made=corrections_made,
+            corrected_files=list(corrected_files.keys()) if corrected_files else [],
+        )
+        checkpoint.clear()
+        if qa_agent_data:
             logging.info(f"[{qa_agent_id}] Updated agent state to 'finished_qa_work'")
-        else:
-            logging.warning(f"[{qa_agent_id}] Agent info file not found: {qa_agent_info_file}")
 
         logging.info(f"[{qa_agent_id}] QA workflow completed successfully")
         return zip_filepath_str
@@ -436,19 +444,17 @@ def perform_qa_work(qa_agent_id, qa_agent_dir, developer_agent_id, developer_age
 
         # Update QA agent state
         zip_filepath_str = str(zip_filepath)
-        if qa_agent_info_file.exists():
-            try:
-                with open(qa_agent_info_file, "r+") as f:
-                    qa_agent_data = json.load(f)
-                    qa_agent_data["state"] = "error"
-                    qa_agent_data["error_details"] = str(e)
-                    qa_agent_data["output_zip_path"] = zip_filepath_str
-                    qa_agent_data["assigned_developer_id"] = developer_agent_id # Keep reference
-                    f.seek(0)
-                    json.dump(qa_agent_data, f, indent=2)
-                    f.truncate()
-            except Exception as e_update:
-                logging.error(f"[{qa_agent_id}] Failed to update agent state to error: {str(e_update)}")
+        try:
+            update_assigned_agent(
+                board_state,
+                qa_agent_id,
+                {"assigned_developer_id": developer_agent_id}, # Keeps the reference; skipped if re-assigned
+                state="error",
+                error_details=str(e),
+                output_zip_path=zip_filepath_str,
+            )
+        except Exception as e_update:
+            logging.error(f"[{qa_agent_id}] Failed to update agent state to error: {str(e_update)}")
 
         return zip_filepath_str # Return path to error zip
 
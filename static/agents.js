@@ -6,6 +6,7 @@ import { log } from './utils.js'; // Keep existing imports
 let agents = [];
 let agentElements = {}; // Cache for DOM elements
 let selectedAgentId = null;
+let agentProgress = {}; // agent_id -> live progress from /state/progress (file, bytes, files_done, files_total)
 const INITIAL_AGENT_X = 50; // Constants can be kept here or imported if needed elsewhere
 const INITIAL_AGENT_Y = 50;
 
@@ -60,6 +61,9 @@ export function renderAgents() {
             const progressBar = document.createElement('div');
             progressBar.className = 'agent-progress';
             progressBar.style.display = 'none';
+            const progressLabel = document.createElement('div');
+            progressLabel.className = 'agent-progress-label';
+            progressLabel.style.display = 'none';
             const deleteButton = document.createElement('button');
             deleteButton.className = 'delete-agent-btn';
             deleteButton.textContent = 'X';
@@ -67,6 +71,7 @@ export function renderAgents() {
             deleteButton.onclick = () => deleteAgent(agent.agent_id);
             agentContainerElement.appendChild(agentSpan);
             agentContainerElement.appendChild(progressBar);
+            agentContainerElement.appendChild(progressLabel);
             agentContainerElement.appendChild(deleteButton);
             container.appendChild(agentContainerElement);
             // Use local 'agentElements' cache
@@ -81,7 +86,6 @@ export function renderAgents() {
 
         // Update content, title, selection, progress bar (same logic)
         const agentSpan = agentContainerElement.querySelector('.agent');
-        const progressBar = agentContainerElement.querySelector('.agent-progress');
         const deleteButton = agentContainerElement.querySelector('.delete-agent-btn');
         if (agentSpan) {
             const letter = agent.name ? agent.name[0].toUpperCase() : agent.agent_id.slice(-1).toUpperCase();
@@ -99,9 +103,7 @@ export function renderAgents() {
             // --- END NEW ---
 
 
-            if (progressBar) {
-                progressBar.style.display = (agentState === 'working' || agentState === 'working_qa') ? 'block' : 'none';
-            }
+            renderAgentProgress(agentContainerElement, agent.agent_id, agentState);
         }
         if(deleteButton) { deleteButton.title = `Delete Agent ${agent.agent_id}`; }
     });
@@ -116,6 +118,47 @@ export function renderAgents() {
     }
 }
 
+function formatBytes(bytes) {
+    return bytes >= 1024 ? `${(bytes / 1024).toFixed(1)} KB` : `${bytes} B`;
+}
+
+// Progress bar and label under a working agent. With streaming progress the bar fills by files
+// done and the label shows the file coming in; without it the bar just animates.
+function renderAgentProgress(agentContainerElement, agentId, agentState) {
+    const progressBar = agentContainerElement.querySelector('.agent-progress');
+    const progressLabel = agentContainerElement.querySelector('.agent-progress-label');
+    const working = agentState === 'working' || agentState === 'working_qa';
+    const progress = working ? agentProgress[agentId] : null;
+    if (progressBar) {
+        progressBar.style.display = working ? 'block' : 'none';
+        const determinate = Boolean(progress && progress.files_total);
+        progressBar.classList.toggle('determinate', determinate);
+        if (determinate) {
+            progressBar.style.setProperty('--progress', `${Math.round(100 * progress.files_done / progress.files_total)}%`);
+        }
+    }
+    if (progressLabel) {
+        let text = '';
+        if (progress && progress.file) {
+            text = `${progress.file}: ${formatBytes(progress.bytes || 0)}`;
+            if (progress.files_total) { text += ` (file ${progress.files_done + 1}/${progress.files_total})`; }
+        }
+        progressLabel.textContent = text;
+        progressLabel.style.display = text ? 'block' : 'none';
+    }
+}
+
+// Called by app.js with each new /state/progress payload; only touches the progress elements
+export function updateAgentProgress(progressMap) {
+    agentProgress = progressMap || {};
+    agents.forEach(agent => {
+        const agentContainerElement = agent && agentElements[agent.agent_id];
+        if (agentContainerElement) {
+            renderAgentProgress(agentContainerElement, agent.agent_id, agent.state || 'unknown');
+        }
+    });
+}
+
 // Export selectAgent so listeners in app.js (or here) can call it
 export function selectAgent(agentId) {
     // Uses local selectedAgentId
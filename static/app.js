@@ -6,6 +6,7 @@ import {
     initializeAgentListeners,
     initializeAgentModule,
     updateAgentsData,
+    updateAgentProgress,
     sendAgentCommand // <--- MAKE SURE THIS IS PRESENT
 } from './agents.js';
 
@@ -176,8 +177,7 @@ document.addEventListener('DOMContentLoaded', function() {
     setupPanelToggle();
     // --- Initial Render and Fetch ---
     renderGrid();
-    fetchState();
-    setInterval(fetchState, 3000);
+    startStateUpdates(); // Push stream, falls back to polling /state
 
     log("App initialized.");
 });
@@ -891,110 +891,52 @@ function handleBlockDragEnd(e) {
 }
 
 
+// --- Versioned board state (delta responses from /state) ---
+// The server stamps every change with a board version; after the first full
+// snapshot we only ask for what changed since the version we hold.
+let boardEpoch = null;
+let boardVersion = null;
+let boardEtag = null;
+let boardAgents = new Map(); // agent_id -> agent
+let boardBlocks = new Map(); // block_id -> block (with server_index)
+let boardZones = new Map();  // zone id -> zone
+let boardRenderPending = false; // A change arrived while dragging; render once the drag ends
+
+function mergeBoardState(data) {
+    // The stream and a poll can race; never let an older payload overwrite a newer one
+    if (data.epoch === boardEpoch && boardVersion !== null && data.version <= boardVersion) { return false; }
+    if (data.full) {
+        boardAgents = new Map((data.agents || []).map(a => [a.agent_id, a]));
+        boardBlocks = new Map((data.blocks || []).map(b => [b.block_id, b]));
+        boardZones = new Map((data.zones || []).map(z => [String(z.id), z]));
+    } else {
+        const deleted = data.deleted || {};
+        (deleted.agents || []).forEach(id => boardAgents.delete(id));
+        (deleted.blocks || []).forEach(id => boardBlocks.delete(id));
+        (deleted.zones || []).forEach(id => boardZones.delete(String(id)));
+        (data.agents || []).forEach(a => boardAgents.set(a.agent_id, a));
+        (data.blocks || []).forEach(b => boardBlocks.set(b.block_id, b));
+        (data.zones || []).forEach(z => boardZones.set(String(z.id), z));
+    }
+    boardEpoch = data.epoch;
+    boardVersion = data.version;
+    return true;
+}
+
 export function fetchState() {
-    fetch('/state')
+    const url = (boardVersion === null)
+        ? '/state'
+        : `/state?since=${boardVersion}&epoch=${encodeURIComponent(boardEpoch)}`;
+    const headers = boardEtag ? { 'If-None-Match': boardEtag } : {};
+
+    fetch(url, { headers: headers, cache: 'no-store' })
         .then(response => {
+            if (response.status === 304) { return null; } // Nothing changed since our version
             if (!response.ok) { throw new Error(`HTTP error ${response.status}`); }
+            boardEtag = response.headers.get('ETag');
             return response.json();
          })
-         .then(data => {
-            const agentsData = data.agents || [];
-            const zonesData = data.zones || [];
-
-            // Update Blocks (existing logic)
-            if (!currentDraggedBlock) { updateBlocksFromServerData(data.blocks || []); }
-            else { log("Skipping grid update during block drag."); }
-
-            // Update Agents via agents.js (existing logic)
-            updateAgentsData(agentsData); // Pass fetched data to agent module
-            renderAgents(); // Call imported render function
-
-            // Update Zones (existing logic)
-             // Separate finish zones and dropoff zones for clarity if needed
-             const finishZones = zonesData.filter(z => z.type !== 'dropoff');
-             // const dropoffZones = zonesData.filter(z => z.type === 'dropoff'); // Not needed right now
-
-            if (Array.isArray(zonesData)) { // Use combined data for rendering
-                if (!currentDraggedZone) {
-                    finishZonesData = zonesData; // Store combined data for rendering
-                    renderFinishZones();
-                } else { log("Skipping zone update during zone drag."); }
-            } else { log("No zone data received from server."); }
-
-            // Update Markers (existing logic)
-             renderMapMarkers(); // Render markers based on current mapMarkers array
-
-            // --- Developer Agent Completion Logic (Existing - Check/Keep) ---
-            agentsData.forEach(agent => {
-                if (agent && agent.state === "finished_work" && agent.completed_marker_id) {
-                    log(`Detected DEV agent ${agent.agent_id} finished work on marker ${agent.completed_marker_id}. Triggering completion.`);
-                    log(`   - Deleting marker: ${agent.completed_marker_id}`);
-                    deleteMapMarker(agent.completed_marker_id); // Assumes available globally or imported
-                    log(`   - Sending 'complete_and_move' command to agent ${agent.agent_id}`);
-                    sendAgentCommand(agent.agent_id, 'complete_and_move', {}); // Assumes available (imported from agents.js)
-                }
-                // --- *** NEW: QA Agent Completion Logic *** ---
-                else if (agent && agent.agent_type === 'qa' && agent.state === "finished_qa_work") {
-                     log(`Detected QA agent ${agent.agent_id} finished QA work. Triggering completion.`);
-                     log(`   - Sending 'complete_qa_and_move' command to QA agent ${agent.agent_id}`);
-                     sendAgentCommand(agent.agent_id, 'complete_qa_and_move', {}); // Call the new backend endpoint
-                 }
-                // --- *** END QA Agent Completion Logic *** ---
-            });
-             // --- *** END Developer/QA Completion Logic *** ---
-
-
-             // --- *** NEW: QA Initiation Logic *** ---
-             // Find ONE idle QA agent
-             const idleQaAgent = agentsData.find(agent =>
-                 agent && agent.agent_type === 'qa' && agent.state === 'idle'
-             );
-
-             if (idleQaAgent) {
-                 // Find ONE idle Developer agent that is located within a "finish" zone (not dropoff)
-                 const idleDevInFinishZone = agentsData.find(agent =>
-                     agent &&
-                     agent.agent_type === 'developer' &&
-                     agent.state === 'idle' &&
-                     isAgentInZones(agent.x, agent.y, finishZones) // Use helper function
-                 );
-
-                 if (idleDevInFinishZone) {
-                     log(`Found idle QA agent ${idleQaAgent.agent_id} and idle Developer ${idleDevInFinishZone.agent_id} in a finish zone. Initiating QA.`);
-
-                     // Send command to backend to start QA
-                     const payload = { developer_agent_id: idleDevInFinishZone.agent_id };
-                     fetch(`/agents/${idleQaAgent.agent_id}/start_qa`, {
-                         method: 'POST',
-                         headers: {'Content-Type': 'application/json'},
-                         body: JSON.stringify(payload)
-                     })
-                     .then(response => {
-                         if (!response.ok) {
-                             // Log error but don't necessarily stop interval/further checks
-                             response.text().then(text => log(`ERROR starting QA for ${idleQaAgent.agent_id} on ${idleDevInFinishZone.agent_id}: ${response.status} ${text}`));
-                             // Potentially mark agents as 'error' locally? Or just let backend handle state? For now, just log.
-                             // If QA agent is now busy, the next fetchState won't pick it again.
-                         } else {
-                             log(`Successfully sent start_qa command for QA ${idleQaAgent.agent_id} on Dev ${idleDevInFinishZone.agent_id}.`);
-                             // Optimistically update local state? Risky, better wait for next fetchState.
-                         }
-                     })
-                     .catch(error => {
-                         log(`Network ERROR starting QA for ${idleQaAgent.agent_id} on ${idleDevInFinishZone.agent_id}: ${error}`);
-                     });
-
-                     // IMPORTANT: We only trigger ONE QA task per fetchState cycle to prevent multiple QA agents grabbing the same developer.
-                     // The logic implicitly handles this by finding the *first* match and then exiting this block.
-                 } else {
-                     // log("Found idle QA agent, but no idle developers in finish zones."); // Can be noisy
-                 }
-             } else {
-                  // log("No idle QA agents found."); // Can be noisy
-             }
-             // --- *** END QA Initiation Logic *** ---
-
-        })
+         .then(data => applyBoardUpdate(data))
         .catch(error => {
             // (existing error handling)
             console.error("Error fetching state:", error);
@@ -1005,6 +947,120 @@ export function fetchState() {
         });
 } // End of fetchState function
 
+// Merges a /state payload (null when nothing changed), re-renders if needed and runs the
+// completion / QA pairing checks. Shared by the push stream and the polling fallback.
+function applyBoardUpdate(data) {
+    const changed = data !== null && mergeBoardState(data);
+
+    const agentsData = Array.from(boardAgents.values());
+    const zonesData = Array.from(boardZones.values());
+    const blocksData = Array.from(boardBlocks.values()).sort((a, b) => a.server_index - b.server_index);
+
+    if (changed || boardRenderPending) {
+        boardRenderPending = false;
+
+        // Update Blocks (existing logic)
+        if (!currentDraggedBlock) { updateBlocksFromServerData(blocksData); }
+        else { log("Skipping grid update during block drag."); boardRenderPending = true; }
+
+        // Update Agents via agents.js (existing logic)
+        updateAgentsData(agentsData); // Pass fetched data to agent module
+        renderAgents(); // Call imported render function
+
+        // Update Zones (existing logic)
+        if (!currentDraggedZone) {
+            finishZonesData = zonesData; // Store combined data for rendering
+            renderFinishZones();
+        } else { log("Skipping zone update during zone drag."); boardRenderPending = true; }
+
+        // Update Markers (existing logic)
+         renderMapMarkers(); // Render markers based on current mapMarkers array
+    }
+
+    // --- Developer/QA Completion ---
+    // The server's agent lifecycle moves finished agents on its own (no complete_* commands from here).
+    // Only the map marker is local, so drop it if we catch the agent before it moves on.
+    agentsData.forEach(agent => {
+        if (agent && agent.state === "finished_work" && agent.completed_marker_id &&
+            mapMarkers.some(m => m.id === agent.completed_marker_id)) {
+            deleteMapMarker(agent.completed_marker_id);
+        }
+    });
+
+
+     // QA initiation (pairing idle QA agents with developers waiting in finish zones) runs on the
+     // server's QA dispatcher, so it happens once per developer no matter how many tabs are open.
+}
+
+// --- Push channel (Server-Sent Events) with polling fallback ---
+const POLL_INTERVAL_MS = 3000;     // Fallback poll while the stream is unavailable
+const RESYNC_INTERVAL_MS = 30000;  // Slow safety poll while streaming
+let stateStream = null;
+let pollTimer = null;
+let resyncTimer = null;
+
+function startPolling() {
+    if (pollTimer) { return; }
+    log("State stream unavailable, polling /state every 3s.");
+    fetchState();
+    pollTimer = setInterval(fetchState, POLL_INTERVAL_MS);
+}
+
+function stopPolling() {
+    if (!pollTimer) { return; }
+    clearInterval(pollTimer);
+    pollTimer = null;
+    log("State stream connected, polling stopped.");
+}
+
+export function startStateUpdates() {
+    if (!window.EventSource) { startPolling(); return; }
+
+    stateStream = new EventSource('/state/stream');
+    stateStream.onopen = () => stopPolling();
+    stateStream.onerror = () => startPolling(); // EventSource keeps reconnecting by itself; onopen stops the poll again
+    stateStream.addEventListener('state', event => {
+        try {
+            const data = JSON.parse(event.data);
+            boardEtag = `"${data.epoch}-${data.version}"`;
+            applyBoardUpdate(data);
+        } catch (error) {
+            console.error("Error handling state event:", error);
+            log(`Error handling state event: ${error.message}`);
+        }
+    });
+    resyncTimer = setInterval(() => { if (!pollTimer) { fetchState(); } }, RESYNC_INTERVAL_MS);
+    setInterval(fetchProgress, PROGRESS_POLL_MS);
+}
+
+// --- Live progress of work in flight (/state/progress, kept out of the versioned board) ---
+const PROGRESS_POLL_MS = 1000;
+let progressEtag = null;
+let progressShown = false; // Last payload had entries; poll once more after the work ends to clear them
+let progressFetching = false;
+
+function fetchProgress() {
+    const working = Array.from(boardAgents.values()).some(a => a.state === 'working' || a.state === 'working_qa');
+    if ((!working && !progressShown) || progressFetching) { return; }
+    progressFetching = true;
+    const headers = progressEtag ? { 'If-None-Match': progressEtag } : {};
+
+    fetch('/state/progress', { headers: headers, cache: 'no-store' })
+        .then(response => {
+            if (response.status === 304) { return null; } // Nothing streamed since the last poll
+            if (!response.ok) { throw new Error(`HTTP error ${response.status}`); }
+            progressEtag = response.headers.get('ETag');
+            return response.json();
+        })
+        .then(progress => {
+            if (progress === null) { return; }
+            progressShown = Object.keys(progress).length > 0;
+            updateAgentProgress(progress);
+        })
+        .catch(error => console.error("Error fetching progress:", error))
+        .finally(() => { progressFetching = false; });
+}
+
 // --- State Management ---
 // export function fetchState() {
 //     fetch('/state')
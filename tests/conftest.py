@@ -0,0 +1,44 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.journal import BoardJournal
+from core.state_store import BoardStateStore
+from core.storage import JsonFileStorage
+
+
+@pytest.fixture
+def board(tmp_path):
+    """A board state store on a JSON tree under tmp_path."""
+    store = BoardStateStore(tmp_path, storage=JsonFileStorage(tmp_path),
+                            journal=BoardJournal(tmp_path / "journal")).load()
+    yield store
+    store.close()
+
+
+def add_agent(board, agent_id, **fields):
+    """Registers an agent (with its workspace directory, which the JSON storage writes into)."""
+    (board.base_output / "agents" / agent_id).mkdir(parents=True, exist_ok=True)
+    return board.put_agent(agent_id, dict({"agent_id": agent_id, "state": "idle"}, **fields))
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """
+    The app module, imported with output/ under a temporary directory (which stays the
+    working directory for the session) and without its background services, so tests
+    drive the dispatchers themselves and queued jobs don't run.
+    """
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("server"))
+    os.environ["BACKGROUND_SERVICES"] = "0"
+    os.environ.setdefault("LLM_CACHE", "0")
+    import app
+    yield app
+    app.job_scheduler.close()
+    app.board_state.close()
+    os.chdir(cwd)
@@ -0,0 +1,38 @@
+import itertools
+import random
+
+from core.assignment import min_cost_assignment
+
+
+def total(cost, assignment):
+    return sum(cost[row][col] for row, col in enumerate(assignment) if col is not None)
+
+
+def test_optimal_where_greedy_is_not():
+    # Greedy takes the 0 in row 1 and ends up at 6; the optimum is 1 + 2 + 2
+    cost = [[4, 1, 3],
+            [2, 0, 5],
+            [3, 2, 2]]
+    assert min_cost_assignment(cost) == [1, 0, 2]
+
+
+def test_rectangular_matrices():
+    assert min_cost_assignment([[5, 1, 9]]) == [1]
+    # More rows than columns: the cheapest row takes the only slot
+    assert min_cost_assignment([[1], [0], [5]]) == [None, 0, None]
+    assert min_cost_assignment([]) == []
+
+
+def test_matches_brute_force():
+    rng = random.Random(7)
+    for _ in range(50):
+        rows, cols = rng.randint(1, 5), rng.randint(1, 5)
+        cost = [[rng.randint(0, 20) for _ in range(cols)] for _ in range(rows)]
+        assignment = min_cost_assignment(cost)
+        matched = [col for col in assignment if col is not None]
+        assert len(matched) == min(rows, cols) and len(set(matched)) == len(matched)
+        if rows <= cols:
+            best = min(sum(cost[r][c] for r, c in enumerate(perm)) for perm in itertools.permutations(range(cols), rows))
+        else:
+            best = min(sum(cost[r][c] for c, r in enumerate(perm)) for perm in itertools.permutations(range(rows), cols))
+        assert total(cost, assignment) == best
@@ -0,0 +1,201 @@
+import io
+import itertools
+import time
+import zipfile
+
+import pytest
+
+from conftest import add_agent
+
+
+@pytest.fixture
+def dispatch(server, monkeypatch):
+    """The server with auto-dispatch on, one idle developer and one pending block."""
+    agent_id = f"agent_dispatch_{next(_ids)}"
+    block_id = f"block_{agent_id}"
+    add_agent(server.board_state, agent_id, agent_type="developer", x=0, y=0)
+    server.board_state.replace_blocks([{"block_id": block_id, "title": "Task", "description": "", "status": "pending"}])
+    monkeypatch.setitem(server.block_dispatch, "enabled", True)
+    yield server, agent_id, block_id
+    server.board_state.replace_blocks([])
+    server.board_state.delete_agent(agent_id)
+
+
+_ids = itertools.count()
+
+
+def test_full_queue_leaves_block_pending(dispatch, monkeypatch):
+    server, agent_id, block_id = dispatch
+    monkeypatch.setattr(server.job_scheduler, "queue_limit", 0)
+
+    assert server.dispatch_blocks() == 0
+    block = server.board_state.get_block(block_id)
+    assert block["status"] == "pending" and block.get("agent_id") is None
+    assert server.board_state.get_agent(agent_id)["state"] == "idle"
+
+
+def test_queue_filling_after_claim_releases_block(dispatch, monkeypatch):
+    server, agent_id, block_id = dispatch
+    checks = itertools.count()
+    # Room for the dispatcher's check, full by the time start_block_work looks
+    monkeypatch.setattr(server.job_scheduler, "is_full", lambda job_type: next(checks) > 0)
+
+    assert server.dispatch_blocks() == 0
+    block = server.board_state.get_block(block_id)
+    assert block["status"] == "pending" and block.get("agent_id") is None
+
+
+@pytest.mark.parametrize("status", [404, 409, 500])
+def test_failed_start_releases_block(dispatch, monkeypatch, status):
+    server, agent_id, block_id = dispatch
+    monkeypatch.setattr(server, "start_block_work", lambda *args, **kwargs: ({"error": "not started"}, status))
+
+    assert server.dispatch_blocks() == 0
+    block = server.board_state.get_block(block_id)
+    assert block["status"] == "pending" and block.get("agent_id") is None
+
+
+def test_developer_with_queued_job_is_skipped(dispatch):
+    server, agent_id, block_id = dispatch
+    # The scheduler isn't started in tests, so the job stays queued
+    job = server.job_scheduler.submit("develop", {"agent_id": agent_id, "task_info": {}, "block_id": "other",
+                                                  "marker_id": None}, agent_id=agent_id)
+    try:
+        assert server.dispatch_blocks() == 0
+        assert server.board_state.get_block(block_id)["status"] == "pending"
+    finally:
+        server.job_scheduler.cancel(job["job_id"])
+
+
+def test_move_keeps_working_state(dispatch):
+    server, agent_id, block_id = dispatch
+    server.board_state.update_agent(agent_id, state="working", assigned_block_id=block_id)
+
+    response = server.app.test_client().post(f"/agents/{agent_id}/move", json={"x": 40, "y": 50})
+    assert response.status_code == 200
+    agent = server.board_state.get_agent(agent_id)
+    assert (agent["x"], agent["y"], agent["state"]) == (40, 50, "working")
+    assert server.dispatch_blocks() == 0
+
+
+def test_move_resets_errored_agent(dispatch):
+    server, agent_id, block_id = dispatch
+    server.board_state.update_agent(agent_id, state="error")
+
+    response = server.app.test_client().post(f"/agents/{agent_id}/move", json={"x": 40, "y": 50})
+    assert response.status_code == 200
+    assert server.board_state.get_agent(agent_id)["state"] == "idle"
+
+
+def test_progress_route(dispatch):
+    server, agent_id, block_id = dispatch
+    client = server.app.test_client()
+    server.board_state.set_progress(agent_id, {"file": "index.html", "bytes": 2048})
+
+    response = client.get("/state/progress")
+    assert response.status_code == 200 and response.json[agent_id]["bytes"] == 2048
+    assert client.get("/state/progress", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    server.board_state.set_progress(agent_id, None)
+
+
+def test_delete_waits_once_for_all_jobs(dispatch, monkeypatch):
+    server, agent_id, block_id = dispatch
+    for _ in range(3):
+        server.job_scheduler.submit("develop", {"agent_id": agent_id, "task_info": {}, "block_id": block_id,
+                                                "marker_id": None}, agent_id=agent_id)
+
+    def never_stops(job_id, timeout=None):
+        time.sleep(timeout)
+        return False
+
+    monkeypatch.setattr(server, "AGENT_DELETE_JOB_WAIT", 0.2)
+    monkeypatch.setattr(server.job_scheduler, "wait", never_stops)
+    started = time.monotonic()
+    assert server.app.test_client().delete(f"/agents/{agent_id}").status_code == 200
+    assert time.monotonic() - started < 0.5
+    assert not server.board_state.has_agent(agent_id)
+
+
+def test_dead_letter_retry_bypasses_llm_cache(dispatch):
+    server, agent_id, block_id = dispatch
+    server.board_state.update_agent(agent_id, state="error", assigned_block_id=block_id)
+
+    body, status = server.retry_dead_letter({"agent_id": agent_id, "job_type": "develop", "target": block_id})
+    assert status in (200, 202)
+    job = server.job_scheduler.get_job(body["job_id"])
+    assert job["args"]["use_cache"] is False
+    server.job_scheduler.cancel(job["job_id"])
+
+
+def test_worker_routes_without_token_are_local_only(server, monkeypatch):
+    monkeypatch.setattr(server, "WORKER_TOKEN", None)
+    client = server.app.test_client()
+
+    assert client.get("/worker/agents/agent_missing").status_code == 404
+    remote = client.get("/worker/agents/agent_missing", environ_base={"REMOTE_ADDR": "10.1.2.3"})
+    assert remote.status_code == 403
+
+    monkeypatch.setattr(server, "WORKER_TOKEN", "secret")
+    assert client.get("/worker/agents/agent_missing", environ_base={"REMOTE_ADDR": "10.1.2.3"}).status_code == 403
+    assert client.get("/worker/agents/agent_missing", environ_base={"REMOTE_ADDR": "10.1.2.3"},
+                      headers={"X-Worker-Token": "secret"}).status_code == 404
+
+
+def test_artifact_upload_skips_board_files(dispatch):
+    server, agent_id, block_id = dispatch
+    job = server.job_scheduler.submit("develop", {"agent_id": agent_id, "task_info": {}, "block_id": block_id,
+                                                  "marker_id": None}, agent_id=agent_id)
+    leased = server.job_scheduler.lease("worker_1", ["develop"])
+    assert leased["job_id"] == job["job_id"]
+    agent_dir = server.BASE_OUTPUT / "agents" / agent_id
+    server.board_state.flush()
+    board_copy = (agent_dir / "agent_info.json").read_bytes()
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr(f"agents/{agent_id}/agent_info.json", "{}")
+        zf.writestr(f"agents/{agent_id}/checkpoint.json.bak", "{}")
+        zf.writestr(f"agents/{agent_id}/files/index.html", "<html></html>")
+        zf.writestr(f"agents/{agent_id}/checkpoint.json", "{}")
+    response = server.app.test_client().put(f"/worker/jobs/{job['job_id']}/artifacts?worker_id=worker_1",
+                                            data=archive.getvalue())
+    try:
+        assert response.status_code == 200 and response.json["written"] == 2
+        assert (agent_dir / "agent_info.json").read_bytes() == board_copy
+        assert not (agent_dir / "checkpoint.json.bak").exists()
+        assert (agent_dir / "files" / "index.html").is_file()
+    finally:
+        server.job_scheduler.complete(job["job_id"], "worker_1", "cancelled")
+
+
+class FakeLLM:
+    """Answers every prompt with a one-file plan and streams generated files in a few chunks."""
+
+    def generate_sync(self, prompt, **kwargs):
+        return "ARCHITECTURE: one module\nFILES:\n1. main.py - entry point"
+
+    def generate_stream_sync(self, prompt, on_chunk, **kwargs):
+        chunks = ["print(", "'hello'", ")\n"]
+        for chunk in chunks:
+            on_chunk(chunk)
+        return "".join(chunks)
+
+
+def test_streaming_step_reports_progress(dispatch, monkeypatch):
+    server, agent_id, block_id = dispatch
+    import developer_agent
+    monkeypatch.setattr(developer_agent, "llm_service", FakeLLM())
+    monkeypatch.setattr(developer_agent, "PROGRESS_INTERVAL", 0)
+    reports = []
+    monkeypatch.setattr(server.board_state, "set_progress", lambda agent_id, progress=None: reports.append(progress))
+    server.board_state.update_agent(agent_id, state="working", assigned_block_id=block_id)
+
+    agent_dir = server.BASE_OUTPUT / "agents" / agent_id
+    developer_agent.perform_agent_work_and_move(agent_id, agent_dir, {"title": "Hello", "description": ""},
+                                                block_id, None)
+
+    streamed = [p for p in reports if p and p.get("file") == "main.py"]
+    assert [p["bytes"] for p in streamed] == [6, 13, 15]
+    assert streamed[-1]["chunks"] == 3 and streamed[-1]["files_total"] == 1
+    assert reports[-1] is None  # Cleared once the work is over
+    assert server.board_state.get_agent(agent_id)["state"] == "finished_work"
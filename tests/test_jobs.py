@@ -0,0 +1,93 @@
+import threading
+import time
+
+import pytest
+
+import core.jobs
+from core.jobs import CancelToken, JobCancelled, JobScheduler, LeaseLost
+
+
+def test_cancel_token_sleep_ends_on_cancel():
+    token = CancelToken("job_sleep")
+    threading.Timer(0.05, token.cancel, args=("stop",)).start()
+    started = time.monotonic()
+    with pytest.raises(JobCancelled):
+        token.sleep(10)
+    assert time.monotonic() - started < 5
+
+
+def test_cancel_token_sleep_ends_at_deadline():
+    token = CancelToken("job_deadline", deadline=time.time() + 0.05)
+    with pytest.raises(JobCancelled) as cancelled:
+        token.sleep(10)
+    assert cancelled.value.timed_out
+    CancelToken("job_free").sleep(0.01)  # Not cancelled: just returns
+
+
+@pytest.fixture
+def remote_only(monkeypatch):
+    """No local develop workers (as with JOB_CONCURRENCY_DEVELOP=0): jobs wait for a lease."""
+    monkeypatch.setenv("JOB_CONCURRENCY_DEVELOP", "0")
+
+
+def scheduler(jobs_dir):
+    jobs = JobScheduler(jobs_dir)
+    jobs.register("develop", lambda **args: None)
+    return jobs.start()
+
+
+def test_running_job_is_requeued_after_restart(tmp_path, remote_only):
+    before = scheduler(tmp_path)
+    job = before.submit("develop", {"block_id": "block_1"}, agent_id="agent_1")
+    assert before.lease("worker_1", ["develop"])["job_id"] == job["job_id"]
+    assert before.flush()
+
+    # The process stops mid-job; the next one finds it on disk and queues it again
+    after = scheduler(tmp_path)
+    restored = after.get_job(job["job_id"])
+    assert restored["status"] == "queued" and restored["args"] == {"block_id": "block_1"}
+    assert after.lease("worker_2", ["develop"])["job_id"] == job["job_id"]
+
+
+def test_expired_lease_is_requeued(tmp_path, remote_only):
+    jobs = scheduler(tmp_path)
+    job = jobs.submit("develop", {"block_id": "block_1"})
+    jobs.lease("worker_1", ["develop"], lease_seconds=0.01)
+    time.sleep(0.05)
+
+    # The next lease request reaps the expired lease and hands the job out again
+    assert jobs.lease("worker_2", ["develop"])["job_id"] == job["job_id"]
+    with pytest.raises(LeaseLost):
+        jobs.heartbeat(job["job_id"], "worker_1")
+    assert jobs.holds_lease(job["job_id"], "worker_2") is not None
+
+
+def test_slow_disk_does_not_hold_the_scheduler(tmp_path, remote_only, monkeypatch):
+    jobs = scheduler(tmp_path)
+    disk = threading.Event()
+    write = core.jobs.write_json_atomic
+    monkeypatch.setattr(core.jobs, "write_json_atomic", lambda path, data: (disk.wait(5), write(path, data)))
+
+    started = time.monotonic()
+    job = jobs.submit("develop", {"block_id": "block_1"})
+    leased = jobs.lease("worker_1", ["develop"])
+    jobs.heartbeat(job["job_id"], "worker_1")
+    assert leased["job_id"] == job["job_id"] and time.monotonic() - started < 1
+
+    disk.set()
+    assert jobs.flush()
+    assert scheduler(tmp_path).get_job(job["job_id"])["status"] == "queued"
+
+
+def test_queue_order_and_positions(tmp_path, remote_only):
+    jobs = scheduler(tmp_path)
+    low = jobs.submit("develop", {}, priority=0)
+    due_late = jobs.submit("develop", {}, priority=1, deadline=time.time() + 60)
+    due_soon = jobs.submit("develop", {}, priority=1, deadline=time.time() + 10)
+    urgent = jobs.submit("develop", {}, priority=5)
+    jobs.cancel(due_late["job_id"])
+
+    assert [jobs.get_job(j["job_id"])["queue_position"] for j in (urgent, due_soon, low)] == [1, 2, 3]
+    order = [jobs.lease("worker_1", ["develop"])["job_id"] for _ in range(3)]
+    assert order == [urgent["job_id"], due_soon["job_id"], low["job_id"]]
+    assert jobs.lease("worker_1", ["develop"]) is None
@@ -0,0 +1,70 @@
+import json
+
+from conftest import add_agent
+from core.journal import BoardJournal, replay
+from core.state_store import BoardStateStore
+from core.storage import JsonFileStorage
+
+
+def agent_put(seq, agent_id, state):
+    return {"seq": seq, "ts": float(seq), "type": "agent_put", "agent_id": agent_id,
+            "data": {"agent_id": agent_id, "state": state},
+            "transition": {"from": None, "to": state, "agent_type": "developer"}}
+
+
+def board_after(events):
+    state = {"agents": {}, "blocks": {}, "zones": []}
+    replay(state, events)
+    return state
+
+
+def test_snapshot_plus_tail_after_compaction(tmp_path):
+    events = [agent_put(seq, f"agent_{seq}", "idle") for seq in range(1, 9)]
+    journal = BoardJournal(tmp_path, snapshot_every=3)
+    journal.write_snapshot(0, board_after([]))
+    journal.append(events[0:3])
+    journal.write_snapshot(3, board_after(events[:3]))
+    journal.append(events[3:6])
+    journal.write_snapshot(6, board_after(events[:6]))
+    journal.append(events[6:8])
+
+    # events-1 ends before the previous snapshot (seq 3): only its transitions are kept
+    assert sorted(p.name for p in tmp_path.glob("*.jsonl")) == [
+        "events-000000000004.jsonl", "events-000000000007.jsonl", "transitions-000000000001.jsonl"]
+
+    snapshot, tail = BoardJournal(tmp_path).load()
+    assert snapshot["seq"] == 6 and [e["seq"] for e in tail] == [7, 8]
+    state = {"agents": snapshot["agents"], "blocks": snapshot["blocks"], "zones": snapshot["zones"]}
+    replay(state, tail)
+    assert state["agents"] == board_after(events)["agents"]
+
+    # An unreadable newest snapshot falls back to the previous one, whose tail is still there
+    (tmp_path / "snapshot.json").write_text("{torn")
+    snapshot, tail = BoardJournal(tmp_path).load()
+    assert snapshot["seq"] == 3 and [e["seq"] for e in tail] == [4, 5, 6, 7, 8]
+
+    assert [t["seq"] for t in BoardJournal(tmp_path).transitions()] == list(range(1, 9))
+
+
+def test_store_reloads_from_snapshot_and_tail(tmp_path):
+    def open_store():
+        return BoardStateStore(tmp_path, storage=JsonFileStorage(tmp_path),
+                               journal=BoardJournal(tmp_path / "journal", snapshot_every=5)).load()
+
+    board = open_store()
+    for i in range(12):
+        add_agent(board, f"agent_{i:02d}", x=i)
+        board.flush()
+    board.update_agent("agent_03", state="working")
+    expected = {a["agent_id"]: a for a in board.list_agents()}
+    board.close()
+
+    journal_dir = tmp_path / "journal"
+    assert 0 < json.loads((journal_dir / "snapshot.json").read_text())["seq"] < 13
+    assert not (journal_dir / "events-000000000001.jsonl").exists()  # Compacted
+    reloaded = open_store()
+    try:
+        assert {a["agent_id"]: a for a in reloaded.list_agents()} == expected
+        assert reloaded._journal_seq == 13
+    finally:
+        reloaded.close()
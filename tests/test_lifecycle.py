@@ -0,0 +1,30 @@
+import time
+
+from core.lifecycle import AgentLifecycle
+
+
+class FakeBoard:
+    def __init__(self):
+        self.sweeps = 0
+
+    def add_transition_listener(self, listener):
+        pass
+
+    def find_agents(self, state=None):
+        self.sweeps += 1
+        return []
+
+
+def test_sweep_runs_during_steady_transitions(monkeypatch):
+    board = FakeBoard()
+    lifecycle = AgentLifecycle(board, sweep_interval=0.05, workers=1)
+    lifecycle.on_enter("finished_work")(lambda agent_id: None)
+    # A backlog that takes the dispatcher ~0.5s to get through, so its queue never runs dry meanwhile
+    monkeypatch.setattr(lifecycle, "_schedule", lambda agent_id, state: time.sleep(0.002))
+    for _ in range(250):
+        lifecycle._on_transition("agent_1", "working", "finished_work", "developer")
+
+    lifecycle.start()
+    time.sleep(0.3)
+    assert not lifecycle._queue.empty()
+    assert board.sweeps >= 3
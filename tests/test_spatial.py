@@ -0,0 +1,27 @@
+from core.spatial import ZoneOccupancyIndex
+
+
+def zone(zone_id, x, y, **fields):
+    return dict({"id": zone_id, "x": x, "y": y, "width": 100, "height": 100}, **fields)
+
+
+def test_repeated_zone_id_is_indexed_once():
+    index = ZoneOccupancyIndex()
+    index.set_zones([zone("z1", 0, 0), zone("z1", 50, 50)])
+
+    assert index.zones_at(120, 120) == ("z1",)
+    assert index.zones_at(10, 10) == ()
+    assert index.zone_count("finish") == 1
+
+
+def test_resetting_zones_moves_occupants():
+    index = ZoneOccupancyIndex()
+    index.set_zones([zone("z1", 0, 0), zone("z2", 200, 0)])
+    index.move_agent("agent_1", 10, 10)
+    assert index.agent_zone_ids("agent_1") == ("z1",)
+
+    index.set_zones([zone("z1", 200, 0), zone("z2", 200, 0, type="dropoff")])
+    assert index.agent_zone_ids("agent_1") == ()
+    index.move_agent("agent_1", 210, 10)
+    assert index.agent_zone_ids("agent_1") == ("z1", "z2")
+    assert index.open_slots("finish") == [] and index.open_slots("dropoff") == []
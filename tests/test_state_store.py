@@ -0,0 +1,127 @@
+import json
+import time
+
+import pytest
+
+from conftest import add_agent
+from core import state_store, storage
+from core.journal import BoardJournal
+from core.state_store import BoardInUse, BoardStateStore, VersionConflict, update_assigned_agent
+from core.storage import JsonFileStorage
+
+
+def test_update_agent_compare_and_swap(board):
+    agent = add_agent(board, "agent_cas")
+    updated = board.update_agent("agent_cas", expected_version=agent["version"], state="working")
+    assert updated["version"] == agent["version"] + 1
+
+    with pytest.raises(VersionConflict) as conflict:
+        board.update_agent("agent_cas", expected_version=agent["version"], state="error")
+    assert (conflict.value.expected, conflict.value.actual) == (agent["version"], updated["version"])
+    assert board.get_agent("agent_cas")["state"] == "working"
+
+
+def test_update_assigned_agent_applies_to_current_assignment(board):
+    add_agent(board, "agent_dev", state="working", assigned_block_id="block_1")
+
+    agent = update_assigned_agent(board, "agent_dev", {"assigned_block_id": "block_1"}, state="error")
+    assert agent["state"] == "error"
+
+
+def test_update_assigned_agent_leaves_newer_assignment(board):
+    # A job for block_1 fails after the agent was moved on to block_2
+    add_agent(board, "agent_dev", state="working", assigned_block_id="block_2")
+
+    assert update_assigned_agent(board, "agent_dev", {"assigned_block_id": "block_1"}, state="error") is None
+    agent = board.get_agent("agent_dev")
+    assert (agent["state"], agent["assigned_block_id"]) == ("working", "block_2")
+    assert update_assigned_agent(board, "agent_gone", {"assigned_block_id": "block_1"}, state="error") is None
+
+
+def test_update_assigned_agent_conflicts_with_unlocked_write(board, monkeypatch):
+    add_agent(board, "agent_dev", state="working", assigned_block_id="block_1")
+    read = board.get_agent
+
+    def read_then_race(agent_id):
+        # Someone writes without the lock between our read and our update
+        agent = read(agent_id)
+        board.update_agent(agent_id, state="idle")
+        return agent
+
+    monkeypatch.setattr(board, "get_agent", read_then_race)
+    with pytest.raises(VersionConflict):
+        update_assigned_agent(board, "agent_dev", {"assigned_block_id": "block_1"}, state="error")
+    assert read("agent_dev")["state"] == "idle"
+
+
+def test_failed_write_stays_pending(board, monkeypatch):
+    add_agent(board, "agent_disk", x=1)
+    assert board.flush()
+    info_file = board.base_output / "agents" / "agent_disk" / "agent_info.json"
+
+    def disk_full(path, data):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(storage, "write_json_atomic", disk_full)
+    board.update_agent("agent_disk", x=2)
+    assert not board.flush()
+    assert json.loads(info_file.read_text())["x"] == 1
+
+    monkeypatch.undo()
+    assert board.flush()
+    assert json.loads(info_file.read_text())["x"] == 2
+
+
+def test_writer_survives_a_failed_pass(board, monkeypatch):
+    monkeypatch.setattr(state_store, "STORAGE_RETRY_DELAY", 0.01)
+    flush = board.flush
+    passes = []
+
+    def failing_once():
+        passes.append(None)
+        if len(passes) == 1:
+            raise RuntimeError("writer pass failed")
+        return flush()
+
+    monkeypatch.setattr(board, "flush", failing_once)
+    add_agent(board, "agent_writer", x=3)
+    info_file = board.base_output / "agents" / "agent_writer" / "agent_info.json"
+    deadline = time.monotonic() + 5
+    while not info_file.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert board._writer.is_alive()
+    assert json.loads(info_file.read_text())["x"] == 3
+
+
+def test_progress_is_not_versioned(board):
+    agent = add_agent(board, "agent_stream")
+    version, seq = board.version, board._journal_seq
+
+    board.set_progress("agent_stream", {"file": "main.py", "bytes": 120})
+    assert board.get_progress()[1] == {"agent_stream": {"file": "main.py", "bytes": 120}}
+    assert board.version == version and board._journal_seq == seq
+    assert board.get_agent("agent_stream")["version"] == agent["version"]
+
+    progress_version = board.get_progress()[0]
+    board.set_progress("agent_stream", None)
+    assert board.get_progress() == (progress_version + 1, {})
+    board.set_progress("agent_unknown", {"bytes": 1})
+    assert board.get_progress()[1] == {}
+
+
+def test_second_store_on_the_same_board_is_refused(board, tmp_path):
+    add_agent(board, "agent_1")
+
+    def second_store():
+        return BoardStateStore(tmp_path, storage=JsonFileStorage(tmp_path), journal=BoardJournal(tmp_path / "journal"))
+
+    with pytest.raises(BoardInUse):
+        second_store().load()
+    assert board.update_agent("agent_1", state="working")["state"] == "working"
+
+    board.close()
+    reopened = second_store().load()
+    try:
+        assert reopened.get_agent("agent_1")["state"] == "working"
+    finally:
+        reopened.close()
@@ -0,0 +1,376 @@
+"""
+worker.py
+
+Runs developer and QA jobs for a board server from another machine (or another
+process on the same one), so LLM-heavy work isn't limited to the server's own
+worker pool.
+
+A worker leases the most urgent queued job over HTTP, downloads the agent's
+workspace, runs the same pipeline the server would (perform_agent_work_and_move /
+perform_qa_work) and uploads the files it produced. While a job runs the worker
+renews its lease with heartbeats; the server answers with whether the job was
+cancelled, and re-queues it if the heartbeats stop (worker crashed or lost the
+network). Agent state updates made by the pipeline are forwarded to the server,
+which stays the only writer of the board.
+
+    python worker.py --server http://board-host:5000 --types develop qa --concurrency 2
+
+Set WORKER_TOKEN to the server's value when it requires one. LLM API keys are
+read from the worker's own environment / .env, as on the server.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from pathlib import Path
+
+from core.jobs import CancelToken, JobCancelled, LeaseLost, cancel_scope, current_cancel_token
+from core.state_store import VersionConflict, set_board_state
+from core.workspace import pack_workspace, unpack_workspace, workspace_paths
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_DIR = Path("output")  # Relative to the worker's work directory, as on the server
+AGENTS_DIR = OUTPUT_DIR / "agents"
+
+# Seconds a lease request waits on the server for a job
+LEASE_WAIT = 20
+# Seconds between retries while the server is unreachable
+RETRY_DELAY = 5
+# Seconds an ordinary request to the server may take
+REQUEST_TIMEOUT = 30
+# Agent states that end a job; the workspace is uploaded before they reach the server
+TERMINAL_STATES = ("finished_work", "finished_qa_work", "error")
+
+
+class BoardClient:
+    """JSON over HTTP to the board server's /worker/... endpoints."""
+
+    def __init__(self, server: str, worker_id: str, token: str = None):
+        self.server = server.rstrip("/")
+        self.worker_id = worker_id
+        self.token = token
+
+    def _request(self, method: str, path: str, body=None, data: bytes = None,
+                 content_type: str = "application/json", timeout: float = REQUEST_TIMEOUT):
+        """Returns (status, payload bytes). Non-2xx answers are returned, not raised; network errors raise OSError."""
+        if body is not None:
+            data = json.dumps(body).encode("utf-8")
+        req = urllib.request.Request(self.server + path, data=data, method=method)
+        if data is not None:
+            req.add_header("Content-Type", content_type)
+        if self.token:
+            req.add_header("X-Worker-Token", self.token)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    @staticmethod
+    def _json(payload: bytes):
+        try:
+            return json.loads(payload or b"{}")
+        except ValueError:
+            return {"error": payload.decode("utf-8", "replace")}
+
+    def _check(self, status: int, payload: bytes, what: str):
+        if status >= 400:
+            raise RuntimeError(f"{what} failed ({status}): {self._json(payload).get('error')}")
+        return self._json(payload)
+
+    def lease(self, job_types, wait: float = LEASE_WAIT):
+        """(job, lease_seconds), or (None, None) when no job turned up in time."""
+        status, payload = self._request("POST", "/worker/lease",
+                                        {"worker_id": self.worker_id, "types": list(job_types), "wait": wait},
+                                        timeout=wait + REQUEST_TIMEOUT)
+        if status == 204:
+            return None, None
+        body = self._check(status, payload, "Lease")
+        return body["job"], body["lease_seconds"]
+
+    def heartbeat(self, job_id: str) -> dict:
+        status, payload = self._request("POST", f"/worker/jobs/{job_id}/heartbeat", {"worker_id": self.worker_id})
+        if status == 409:
+            raise LeaseLost(job_id, self.worker_id)
+        return self._check(status, payload, "Heartbeat")
+
+    def complete(self, job_id: str, status: str, error: str = None) -> dict:
+        code, payload = self._request("POST", f"/worker/jobs/{job_id}/complete",
+                                      {"worker_id": self.worker_id, "status": status, "error": error})
+        if code == 409:
+            raise LeaseLost(job_id, self.worker_id)
+        return self._check(code, payload, "Completing job")
+
+    def get_agent(self, agent_id: str):
+        status, payload = self._request("GET", f"/worker/agents/{agent_id}")
+        if status == 404:
+            return None
+        return self._check(status, payload, f"Reading agent {agent_id}")
+
+    def update_agent(self, agent_id: str, job_id: str, expected_version, fields: dict):
+        status, payload = self._request("POST", f"/worker/agents/{agent_id}/update",
+                                        {"worker_id": self.worker_id, "job_id": job_id,
+                                         "expected_version": expected_version, "fields": fields})
+        if status == 404:
+            return None
+        if status == 409:
+            body = self._json(payload)
+            if "current_version" in body:
+                raise VersionConflict(agent_id, expected_version, body["current_version"])
+            raise LeaseLost(job_id, self.worker_id)
+        return self._check(status, payload, f"Updating agent {agent_id}")
+
+    def set_progress(self, agent_id: str, job_id: str, progress):
+        status, payload = self._request("POST", f"/worker/agents/{agent_id}/progress",
+                                        {"worker_id": self.worker_id, "job_id": job_id, "progress": progress})
+        if status == 409:
+            raise LeaseLost(job_id, self.worker_id)
+        return self._check(status, payload, f"Reporting progress of agent {agent_id}")
+
+    def download_workspace(self, agent_id: str):
+        """The agent's workspace archive, or None if the agent no longer exists."""
+        status, payload = self._request("GET", f"/worker/agents/{agent_id}/workspace")
+        if status == 404:
+            return None
+        if status >= 400:
+            self._check(status, payload, f"Downloading workspace of {agent_id}")
+        return payload
+
+    def upload_artifacts(self, job_id: str, archive: bytes) -> dict:
+        status, payload = self._request("PUT", f"/worker/jobs/{job_id}/artifacts?worker_id={self.worker_id}",
+                                        data=archive, content_type="application/zip")
+        if status == 409:
+            raise LeaseLost(job_id, self.worker_id)
+        return self._check(status, payload, "Uploading artifacts")
+
+
+class RemoteBoardState:
+    """
+    The part of BoardStateStore the pipelines use, answered by the board server.
+    Installed with set_board_state(), so the unchanged pipelines report through it.
+    Updates are made as the job running on the calling thread (current_cancel_token()).
+    """
+
+    def __init__(self, client: BoardClient):
+        self.client = client
+        self._jobs = {}  # job_id -> job record, for jobs running here
+        self._uploaded = set()  # job_ids whose artifacts already reached the server
+        self._lock = threading.Lock()
+
+    def begin(self, job: dict):
+        with self._lock:
+            self._jobs[job["job_id"]] = job
+
+    def end(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+            self._uploaded.discard(job_id)
+
+    def has_agent(self, agent_id: str) -> bool:
+        return self.client.get_agent(agent_id) is not None
+
+    def get_agent(self, agent_id: str):
+        return self.client.get_agent(agent_id)
+
+    def agent_lock(self, agent_id: str, timeout: float = None):
+        # The server applies each update under the agent's lock; stale reads surface as VersionConflict
+        return contextlib.nullcontext()
+
+    def update_agent(self, agent_id: str, expected_version: int = None, **fields):
+        token = current_cancel_token()
+        if token is None:
+            raise RuntimeError(f"Update of agent {agent_id} outside a leased job")
+        if fields.get("state") in TERMINAL_STATES:
+            # The server's lifecycle hooks act on the new state right away; the files must be there first
+            self.upload(token.job_id, extra_paths=[p for p in [fields.get("output_zip_path")] if p])
+        return self.client.update_agent(agent_id, token.job_id, expected_version, fields)
+
+    def set_progress(self, agent_id: str, progress: dict = None):
+        token = current_cancel_token()
+        if token is None:
+            raise RuntimeError(f"Progress of agent {agent_id} outside a leased job")
+        self.client.set_progress(agent_id, token.job_id, progress)
+
+    def upload(self, job_id: str, extra_paths=(), force: bool = False):
+        """Sends the job's workspace (and `extra_paths`, relative to the work directory) to the server once."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or (job_id in self._uploaded and not force):
+                return
+        archive = pack_workspace(OUTPUT_DIR, job["agent_id"], job_artifact_paths(job, extra_paths))
+        result = self.client.upload_artifacts(job_id, archive)
+        with self._lock:
+            self._uploaded.add(job_id)
+        logger.info(f"Uploaded {result.get('written')} file(s) for job {job_id}")
+
+    def uploaded(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._uploaded
+
+
+def job_artifact_paths(job: dict, extra_paths=()) -> list:
+    """
+    Paths (relative to OUTPUT_DIR) to upload besides the job's own workspace: `extra_paths`
+    given relative to the work directory, and for QA jobs the developer files it corrected.
+    """
+    paths = []
+    for path in extra_paths:
+        relative = os.path.relpath(path, OUTPUT_DIR)
+        if not relative.startswith(".."):
+            paths.append(Path(relative).as_posix())
+    if job["type"] == "qa":
+        files_dir = AGENTS_DIR / job["args"]["developer_agent_id"] / "files"
+        if files_dir.is_dir():
+            paths.extend(p.relative_to(OUTPUT_DIR).as_posix() for p in sorted(files_dir.rglob("*")) if p.is_file())
+    return paths
+
+
+def job_agents(job: dict) -> list:
+    """Agents whose workspaces a job reads: its own, plus the reviewed developer's for QA."""
+    if job["type"] == "qa":
+        return [job["args"]["qa_agent_id"], job["args"]["developer_agent_id"]]
+    return [job["agent_id"]]
+
+
+def fetch_workspace(client: BoardClient, agent_id: str) -> bool:
+    """Replaces the local copy of an agent's workspace with the server's. False if the agent is gone."""
+    archive = client.download_workspace(agent_id)
+    if archive is None:
+        return False
+    agent_dir = AGENTS_DIR / agent_id
+    shutil.rmtree(agent_dir, ignore_errors=True)
+    agent_dir.mkdir(parents=True, exist_ok=True)
+    unpack_workspace(OUTPUT_DIR, archive, workspace_paths(agent_id))
+    return True
+
+
+def keep_lease(client: BoardClient, job_id: str, token: CancelToken, interval: float, done: threading.Event):
+    """Heartbeats until `done`; cancels the job when the server did or the lease is gone."""
+    while not done.wait(interval):
+        try:
+            reply = client.heartbeat(job_id)
+        except LeaseLost:
+            logger.warning(f"Lost the lease on job {job_id}; stopping it")
+            token.cancel("lease lost")
+            return
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"Heartbeat for job {job_id} failed: {e}")
+            continue
+        if reply.get("cancelled"):
+            token.cancel(reply.get("reason") or "cancelled")
+
+
+def run_job(client: BoardClient, board: RemoteBoardState, handlers: dict, job: dict, lease_seconds: float):
+    job_id = job["job_id"]
+    token = CancelToken(job_id, job.get("deadline_at"))
+    done = threading.Event()
+    threading.Thread(target=keep_lease, args=(client, job_id, token, max(lease_seconds / 3, 1), done),
+                     name=f"heartbeat-{job_id}", daemon=True).start()
+    board.begin(job)
+    status, error = "done", None
+    try:
+        if not all(fetch_workspace(client, agent_id) for agent_id in job_agents(job)):
+            logger.warning(f"Skipping {job['type']} job {job_id}: agent deleted")
+            return finish_job(client, board, job_id, "done", None, upload=False)
+        logger.info(f"Running {job['type']} job {job_id} for {job['agent_id']}")
+        with cancel_scope(token):
+            try:
+                handlers[job["type"]](**job["args"])
+            except JobCancelled as e:
+                logger.warning(f"{job['type']} job {job_id} stopped: {e.reason}")
+                status, error = ("timed_out" if e.timed_out else "cancelled"), e.reason
+            except Exception as e:
+                logger.error(f"{job['type']} job {job_id} failed: {e}", exc_info=True)
+                status, error = "failed", str(e)
+        finish_job(client, board, job_id, status, error)
+    except (OSError, RuntimeError) as e:
+        logger.error(f"Job {job_id} could not be run: {e}")
+        finish_job(client, board, job_id, "failed", str(e), upload=False)
+    finally:
+        done.set()
+        board.end(job_id)
+
+
+def finish_job(client: BoardClient, board: RemoteBoardState, job_id: str, status: str, error, upload: bool = True):
+    try:
+        if upload and not board.uploaded(job_id):
+            board.upload(job_id)
+        client.complete(job_id, status, error)
+        logger.info(f"Job {job_id} {status}")
+    except LeaseLost:
+        logger.warning(f"Job {job_id} was handed to another worker; dropping this result")
+    except (OSError, RuntimeError) as e:
+        logger.error(f"Could not report job {job_id} ({status}): {e}; its lease will expire and it re-runs")
+
+
+def worker_slot(client: BoardClient, board: RemoteBoardState, handlers: dict, job_types):
+    """One job at a time, forever."""
+    while True:
+        try:
+            job, lease_seconds = client.lease(job_types)
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"Board server unreachable ({e}); retrying in {RETRY_DELAY}s")
+            time.sleep(RETRY_DELAY)
+            continue
+        if job is not None:
+            run_job(client, board, handlers, job, lease_seconds)
+
+
+def load_handlers() -> dict:
+    """The pipelines, imported once the work directory is set (they write under ./output)."""
+    from developer_agent import perform_agent_work_and_move
+    from qa_agent import perform_qa_work
+
+    def develop(agent_id, task_info, block_id, marker_id, use_cache=True):
+        perform_agent_work_and_move(agent_id, AGENTS_DIR / agent_id, task_info, block_id, marker_id, use_cache=use_cache)
+
+    def qa(qa_agent_id, developer_agent_id, use_cache=True):
+        perform_qa_work(qa_agent_id, AGENTS_DIR / qa_agent_id, developer_agent_id, str(AGENTS_DIR / developer_agent_id),
+                        use_cache=use_cache)
+
+    return {"develop": develop, "qa": qa}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Run developer / QA jobs for a CompanyRTS board server.")
+    parser.add_argument("--server", default=os.getenv("BOARD_SERVER", "http://localhost:5000"),
+                        help="Board server URL (default: $BOARD_SERVER or http://localhost:5000)")
+    parser.add_argument("--types", nargs="+", choices=["develop", "qa"], default=["develop", "qa"],
+                        help="Job types to take (default: both)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Jobs run at once (default: 1)")
+    parser.add_argument("--worker-id", default=None, help="Name shown in the server's jobs (default: host-pid-random)")
+    parser.add_argument("--workdir", default=None, help="Where workspaces are kept (default: worker_data/<worker-id>)")
+    args = parser.parse_args()
+
+    worker_id = args.worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:4]}"
+    workdir = Path(args.workdir or Path("worker_data") / worker_id).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(workdir)
+
+    client = BoardClient(args.server, worker_id, token=os.getenv("WORKER_TOKEN"))
+    board = RemoteBoardState(client)
+    set_board_state(board)
+    handlers = load_handlers()
+    from llm_service import get_llm_service
+    get_llm_service().warm_up()
+
+    logger.info(f"Worker {worker_id} taking {', '.join(args.types)} jobs from {args.server} "
+                f"({args.concurrency} at a time, workspaces in {workdir})")
+    for slot in range(max(args.concurrency, 1)):
+        threading.Thread(target=worker_slot, args=(client, board, handlers, args.types),
+                         name=f"worker-slot-{slot}", daemon=True).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        logger.info(f"Worker {worker_id} stopping; unfinished jobs are re-queued when their leases expire")